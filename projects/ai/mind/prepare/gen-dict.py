@@ -14,43 +14,29 @@ from __future__ import print_function
 
 import sys 
 import os
-from tqdm import tqdm
 import gezi
 
-uid_vocab = gezi.WordCounter()
-did_vocab = gezi.WordCounter()
-
-uid_vocab2 = gezi.WordCounter()
-did_vocab2 = gezi.WordCounter()
-
-  
 files = [
   '../input/big/train/behaviors.tsv',
   '../input/big/dev/behaviors.tsv',
   '../input/big/test/behaviors.tsv'
   ]
 
-for file in files:
-  total = len(open(file).readlines())
-  for line in tqdm(open(file), total=total):
-    l = line.strip('\nt').split('\t')
-    uid = l[1]
-    uid_vocab.add(uid)
-    if 'train' in file:
-      uid_vocab2.add(uid)
-    dids, dids2 = l[-2], l[-1]
-    for did in dids.split():
-      did_vocab.add(did)
-      if 'train' in file:
-        did_vocab2.add(did)
-    for did in dids2.split():
-      did = did.split('-')[0]
-      did_vocab.add(did)
-      if 'train' in file:
-        did_vocab2.add(did)
+def parse(line, file):
+  l = line.strip('\nt').split('\t')
+  uids = [l[1]]
+  dids, dids2 = l[-2], l[-1]
+  dids = dids.split() + [did.split('-')[0] for did in dids2.split()]
+  res = {'uid': uids, 'did': dids}
+  if 'train' in file:
+    res.update({'uid2': uids, 'did2': dids})
+  return res
+
+# files are split by byte ranges and counted in all cores
+counters = gezi.count_files(files, parse, names=['uid', 'did', 'uid2', 'did2'], with_file=True)
 
-uid_vocab.save('../input/big/uid.txt')
-did_vocab.save('../input/big/did.txt')
+counters['uid'].save('../input/big/uid.txt')
+counters['did'].save('../input/big/did.txt')
 
-uid_vocab2.save('../input/big/train/uid.txt')
-did_vocab2.save('../input/big/train/did.txt')
\ No newline at end of file
+counters['uid2'].save('../input/big/train/uid.txt')
+counters['did2'].save('../input/big/train/did.txt')
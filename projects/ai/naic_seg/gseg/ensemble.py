@@ -16,6 +16,7 @@ import sys
 import os
 
 import glob
+from multiprocessing import cpu_count
 import numpy as np
 import cv2
 
@@ -24,6 +25,7 @@ import tensorflow as tf
 import gezi
 from gezi import logging, tqdm
 import melt as mt
+from gezi.metrics.image.semantic_seg import Evaluator
 
 from .evaluate import ImageEvaluator
 from .util import *
@@ -47,7 +49,7 @@ class EnsembleDataset(mt.Dataset):
     f['pred'] = tf.cast(f['pred'], tf.float32)
 
     if self.subset == 'valid':
-      f['mask'] = tf.reshape(tf.io.decode_raw(f['pred'], tf.uint16), (*FLAGS.image_size))
+      f['mask'] = tf.reshape(tf.io.decode_raw(f['pred'], tf.uint16), (*FLAGS.image_size,))
     else:
       f['mask'] = tf.zeros_like(f['id'])
 
@@ -116,50 +118,103 @@ def ensemble_tfrec(dirs, mode='test', outdir=None, num_images=None, display_resu
       pass
     # break
 
+def _accumulate(ctx, image_id, out=None):
+  """Weighted sum of memory-mapped model scores, chunk_rows rows at a time into one float32 [H, W, C] buffer"""
+  chunk_rows = ctx['chunk_rows']
+  tmp = None
+  for i, (dir_, weight) in enumerate(zip(ctx['dirs'], ctx['weights'])):
+    pred, scale = load_pred(f'{dir_}/{image_id}.npy')
+    if out is None or out.shape != pred.shape:
+      out = np.empty(pred.shape, dtype=np.float32)
+    for start in range(0, len(pred), chunk_rows):
+      rows = out[start:start + chunk_rows]
+      if i == 0:
+        np.multiply(pred[start:start + chunk_rows], np.float32(weight * scale), out=rows, casting='unsafe')
+      else:
+        if tmp is None or tmp.shape != rows.shape:
+          tmp = np.empty_like(rows)
+        np.multiply(pred[start:start + chunk_rows], np.float32(weight * scale), out=tmp, casting='unsafe')
+        rows += tmp
+  return out
+
+def _read_label(ctx, image_id):
+  label = cv2.imread(f'{ctx["label_dir"]}/{image_id}.png', cv2.IMREAD_UNCHANGED)
+  return (label / 100 - 1).astype(np.int32)
+
+def _ensemble_one(image_id):
+  """Returns (image_id, confusion matrix or None), test mode writes the submit png here"""
+  # dirs, weights and label paths are inherited by fork
+  ctx = gezi.fork_ctx()
+  ctx['buf'] = _accumulate(ctx, image_id, ctx.get('buf'))
+  pred = to_pred(ctx['buf'][np.newaxis])[0]
+  if ctx['label_dir']:
+    return image_id, ctx['evaluator']._generate_matrix(_read_label(ctx, image_id), pred)
+  cv2.imwrite(f'{ctx["outdir"]}/{image_id}.png', to_submit(pred))
+  return image_id, None
+
 # ensemble from numpy files
-def ensemble_npy(dirs, label_dir=None, outdir=None, num_images=None, display_results=True):
+def ensemble_npy(dirs, label_dir=None, outdir=None, num_images=None, display_results=True,
+                 weights=None, num_workers=None, chunk_rows=64):
+  """
+  dirs: model dirs of per image [H, W, C] .npy scores (write_inter_results, uint8 quantized or float16),
+  files are memory-mapped and summed in place with normalized weights (default equal),
+  so memory is one float32 score map per worker whatever the number of models.
+  Images run in num_workers forked processes (default all cores), valid mode merges the
+  per image confusion matrices into one Evaluator as they finish,
+  display_results (tensorboard best/worst images) needs the scores so only with num_workers 1.
+  """
   key_metric = 'FWIoU'
   res = {}
   dir_ = dirs[0]
   mode = 'valid' if label_dir else 'test'
-  files = glob.glob(f'{dir_}/*.npy')
+  files = sorted(glob.glob(f'{dir_}/*.npy'))
   image_ids = [os.path.basename(file).split('.')[0] for file in files]
   if num_images:
     image_ids = image_ids[:num_images]
-  logging.info('Num image ids:', len(image_ids))
+  logging.info('Num image ids:', len(image_ids), 'num models:', len(dirs))
+  weights = np.ones(len(dirs)) if weights is None else np.asarray(weights, dtype=np.float64)
+  assert len(weights) == len(dirs)
+  weights = weights / weights.sum()
+  num_workers = max(min(num_workers or cpu_count(), len(image_ids)), 1)
+
+  # workers count single images, no threads needed
+  evaluator = Evaluator(FLAGS.CLASSES, num_workers=1)
   if mode == 'valid':
     image_dir = os.path.dirname(label_dir) + '/image'
-    evaluator = ImageEvaluator(len(image_ids), display_results=display_results)
+    display_results = display_results and num_workers == 1
+    if display_results:
+      image_evaluator = ImageEvaluator(len(image_ids), display_results=display_results)
   else:
-    assert out_dir
-    out_dir = out_dir + '/results'
-    gezi.try_mkdir(out_dir)
-
-  t = tqdm(image_ids, total=len(image_ids), desc=f'ensemble_{mode}', ascii=True)
-  for image_id in t:
-    if mode == 'valid':
-      label = cv2.imread(f'{label_dir}/{image_id}.png', cv2.IMREAD_UNCHANGED)
-      label = label / 100 - 1
+    assert outdir
+    outdir = outdir + '/results'
+    gezi.try_mkdir(outdir)
+    display_results = False
+
+  ctx = dict(dirs=dirs, weights=weights, label_dir=label_dir, outdir=outdir,
+             chunk_rows=chunk_rows, evaluator=evaluator)
+
+  t = tqdm(total=len(image_ids), desc=f'ensemble_{mode}', ascii=True)
+  if display_results:
+    for image_id in image_ids:
+      pred = _accumulate(ctx, image_id, ctx.get('buf'))
+      ctx['buf'] = pred
       image = cv2.imread(f'{image_dir}/{image_id}.tif', cv2.IMREAD_UNCHANGED)
-    
-    preds = []
-    for dir_ in dirs:
-      preds.append(np.load(f'{dir_}/{image_id}.npy').astype(np.float32))
-    
-    preds = np.stack(preds, axis=0)
-    pred = np.mean(preds, axis=0)
-
-    if mode == 'valid':
-      evaluator(image_id, image, label, pred)
-      res = evaluator.eval_once()
-      t.set_postfix({key_metric: res[key_metric]})
-    else:
-      mask = np.mean(pred, axis=-1)
-      mask = to_submit(mask)
-      cv2.imwrite(outdir + f'/{id}.png', mask)
+      # pred is the reused buffer, the evaluator keeps best/worst images
+      image_evaluator(image_id, image, _read_label(ctx, image_id), pred.copy())
+      evaluator = image_evaluator.evaluator
+      t.set_postfix({key_metric: evaluator.eval_once(key_metric)})
+      t.update()
+  else:
+    for image_id, cm in gezi.fork_map(_ensemble_one, image_ids, ctx, num_workers, ordered=False, chunksize=4):
+      if cm is not None:
+        evaluator.merge(cm)
+        t.set_postfix({key_metric: evaluator.eval_once(key_metric)})
+      t.update()
+  t.close()
     
   if mode == 'valid':
-    res.update(evaluator.eval_once())
+    res = evaluator.eval_once()
     gezi.pprint_dict(res)
-    evaluator.finalize()
-  
+    if display_results:
+      image_evaluator.finalize()
+  return res
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   tiling.py
+#        \author   chenghuige
+#          \date   2021-10-17 10:12:36.281039
+#   \Description   Sliding window tiled inference for large images, numpy only
+#                  (no gseg/tf imports) so it can be zipped with infer/v*
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import time
+
+import numpy as np
+
+def _starts(size, tile, stride):
+  """Window starts covering [0, size), the last window aligned to the end, size >= tile"""
+  starts = list(range(0, size - tile, stride)) + [size - tile]
+  return np.asarray(starts, dtype=np.int64)
+
+
+def blend_weights(tile_size, overlap, mode='gaussian'):
+  """[th, tw] blending weights, gaussian (sigma tile / 8) or linear ramp over the overlap, or none"""
+  th, tw = tile_size
+  if mode == 'gaussian':
+    def _window(n):
+      x = np.arange(n) - (n - 1) / 2.
+      return np.exp(-x ** 2 / (2 * (n / 8.) ** 2))
+  elif mode == 'linear':
+    def _window(n):
+      ramp = max(int(n * overlap), 1)
+      x = np.minimum(np.arange(n) + 1, np.arange(n)[::-1] + 1)
+      return np.minimum(x / ramp, 1.)
+  else:
+    def _window(n):
+      return np.ones(n)
+  w = np.outer(_window(th), _window(tw)).astype(np.float32)
+  return np.maximum(w / w.max(), 1e-3)
+
+
+class TiledPredictor(object):
+  """
+  predict_fn: [b, th, tw, c] float32 -> [b, th, tw, num_classes] scores (model.predict or tflite/onnx wrapper)
+  Any image size, windows overlap by overlap ratio and scores are blended by weights,
+  tiles are gathered batch by batch from a strided view of the (maybe memory-mapped) image,
+  tta flips ('hflip', 'vflip') are predicted in the same batch.
+  stream() emits finished rows, memory is bounded by a few tile rows of scores.
+  """
+  def __init__(self, predict_fn, tile_size=(256, 256), overlap=0.25, batch_size=4,
+               blend='gaussian', tta=(), pad_mode='reflect'):
+    self.predict_fn = predict_fn
+    self.tile_size = tuple(tile_size)
+    self.overlap = overlap
+    self.strides = tuple(max(int(size * (1. - overlap)), 1) for size in self.tile_size)
+    self.batch_size = batch_size
+    # None means uniform weights
+    self.weights = blend_weights(self.tile_size, overlap, blend) if overlap > 0 and blend != 'none' else None
+    self.tta = tuple(tta)
+    self.pad_mode = pad_mode
+
+  def _predict(self, tiles):
+    b = len(tiles)
+    if not self.tta:
+      return self.predict_fn(tiles)
+    batch = np.empty((b * (len(self.tta) + 1),) + tiles.shape[1:], dtype=tiles.dtype)
+    batch[:b] = tiles
+    for i, aug in enumerate(self.tta):
+      batch[(i + 1) * b: (i + 2) * b] = tiles[:, :, ::-1] if aug == 'hflip' else tiles[:, ::-1]
+    preds = np.asarray(self.predict_fn(batch))
+    pred = preds[:b].astype(np.float32)
+    for i, aug in enumerate(self.tta):
+      pred_ = preds[(i + 1) * b: (i + 2) * b]
+      pred += pred_[:, :, ::-1] if aug == 'hflip' else pred_[:, ::-1]
+    return pred / (len(self.tta) + 1)
+
+  def stream(self, image):
+    """Yields (y0, y1, scores) with scores [y1 - y0, W, num_classes] rows in order, scores is a reused buffer"""
+    height, width = image.shape[:2]
+    th, tw = self.tile_size
+    # images smaller than the tile are padded, only the covered area is emitted
+    pad_h, pad_w = max(th - height, 0), max(tw - width, 0)
+    if pad_h or pad_w:
+      image = np.pad(image, ((0, pad_h), (0, pad_w), (0, 0)), mode=self.pad_mode)
+    full_height, full_width = image.shape[:2]
+
+    ys = _starts(full_height, th, self.strides[0])
+    xs = _starts(full_width, tw, self.strides[1])
+    # [H - th + 1, W - tw + 1, th, tw, C] read only view of all windows, no copy
+    s0, s1, s2 = image.strides
+    windows = np.lib.stride_tricks.as_strided(image, (full_height - th + 1, full_width - tw + 1, th, tw, image.shape[2]),
+                                              (s0, s1, s0, s1, s2), writeable=False)
+    tile_ys = np.repeat(ys, len(xs))
+    tile_xs = np.tile(xs, len(ys))
+    num_tiles = len(tile_ys)
+
+    # score rows [acc_y, acc_y + len(acc)), tall enough for the tile rows of any batch
+    starts = np.arange(0, num_tiles, self.batch_size)
+    ends = np.minimum(starts + self.batch_size, num_tiles) - 1
+    buf_height = int((tile_ys[ends] - tile_ys[starts]).max()) + th
+    acc, acc_w = None, np.zeros((buf_height, full_width), dtype=np.float32)
+    acc_y = 0
+    for start in range(0, num_tiles, self.batch_size):
+      end = min(start + self.batch_size, num_tiles)
+      tiles = windows[tile_ys[start:end], tile_xs[start:end]].astype(np.float32, copy=False)
+      preds = self._predict(tiles)
+      if acc is None:
+        acc = np.zeros((buf_height, full_width, preds.shape[-1]), dtype=np.float32)
+      for i in range(end - start):
+        y, x = tile_ys[start + i] - acc_y, tile_xs[start + i]
+        if self.weights is None:
+          acc[y:y + th, x:x + tw] += preds[i]
+          acc_w[y:y + th, x:x + tw] += 1.
+        else:
+          acc[y:y + th, x:x + tw] += preds[i] * self.weights[..., None]
+          acc_w[y:y + th, x:x + tw] += self.weights
+
+      # rows above the next tile row are final
+      next_y = tile_ys[end] if end < num_tiles else full_height
+      if next_y > acc_y:
+        n = next_y - acc_y
+        m = min(next_y, height) - acc_y
+        if m > 0:
+          rows = acc[:m, :width]
+          np.multiply(rows, (1. / acc_w[:m, :width])[..., None], out=rows)
+          yield acc_y, acc_y + m, rows
+        # shift unfinished (overlapped) rows to the top
+        rest = max(buf_height - n, 0)
+        acc[:rest] = acc[n:n + rest]
+        acc[rest:] = 0.
+        acc_w[:rest] = acc_w[n:n + rest]
+        acc_w[rest:] = 0.
+        acc_y = next_y
+
+  def predict(self, image, out=None, argmax=False):
+    """Returns [H, W, num_classes] scores or [H, W] labels if argmax, out can be a (memory-mapped) buffer"""
+    for y0, y1, rows in self.stream(image):
+      if out is None:
+        shape = image.shape[:2] if argmax else image.shape[:2] + rows.shape[-1:]
+        out = np.empty(shape, dtype=np.uint8 if argmax else np.float32)
+      out[y0:y1] = rows.argmax(-1) if argmax else rows
+    return out
+
+  def num_tiles(self, height, width):
+    th, tw = self.tile_size
+    return len(_starts(max(height, th), th, self.strides[0])) * len(_starts(max(width, tw), tw, self.strides[1]))
+
+
+def _naive_predict(predict_fn, image, tile_size, pad_size, batch_size):
+  # list of tiles then copy back one tile at a time, as infer/v4 overlap_tile_predict
+  height, width = image.shape[:2]
+  padded = np.pad(image, ((pad_size, pad_size), (pad_size, pad_size), (0, 0)), mode='reflect')
+  tiles = []
+  for y in range(0, height, tile_size):
+    for x in range(0, width, tile_size):
+      tiles.append(padded[y:y + tile_size + 2 * pad_size, x:x + tile_size + 2 * pad_size])
+  score_map = None
+  for i in range(0, len(tiles), batch_size):
+    res = predict_fn(np.asarray(tiles[i: i + batch_size]))
+    if score_map is None:
+      score_map = np.zeros((height, width, res.shape[-1]), dtype=np.float32)
+    for j in range(len(res)):
+      y, x = divmod(i + j, width // tile_size)
+      score_map[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size] = \
+        res[j][pad_size:pad_size + tile_size, pad_size:pad_size + tile_size]
+  return score_map
+
+
+def benchmark(image_size=2048, tile_sizes=(256, 512), num_classes=10, batch_size=4, repeat=3):
+  """Tiling and blending overhead with a cheap 1x1 projection as model"""
+  rng = np.random.default_rng(0)
+  image = rng.random((image_size, image_size, 3), dtype=np.float32)
+  proj = rng.random((3, num_classes), dtype=np.float32)
+  predict_fn = lambda x: x @ proj
+  for tile_size in tile_sizes:
+    t = time.time()
+    for _ in range(repeat):
+      _naive_predict(predict_fn, image, tile_size, 0, batch_size)
+    naive = (time.time() - t) / repeat
+    for overlap, blend, tta in [(0., 'none', ()), (0.25, 'gaussian', ()), (0.25, 'linear', ()), (0.25, 'gaussian', ('hflip', 'vflip'))]:
+      predictor = TiledPredictor(predict_fn, (tile_size, tile_size), overlap, batch_size, blend, tta)
+      t = time.time()
+      for _ in range(repeat):
+        predictor.predict(image)
+      elapsed = (time.time() - t) / repeat
+      print(f'tile:{tile_size} overlap:{overlap} blend:{blend} tta:{len(tta)} tiles:{predictor.num_tiles(image_size, image_size)}',
+            f'{elapsed:.3f}s naive:{naive:.3f}s')
+
+
+if __name__ == '__main__':
+  benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2048)
@@ -30,39 +30,30 @@ import melt as mt
 import gezi
 from gezi import tqdm
 
+def read_records(record_file):
+  for item in tf.data.TFRecordDataset(record_file):
+    yield mt.decode_example(item)
+
+def parse(x):
+  title = gezi.decode(x['title'])[0]
+  asr = gezi.decode(x['asr_text'])[0]
+  title_words = list(jieba.cut(title))
+  asr_words = list(jieba.cut(asr))
+  return {'word': title_words + asr_words, 'title': title_words, 'asr': asr_words}
+
 def main(_):
-  word_counter = gezi.WordCounter()
-  title_counter = gezi.WordCounter()
-  asr_counter = gezi.WordCounter()
-  
-  record_files = []
   dirs = ['../input/pointwise', '../input/pairwise', '../input/test_a/', '../input/test_b']
-  tdirs = tqdm(dirs)
-  for dir in tdirs:
-    ids = []
-    tdirs.set_postfix({'dir': dir})
-    record_files = gezi.list_files(f'{dir}/*.tfrecords')
-    ic(record_files)
-    t = tqdm(record_files)
-    for record_file in t:
-      t.set_postfix({'file': record_file})
-      for i, item in enumerate(tf.data.TFRecordDataset(record_file)):
-        x = mt.decode_example(item)
-        title = gezi.decode(x['title'])[0]
-        asr = gezi.decode(x['asr_text'])[0]
-        title_words = list(jieba.cut(title))
-        asr_words = list(jieba.cut(asr))
-        if i == 0:
-          ic(title, asr)
-          ic(title_words, asr_words)
-        word_counter.adds(title_words)
-        word_counter.adds(asr_words)
-        title_counter.adds(title_words)
-        asr_counter.adds(asr_words)
+  record_files = []
+  for dir in dirs:
+    record_files += gezi.list_files(f'{dir}/*.tfrecords')
+  ic(len(record_files))
+
+  # each record file is cut and counted in a worker process
+  counters = gezi.count_files(record_files, parse, names=['word', 'title', 'asr'], read_fn=read_records)
 
-  word_counter.save('../input/word_vocab.txt')
-  title_counter.save('../input/title_vocab.txt')
-  asr_counter.save('../input/asr_vocab.txt')
+  counters['word'].save('../input/word_vocab.txt')
+  counters['title'].save('../input/title_vocab.txt')
+  counters['asr'].save('../input/asr_vocab.txt')
 
 if __name__ == '__main__':
   app.run(main)  
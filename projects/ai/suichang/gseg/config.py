@@ -70,6 +70,7 @@ flags.DEFINE_bool('write_test_results', True, 'image write to disk')
 flags.DEFINE_bool('zip_image', True, '')
 
 flags.DEFINE_bool('write_inter_results', False, 'inter image write to disk for ensemble')
+flags.DEFINE_string('inter_results_dtype', 'uint8', 'uint8(quantized probs) or float16, npy inter results for ensemble')
 
 flags.DEFINE_bool('aug_train_image', True, '')
 flags.DEFINE_bool('aug_pred_image', False, '')
@@ -20,6 +20,11 @@ import cv2
 import tensorflow as tf
 from tqdm.auto import tqdm
 
+# tiling.py is zipped along with this file (see zip.sh), or from gseg when run in repo
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+from tiling import TiledPredictor
+
 DEBUG = False
 TEST_RAND_SHAPE = True
 TEST_OOM = False
@@ -52,8 +57,11 @@ IMAGE_SIZE = (IMAGE_SIZE_, IMAGE_SIZE_)
 PAD_SIZE_ = 0
 assert PAD_SIZE_ % 32 == 0
 PAD_SIZE = (PAD_SIZE_, PAD_SIZE_)
+# tiles overlap by 2 * PAD_SIZE, overlapped scores blended by gaussian weights
+OVERLAP = PAD_SIZE_ * 2 / IMAGE_SIZE_
+BLEND = 'gaussian'
 
-print("IMAGE_SIZE", IMAGE_SIZE, "PAD_SIZE", PAD_SIZE)
+print("IMAGE_SIZE", IMAGE_SIZE, "PAD_SIZE", PAD_SIZE, "OVERLAP", OVERLAP)
 
 # bs = os.environ.get('BATCH_SIZE')
 # try:
@@ -120,150 +128,6 @@ def _predict(model, imgs):
 # max_patches = 0
 # num_shapes = 0
 
-# from https://github.com/PaddlePaddle/PaddleX/blob/4a6c125339d7c05550d470a413a947967500fd44/paddlex/cv/models/deeplabv3p.py
-def overlap_tile_predict(model, image, tile_size, pad_size, batch_size):
-  """有重叠的大图切小图预测。
-  Args:
-      img_file(str|np.ndarray): 预测图像路径，或者是解码后的排列格式为（H, W, C）且类型为float32且为RGB格式的数组。
-      tile_size(list|tuple): 滑动窗口的大小，该区域内用于拼接预测结果，格式为（H, W）。默认值为[512, 512]。
-      pad_size(list|tuple): 滑动窗口向四周扩展的大小，扩展区域内不用于拼接预测结果，格式为（H, W）。默认值为[64，64]。
-      batch_size(int)：对窗口进行批量预测时的批量大小。默认值为32
-  Returns:
-      dict: 包含关键字'label_map'和'score_map', 'label_map'存储预测结果灰度图，
-          像素值表示对应的类别，'score_map'存储各类别的概率，shape=(h, w, num_classes)
-  """
-
-  height, width, channel = image.shape
-  image_tile_list = list()
-
-  num_classes = model.output.shape[-1]
-
-  # print('imaage shape for tile predict', image.shape, 'num_output_classes', num_classes)
-  # Padding along the left and right sides
-  if pad_size[0] > 0:
-    left_pad = cv2.flip(image[0:height, 0:pad_size[1], :], 1)
-    right_pad = cv2.flip(image[0:height, -pad_size[1]:width, :], 1)
-    padding_image = cv2.hconcat([left_pad, image])
-    padding_image = cv2.hconcat([padding_image, right_pad])
-  else:
-    padding_image = image
-#     import copy
-#     padding_image = copy.deepcopy(image)
-
-  # Padding along the upper and lower sides
-  padding_height, padding_width, _ = padding_image.shape
-  if pad_size[0] > 0:
-    upper_pad = cv2.flip(
-        padding_image[0:pad_size[0], 0:padding_width, :], 0)
-    lower_pad = cv2.flip(
-        padding_image[-pad_size[0]:padding_height, 0:padding_width, :],
-        0)
-    padding_image = cv2.vconcat([upper_pad, padding_image])
-    padding_image = cv2.vconcat([padding_image, lower_pad])
-
-  # crop the padding image into tile pieces
-  padding_height, padding_width, _ = padding_image.shape
-
-  # print(padding_image.shape)
-
-  hws = []
-  # print('------abc', height // tile_size[1] + 1,  width // tile_size[0] + 1)
-  assert height % tile_size[0] == 0
-  assert width % tile_size[1] == 0
-
-  # print('hscale', height / tile_size[1], 'wscale', width / tile_size[0])
-
-  for h_id in range(0, int(height / tile_size[0])):
-    for w_id in range(0, int(width / tile_size[1])):
-      hws.append([h_id, w_id])
-
-  for h_id, w_id in tqdm(hws, desc='sub_image', ascii=True, leave=False):
-    left = w_id * tile_size[1] 
-    upper = h_id * tile_size[0] 
-    right = min(left + tile_size[1] + pad_size[1] * 2,
-                padding_width)
-    lower = min(upper + tile_size[0] + pad_size[0] * 2,
-                padding_height)
-    image_tile = padding_image[upper:lower, left:right, :]
-    # print(left, upper, right, lower, image_tile.shape)
-    image_tile_list.append(image_tile)
-
-  # predict
-  score_map = np.zeros((height, width, num_classes), dtype=np.float32)
-
-  # print('score map', score_map.shape)
-
-  num_tiles = len(image_tile_list)
-  for i in tqdm(range(0, num_tiles, batch_size), desc='predict', ascii=True, leave=False):
-    begin = i
-    end = min(i + batch_size, num_tiles)
-    # print([x.shape for x in image_tile_list[begin:end]])
-    imgs = np.asarray(image_tile_list[begin:end])
-    # print(imgs.shape)
-    res = _predict(model, imgs)
-    # print(res.shape)
-    for j in range(begin, end):
-      h_id = j // int(width / tile_size[0])
-      w_id = j % int(width / tile_size[1])
-      left = w_id * tile_size[1]
-      upper = h_id * tile_size[0]
-      right = min((w_id + 1) * tile_size[1], width)
-      lower = min((h_id + 1) * tile_size[0], height)
-      tile_score_map = res[j - begin]
-      tile_upper = pad_size[0]
-      tile_lower = tile_score_map.shape[0] - pad_size[0]
-      tile_left = pad_size[1]
-      tile_right = tile_score_map.shape[1] - pad_size[1]
-      score_map[upper:lower, left:right, :] = \
-          tile_score_map[tile_upper:tile_lower, tile_left:tile_right, :]
-
-  return score_map, num_tiles
-
-def concat_tile_predict(model, img, tile_size, batch_size):
-  img_shape = img.shape[:2]
-  assert img_shape[0] % tile_size[0] == 0
-  imgs = []
-  i = 0
-  hws = []
-  for h in range(0, img_shape[0], tile_size[0]):
-    for w in range(0, img_shape[1], tile_size[1]):
-      hws.append((h,w))
-
-  preds = []
-  for h, w in tqdm(hws, desc='sub_image', ascii=True, leave=False):
-    left = w 
-    upper = h
-    right = min(w + tile_size[1], img_shape[1])
-    lower = min(h + tile_size[0], img_shape[0])
-    tile_img = img[upper:lower, left:right, :]
-    # print(i, h, w, left, upper, right, lower, tile_img.shape)
-    imgs.append(tile_img)
-    if len(imgs) == batch_size:
-      pred = _predict(model, np.asarray(imgs))
-      # print(pred.shape)
-      preds.append(pred)
-      imgs = []
-    i += 1
-  if imgs:
-    pred = _predict(model, np.asarray(imgs))
-    preds.append(pred)
-    imgs = []
-
-  preds = np.concatenate(preds, axis=0)
-  assert len(preds) > 1
-  i = 0
-  l = []
-  for _ in range(0, img_shape[0], tile_size[0]):
-    l_ = []
-    for _ in range(0, img_shape[1], tile_size[1]):
-      l_.append(preds[i])
-      i += 1
-    l.append(cv2.hconcat(l_))
-  pred = cv2.vconcat(l)
-  num_tiles = len(preds)
-    
-  return pred, num_tiles
-
 def predict(model, input_path, output_dir):
   os.makedirs(output_dir, exist_ok=True)
   img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED).astype(np.float32)
@@ -342,10 +206,6 @@ def predict(model, input_path, output_dir):
   resize_w = scale_w  * tile_size[1]
   resize_shape = (resize_h, resize_w)
 
-  if resize_shape != ori_shape:
-    img = tf.image.resize(img, (resize_shape[0], resize_shape[1])).numpy()
-    # img = cv2.resize(img, (resize_shape[1], resize_shape[0]), interpolation=cv2.INTER_NEAREST)
-
   if scale_h * scale_w > 1:
     if tile_size[0] > 512:
       batch_size = BATCH_SIZE
@@ -353,11 +213,15 @@ def predict(model, input_path, output_dir):
       batch_size = 2
     else:
       batch_size = 4
-#       if PAD_SIZE[0] * PAD_SIZE[1] == 0:
-#         pred, num_tiles = concat_tile_predict(model, img, tile_size=tile_size, batch_size=BATCH_SIZE)
-#       else:
-    pred, num_tiles = overlap_tile_predict(model, img, tile_size=tile_size, pad_size=PAD_SIZE, batch_size=batch_size)
+    # any image size, no resize needed, tta flips are predicted in the same batch
+    tiled = TiledPredictor(model.predict, tile_size, overlap=OVERLAP, batch_size=batch_size, 
+                           blend=BLEND, tta=('hflip', 'vflip') if tta else ())
+    pred = tiled.predict(img)
+    num_tiles = tiled.num_tiles(*ori_shape)
   else:
+    if resize_shape != ori_shape:
+      img = tf.image.resize(img, (resize_shape[0], resize_shape[1])).numpy()
+      # img = cv2.resize(img, (resize_shape[1], resize_shape[0]), interpolation=cv2.INTER_NEAREST)
     pred = _predict(model, np.asarray([img]))
     pred = pred[0]
     tile_size = resize_shape
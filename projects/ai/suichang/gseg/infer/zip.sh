@@ -1 +1,2 @@
 zip submit.zip model_define.py model_predict.py model.h5
+zip -j submit.zip $(dirname $0)/../tiling.py
@@ -12,15 +12,23 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import sys 
+import sys
 import os
-  
+import time
+import mmap
+from multiprocessing import cpu_count
+from collections import defaultdict
+
 import numpy as np
+from numba import njit
 
-import pydensecrf.densecrf as dcrf
-from pydensecrf.utils import unary_from_labels
+import gezi
 
-from skimage.morphology import remove_small_holes, remove_small_objects
+try:
+    import pydensecrf.densecrf as dcrf
+    from pydensecrf.utils import unary_from_labels
+except Exception:
+    dcrf = None
 
 # Fully connected CRF post processing function
 def do_crf(image, mask, zero_unsure=True):
@@ -47,15 +55,207 @@ def do_crf(image, mask, zero_unsure=True):
     return MAP
     # MAP = do_crf(frame, labels.astype('int32'), zero_unsure=False)
 
-def remove_small_objects_and_holes(mask, num_classes, min_size=30, area_threshold=30):
-    masks = []
-    # print(mask)
-    # print(len(np.unique(mask)))
+@njit
+def _find(parent, x):
+    root = x
+    while parent[root] != root:
+        root = parent[root]
+    while parent[x] != root:
+        parent[x], x = root, parent[x]
+    return root
+
+@njit
+def _union(parent, a, b):
+    a, b = _find(parent, a), _find(parent, b)
+    # root is the smallest pixel index of the region, so roots come first in scan order
+    if a < b:
+        parent[b] = a
+    elif b < a:
+        parent[a] = b
+
+@njit
+def _label_regions(mask):
+    """4-connected regions of equal class, all classes in one union find pass -> [H, W] region ids, num regions"""
+    h, w = mask.shape
+    parent = np.arange(h * w, dtype=np.int32)
+    for y in range(h):
+        for x in range(w):
+            i = y * w + x
+            if x > 0 and mask[y, x - 1] == mask[y, x]:
+                _union(parent, i, i - 1)
+            if y > 0 and mask[y - 1, x] == mask[y, x]:
+                _union(parent, i, i - w)
+    labels = np.empty(h * w, dtype=np.int32)
+    n = 0
+    for i in range(h * w):
+        root = _find(parent, i)
+        if root == i:
+            labels[i] = n
+            n += 1
+        else:
+            labels[i] = labels[root]
+    return labels.reshape(h, w), n
+
+@njit
+def _region_keeps(mask, labels, num_regions, num_classes, min_size, area_threshold):
+    h, w = mask.shape
+    # area histogram and class of each region, edges between 4-adjacent regions (duplicates are harmless)
+    areas = np.zeros(num_regions, dtype=np.int64)
+    classes = np.zeros(num_regions, dtype=np.int64)
+    src = np.empty(2 * h * w, dtype=np.int32)
+    dst = np.empty(2 * h * w, dtype=np.int32)
+    num_edges = 0
+    for y in range(h):
+        for x in range(w):
+            label = labels[y, x]
+            areas[label] += 1
+            classes[label] = mask[y, x]
+            if x > 0 and labels[y, x - 1] != label:
+                src[num_edges], dst[num_edges] = label, labels[y, x - 1]
+                num_edges += 1
+            if y > 0 and labels[y - 1, x] != label:
+                src[num_edges], dst[num_edges] = label, labels[y - 1, x]
+                num_edges += 1
+
+    keeps = np.zeros((num_classes, num_regions), dtype=np.bool_)
+    has_objects = np.zeros(num_classes, dtype=np.bool_)
+    for r in range(num_regions):
+        if classes[r] < num_classes and areas[r] >= min_size:
+            has_objects[classes[r]] = True
+    parent = np.empty(num_regions, dtype=np.int32)
+    group_areas = np.empty(num_regions, dtype=np.int64)
+    no_objects = -1
     for i in range(num_classes):
-        # print('-----1', i, np.sum((mask == i).astype(np.int32)) / 65536)
-        mask_ = remove_small_objects(mask==i,min_size=min_size,connectivity=1)
-        mask_ = remove_small_holes(mask_==1,area_threshold=area_threshold,connectivity=1) 
-        # print('-----2', i, np.sum((mask_ == 1).astype(np.int32)) / 65536)
-        masks.append(mask_)
-    mask = np.stack(masks, -1).astype(np.float32)       
+        # classes without objects all get the same holes (small islands of the whole image)
+        if not has_objects[i] and no_objects >= 0:
+            keeps[i] = keeps[no_objects]
+            continue
+        if not has_objects[i]:
+            no_objects = i
+        for r in range(num_regions):
+            parent[r] = r
+            group_areas[r] = 0
+        # objects of class i, the rest (other classes and small objects of i) joined by adjacency are hole candidates
+        for e in range(num_edges):
+            a, b = src[e], dst[e]
+            if not (classes[a] == i and areas[a] >= min_size) and not (classes[b] == i and areas[b] >= min_size):
+                _union(parent, a, b)
+        for r in range(num_regions):
+            if not (classes[r] == i and areas[r] >= min_size):
+                group_areas[_find(parent, r)] += areas[r]
+        for r in range(num_regions):
+            if classes[r] == i and areas[r] >= min_size:
+                keeps[i, r] = True
+            else:
+                keeps[i, r] = group_areas[_find(parent, r)] < area_threshold
+    return keeps
+
+def region_keeps(mask, num_classes, min_size=30, area_threshold=30):
+    """
+    [num_classes, num_regions] bool, same result as skimage remove_small_objects (min_size) then
+    remove_small_holes (area_threshold) on each mask == i with connectivity 1, and [H, W] region ids.
+    Pixels are labeled once for all classes, objects are regions of class i with area >= min_size,
+    holes are groups of the other regions (joined over the region adjacency graph) with area < area_threshold,
+    so the per class work is on regions not pixels.
+    """
+    mask = np.ascontiguousarray(mask)
+    labels, num_regions = _label_regions(mask)
+    return _region_keeps(mask, labels, num_regions, num_classes, min_size, area_threshold), labels
+
+def remove_small_objects_and_holes(mask, num_classes, min_size=30, area_threshold=30):
+    keeps, labels = region_keeps(mask, num_classes, min_size, area_threshold)
+    mask = keeps.T[labels].astype(np.float32)
+    return mask
+
+def _clean(mask, prob, num_classes, min_size, area_threshold, rounds, timings):
+    for _ in range(rounds):
+        t = time.time()
+        keeps, labels = region_keeps(mask, num_classes, min_size, area_threshold)
+        timings['regions'] += time.time() - t
+        t = time.time()
+        prob *= keeps.T[labels]
+        mask = np.argmax(prob, axis=-1).astype(np.uint8)
+        timings['argmax'] += time.time() - t
     return mask
+
+def _post_process_range(span):
+    # inputs are inherited by fork (not copied), outputs written to shared memory
+    ctx = gezi.fork_ctx()
+    timings = defaultdict(float)
+    for i in range(*span):
+        mask = np.asarray(ctx['masks'][i])
+        if ctx['crf']:
+            t = time.time()
+            mask = do_crf(ctx['images'][i], mask, zero_unsure=True)
+            timings['crf'] += time.time() - t
+        if ctx['remove']:
+            t = time.time()
+            prob = np.array(ctx['probs'][i], dtype=np.float32)
+            timings['load'] += time.time() - t
+            mask = _clean(mask, prob, ctx['num_classes'], ctx['min_size'], ctx['area_threshold'], ctx['rounds'], timings)
+        ctx['out'][i] = mask
+    return dict(timings)
+
+class PostProcessor(object):
+    """
+    crf (dense crf per image, needs pydensecrf) and/or remove small objects and holes of each class
+    (rounds times: probs of classes not kept are zeroed then argmax, as post_deal did).
+    Images run in num_workers forked processes which write to one shared output buffer,
+    timings accumulates seconds of each stage over workers and calls, see report().
+    """
+    def __init__(self, num_classes, min_size=30, area_threshold=None, crf=False, remove=True, rounds=2,
+                 num_workers=None, chunk_size=4):
+        self.num_classes = num_classes
+        self.min_size = min_size
+        self.area_threshold = area_threshold if area_threshold is not None else min_size
+        self.crf = crf
+        self.remove = remove
+        self.rounds = rounds
+        self.num_workers = num_workers or cpu_count()
+        self.chunk_size = chunk_size
+        self.timings = defaultdict(float)
+        self.num_images = 0
+
+    def __call__(self, masks, probs=None, images=None):
+        """masks: [N, H, W], probs: [N, H, W, num_classes] (needed by remove), images: [N, H, W, 3] (needed by crf)"""
+        assert not self.remove or probs is not None
+        assert not self.crf or (images is not None and dcrf is not None)
+        num_images = len(masks)
+        shape = (num_images,) + tuple(masks.shape[1:])
+        t = time.time()
+        buf = mmap.mmap(-1, max(int(np.prod(shape)), 1))
+        out = np.frombuffer(buf, dtype=np.uint8, count=int(np.prod(shape))).reshape(shape)
+        ctx = dict(masks=masks, probs=probs, images=images, out=out, crf=self.crf, remove=self.remove,
+                   num_classes=self.num_classes, min_size=self.min_size, area_threshold=self.area_threshold,
+                   rounds=self.rounds)
+        spans = [(i, min(i + self.chunk_size, num_images)) for i in range(0, num_images, self.chunk_size)]
+        for timings in gezi.fork_map(_post_process_range, spans, ctx, self.num_workers):
+            for key, val in timings.items():
+                self.timings[key] += val
+        masks = out.copy()
+        del out, ctx
+        buf.close()
+        self.timings['total'] += time.time() - t
+        self.num_images += num_images
+        return masks
+
+    def report(self):
+        """Stage seconds (summed over workers) and per image ms, total is wall time"""
+        num_images = max(self.num_images, 1)
+        return dict((key, (round(val, 3), round(val * 1000 / num_images, 2))) for key, val in self.timings.items())
+
+def compare_post_processing(labels, masks, probs=None, images=None, num_classes=None, **kwargs):
+    """FWIoU/MIoU before and after post processing plus stage timings, to judge if the cost is worth it"""
+    from gezi.metrics.image.semantic_seg import Evaluator
+    num_classes = num_classes or probs.shape[-1]
+    processor = PostProcessor(num_classes, **kwargs)
+    masks_ = processor(masks, probs, images)
+    res = {}
+    for name, preds in [('before', masks), ('after', masks_)]:
+        evaluator = Evaluator(num_classes)
+        for i in range(len(labels)):
+            evaluator.add_batch(np.asarray(labels[i]), np.asarray(preds[i]))
+        metrics = evaluator.eval_once()
+        res[f'{name}/FWIoU'], res[f'{name}/MIoU'] = metrics['FWIoU'], metrics['MIoU']
+    res['timings'] = processor.report()
+    return res
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   post_processing_test.py
+#        \author   chenghuige
+#          \date   2021-10-20 16:40:21.118305
+#   \Description   python -m pytest gseg/post_processing_test.py
+#                  single pass region removal against the old per class skimage version
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from scipy import ndimage
+
+from gseg.post_processing import region_keeps, remove_small_objects_and_holes, PostProcessor
+
+try:
+    from skimage.morphology import remove_small_holes, remove_small_objects
+except ImportError:
+    # what skimage does for bool images with connectivity 1
+    def remove_small_objects(ar, min_size=64, connectivity=1):
+        labels, _ = ndimage.label(ar, ndimage.generate_binary_structure(ar.ndim, connectivity))
+        sizes = np.bincount(labels.ravel())
+        too_small = sizes < min_size
+        too_small[0] = False
+        out = ar.copy()
+        out[too_small[labels]] = False
+        return out
+
+    def remove_small_holes(ar, area_threshold=64, connectivity=1):
+        return ~remove_small_objects(~ar, area_threshold, connectivity)
+
+def _remove_small_objects_and_holes(mask, num_classes, min_size=30, area_threshold=30):
+    # as the old remove_small_objects_and_holes
+    masks = []
+    for i in range(num_classes):
+        mask_ = remove_small_objects(mask == i, min_size=min_size, connectivity=1)
+        mask_ = remove_small_holes(mask_ == 1, area_threshold=area_threshold, connectivity=1)
+        masks.append(mask_)
+    return np.stack(masks, -1).astype(np.float32)
+
+def _post_deal(masks, probs, num_classes, min_size):
+    # as the old post_deal with post_remove
+    masks_ = []
+    for mask, prob in zip(masks, probs):
+        for _ in range(2):
+            prob *= _remove_small_objects_and_holes(mask, num_classes, min_size, min_size)
+            mask = np.argmax(prob, axis=-1)
+        masks_.append(mask)
+    return np.stack(masks_, axis=0)
+
+def _gen_masks(seed, n=4, size=48, num_classes=4):
+    rng = np.random.default_rng(seed)
+    # blocky masks so there are regions of all sizes, plus single pixel noise
+    masks = np.kron(rng.integers(0, num_classes, (n, size // 4, size // 4)), np.ones((1, 4, 4), dtype=np.int64))
+    noise = rng.random(masks.shape) < 0.05
+    masks[noise] = rng.integers(0, num_classes, noise.sum())
+    probs = rng.random(masks.shape + (num_classes,)).astype(np.float32)
+    return masks.astype(np.uint8), probs
+
+def test_remove_small_objects_and_holes():
+    masks, _ = _gen_masks(0)
+    for min_size, area_threshold in [(1, 1), (5, 5), (20, 8), (30, 30), (100, 200)]:
+        for mask in masks:
+            expected = _remove_small_objects_and_holes(mask, 4, min_size, area_threshold)
+            assert (remove_small_objects_and_holes(mask, 4, min_size, area_threshold) == expected).all()
+
+def test_region_keeps_single_class():
+    mask = np.zeros((10, 10), dtype=np.uint8)
+    keeps, labels = region_keeps(mask, 3, 30, 30)
+    assert keeps.T[labels].shape == (10, 10, 3)
+    assert (keeps.T[labels] == _remove_small_objects_and_holes(mask, 3)).all()
+
+def test_post_processor():
+    masks, probs = _gen_masks(1)
+    expected = _post_deal(masks, probs.copy(), 4, 10)
+    for num_workers in [1, 3]:
+        processor = PostProcessor(4, min_size=10, num_workers=num_workers, chunk_size=1)
+        assert (processor(masks, probs.copy()) == expected).all()
+    assert processor.num_images == len(masks)
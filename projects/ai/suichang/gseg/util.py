@@ -104,26 +104,12 @@ def to_pred(preds, image=None):
   return preds
 
 def post_deal(masks, probs=None, images=None):
-  NUM_CLASSES = FLAGS.NUM_CLASSES
-  if FLAGS.post_crf:
-    masks_ = []
-    for image, mask in zip(images, masks):
-      mask = do_crf(image, mask, zero_unsure=True)
-      masks_.append(mask)
-    masks = np.stack(masks_, axis=0)
-  if FLAGS.post_remove:
-    masks_ = []
-    for mask, prob in zip(masks, probs):
-      # print('------1', len(np.unique(mask)))
-      mask = remove_small_objects_and_holes(mask, NUM_CLASSES, FLAGS.min_size, FLAGS.min_size)
-      # print('-----2', len(np.unique(mask)))
-      prob *= mask
-      mask = np.argmax(prob, axis=-1)
-      mask = remove_small_objects_and_holes(mask, NUM_CLASSES, FLAGS.min_size, FLAGS.min_size)
-      prob *= mask
-      mask = np.argmax(prob, axis=-1)
-      masks_.append(mask)
-    masks = np.stack(masks_, axis=0)
+  if not FLAGS.post_crf and not FLAGS.post_remove:
+    return masks
+  processor = PostProcessor(FLAGS.NUM_CLASSES, FLAGS.min_size, FLAGS.min_size,
+                            crf=FLAGS.post_crf, remove=FLAGS.post_remove)
+  masks = processor(masks, probs, images)
+  logging.debug('post processing timings (sec, ms/image):', processor.report())
   return masks
 
 m = {}
@@ -182,6 +168,18 @@ def write_results(ids, predicts, outdir, mode):
     id = '%06d' % id
     cv2.imwrite(outdir + f'/{id}.png', pred)
 
+def save_pred(file, pred, dtype='uint8'):
+  """uint8 quantizes [0, 1] probs to 0-255, float16 keeps scores as is"""
+  pred = np.asarray(pred)
+  if dtype == 'uint8':
+    pred = np.rint(np.clip(pred, 0., 1.) * 255.)
+  np.save(file, pred.astype(dtype))
+
+def load_pred(file):
+  """Memory-mapped [H, W, C] scores saved by save_pred, uint8 is left quantized (scale 1/255)"""
+  pred = np.load(file, mmap_mode='r')
+  return pred, 1. / 255. if pred.dtype == np.uint8 else 1.
+
 def write_inter_results(ids, predicts, outdir, mode, out_type='npy', masks=None):
   if mode == 'test':
     outdir += '/test_inter_results'
@@ -192,8 +190,7 @@ def write_inter_results(ids, predicts, outdir, mode, out_type='npy', masks=None)
   if out_type == 'npy':
     # # for valid ensemble also test ensemble
     for id, pred in zip(ids, predicts):
-      pred = tf.quantization.quantize(pred, 0, 1, tf.quint8).output.numpy()
-      np.save(outdir + f'/{id}.npy', pred.astype(np.uint8))
+      save_pred(outdir + f'/{id}.npy', pred, FLAGS.inter_results_dtype)
   elif out_type == 'tfrec':
     write_tfrec_results(ids, predicts, outdir, mode)
   else:
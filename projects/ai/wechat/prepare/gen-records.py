@@ -14,6 +14,7 @@ FLAGS = flags.FLAGS
 import tensorflow as tf
 import tensorflow_addons as tfa
 import glob
+import json
 import numpy as np
 from multiprocessing import Pool, Manager, cpu_count
 import pandas as pd
@@ -25,6 +26,8 @@ import gezi
 from gezi import tqdm
 tqdm.pandas()
 
+from wechat.history_index import get_day_index, NO_EXCLUDE
+
 MAX_TAGS = 14
 MAX_KEYS = 18
 DESC_LEN = 128
@@ -45,7 +48,7 @@ history_days = {}
 feed_history_days = {}
 
 doc_info = {}
-doc_dynamic_feature = {}
+doc_stats = None
 default_vals = {}
 todays = {}
 todays2 = {}
@@ -151,214 +154,196 @@ def is_neg(row):
   else:
     return False
   
-def get_history(userid, feedid, action, day, is_first):
-  feeds, spans = history_days[day][userid][action]
-  len_ = HIST_LENS[action] if not FLAGS.dynamic_len else MAX_HIS_LEN
-  if not is_first:
-    feeds_, spans_ = [], []
-    for feed, span in zip(feeds, spans):
-      if feed == feedid:
-        continue
-      feeds_.append(feed)
-      spans_.append(span)
-      if len(feeds_) == len_:
-        return feeds_, spans_
-    if not FLAGS.dynamic_len:
-      feeds_, spans_ = gezi.pad(feeds_, len_), gezi.pad(spans_, len_)
-    return feeds_, spans_
-  
-  if not FLAGS.dynamic_len:
-    feeds, spans = gezi.pad(feeds, len_), gezi.pad(spans, len_)
-  else:
-    feeds, spans = feeds[:len_], spans[:len_]
-  return feeds, spans
+def get_histories(df_):
+  """Batch lookups of user history (excluding current doc) and feed history (excluding current user) for all rows of df_"""
+  n = len(df_)
+  userids = df_.userid.values.astype(np.int64)
+  feedids = df_.feedid.values.astype(np.int64)
+  docs = doc_vocab.encode_batch(feedids)
+  users = user_vocab.encode_batch(userids)
+  dates = df_.date_.values.astype(int) if 'date_' in df_.columns else np.full(n, FLAGS.test_day)
+  is_first = df_.is_first.values.astype(bool) if 'is_first' in df_.columns else np.ones(n, dtype=bool)
+
+  his = {}
+  def _set(key, len_, rows, values, lengths, found):
+    if key not in his:
+      his[key] = (np.zeros((n, len_), dtype=np.int32), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool))
+    his[key][0][rows], his[key][1][rows], his[key][2][rows] = values, lengths, found
+
+  for day in np.unique(dates):
+    rows = np.nonzero(dates == day)[0]
+    for action in HIS_ACTIONS:
+      len_ = HIST_LENS[action] if not FLAGS.dynamic_len else MAX_HIS_LEN
+      if FLAGS.use_history:
+        # 注意per day的history是转换docid之后的
+        excludes = np.where(is_first[rows], NO_EXCLUDE, docs[rows])
+        values, spans, lengths, found = history_days[day][action].lookup(userids[rows], excludes, len_)
+        _set(f'{action}s', len_, rows, values, lengths, found)
+        _set(f'{action}s_spans', len_, rows, spans, lengths, found)
+      if FLAGS.use_feed_history:
+        if action in feed_history_days[day]:
+          excludes = np.where(is_first[rows], NO_EXCLUDE, users[rows])
+          values, _, lengths, found = feed_history_days[day][action].lookup(feedids[rows], excludes, len_)
+        else:
+          values, lengths, found = 0, 0, False
+        _set(f'u_{action}s', len_, rows, values, lengths, found)
+  return his
+
+def get_history(his, key, i):
+  values, lengths, _ = his[key]
+  if FLAGS.dynamic_len:
+    return list(values[i][:lengths[i]])
+  return list(values[i])
+
+def get_doc_dynamic_feats(df_):
+  """Doc dynamic features of all rows of df_ as window sums over the prefix sum doc_stats (feed x day x counter)"""
+  n = len(df_)
+  feedids = df_.feedid.values.astype(np.int64)
+  dates = df_.date_.values.astype(np.int64) if 'date_' in df_.columns else np.full(n, FLAGS.test_day)
+  idx = doc_stats.index(feedids)
+  actions = ['actions'] + ACTIONS
+  keys = ['finish_rate', 'stay_rate']
 
-def get_feed_history(userid, feedid, action, day, is_first):
-  if action in feed_history_days[day][feedid]:
-    userids = feed_history_days[day][feedid][action] 
-  else:
-    return None
-  len_ = HIST_LENS[action] if not FLAGS.dynamic_len else MAX_HIS_LEN
-  if not is_first:
-    userids_ = []
-    for uid in userids:
-      if uid == userid:
-        continue
-      userids_.append(uid)
-      if len(userids_) == len_:
-        return userids_
-    if not FLAGS.dynamic_len:
-      userids_ = gezi.pad(userids_, len_)
-    return userids_
-  
-  if not FLAGS.dynamic_len:
-    userids = gezi.pad(userids, len_)
-  else:
-    userids = userids[:len_]
-  return userids
-
-# TODO pre generate just load and search in tfrecord
-def get_doc_dynamic_feats(fd, feedid, date, doc_dynamic_feats):
-  key_ = f'{feedid}_{date}'
-  if key_ in doc_dynamic_feats:
-    return doc_dynamic_feats[key_]
   fe = {}
-  fe['num_shows'] = sum(fd['shows'][:date])
-  fe['num_shows2'] = sum(fd['shows'][:date + 1])
-  fe['num_shows_today'] = fd['shows'][date]
-
-  min_count = 10
-  rate = min(fe['num_shows'] / min_count, 1.)
-  for action in ['actions'] + ACTIONS:
-    fe[f'num_{action}'] = sum(fd[action][:date])
-    # TODO smooth ? for each action different default value from conf or FLAGS
-    # 用均值取代
-    # +0,+10 似乎并没有比 +1,+1效果好? 那么 0, 1?
-    # a, b = 0, 10  rv=2
-    a, b = 0, 1 #rv=3
-    # a, b = 1, 1
-    
-    fe[f'{action}_rate'] = (fe[f'num_{action}'] + a) / (fe['num_shows'] + b) if rate else default_vals[action]
-    # fe[f'{action}_rate'] = rate * ((fe[f'num_{action}']) / (fe['num_shows']) * (fe['num_shows'])) + (1 - rate) * default_vals[action] if rate else default_vals[action]
-
-  for key in ['finish_rate', 'stay_rate']:
-    fe[f'total_{key}'] = float(sum(fd[key][:date]))
-    fe[f'{key}_mean'] = (fe[f'total_{key}'] + a) / (fe['num_shows'] + b) if rate else default_vals[key]
-    # fe[f'{key}_mean'] = rate * (fe[f'total_{key}']) / (fe['num_shows'])  + (1 - rate) * default_vals[key] if rate else default_vals[key]
+  num_shows = doc_stats.sum(idx, 0, dates, ['shows'])[:, 0]
+  fe['num_shows'] = num_shows.astype(np.int64)
+  fe['num_shows2'] = doc_stats.sum(idx, 0, dates + 1, ['shows'])[:, 0].astype(np.int64)
+  fe['num_shows_today'] = doc_stats.sum(idx, dates, dates + 1, ['shows'])[:, 0].astype(np.int64)
+
+  # TODO smooth ? for each action different default value from conf or FLAGS
+  # 用均值取代
+  # +0,+10 似乎并没有比 +1,+1效果好? 那么 0, 1?
+  # a, b = 0, 10  rv=2
+  a, b = 0, 1 #rv=3
+  # a, b = 1, 1
+  counts = doc_stats.sum(idx, 0, dates, actions + keys)
+  for j, action in enumerate(actions):
+    fe[f'num_{action}'] = counts[:, j].astype(np.int64)
+    fe[f'{action}_rate'] = np.where(num_shows > 0, (counts[:, j] + a) / (num_shows + b), default_vals.get(action, 0.))
+  for j, key in enumerate(keys, len(actions)):
+    fe[f'total_{key}'] = counts[:, j]
+    fe[f'{key}_mean'] = np.where(num_shows > 0, (counts[:, j] + a) / (num_shows + b), default_vals.get(key, 0.))
 
   for span in SPANS:
-    fe[f'num_shows_{span}'] = sum(fd['shows'][date - span:date])
-    rate = min(fe[f'num_shows_{span}'] / min_count, 1.)
-
-    for action in ACTIONS + ['actions']:
-      fe[f'num_{action}_{span}'] = sum(fd[action][date - span:date])
-      # TODO smooth ?
-      fe[f'{action}_rate_{span}'] = (fe[f'num_{action}_{span}'] + a) / (fe[f'num_shows_{span}'] + b)if rate else default_vals[action]
-
-      # fe[f'{action}_rate_{span}'] = rate * (fe[f'num_{action}_{span}']) / (fe[f'num_shows_{span}']) + (1 - rate) * default_vals[action] if rate else default_vals[action]
-
-    for key in ['finish_rate', 'stay_rate']:
-      fe[f'total_{key}_{span}'] = float(sum(fd[key][date - span:date]))
-      fe[f'{key}_mean_{span}'] = (fe[f'total_{key}_{span}'] + a) / (fe[f'num_shows_{span}'] + b) if rate else default_vals[key]
-      # fe[f'{key}_mean_{span}'] = rate * (fe[f'total_{key}_{span}']) / (fe[f'num_shows_{span}']) + (1 - rate) * default_vals[key] if rate else default_vals[key]
-    doc_dynamic_feats[key_] = fe
-  return fe
-
-def build_features(index):
+    # same as python list slice fd[key][date - span:date] which is empty if date < span
+    valid = (dates >= span)[:, None]
+    counts = doc_stats.sum(idx, dates - span, dates, ['shows'] + actions + keys) * valid
+    num_shows = counts[:, 0]
+    fe[f'num_shows_{span}'] = num_shows.astype(np.int64)
+    for j, action in enumerate(actions, 1):
+      fe[f'num_{action}_{span}'] = counts[:, j].astype(np.int64)
+      fe[f'{action}_rate_{span}'] = np.where(num_shows > 0, (counts[:, j] + a) / (num_shows + b), default_vals.get(action, 0.))
+    for j, key in enumerate(keys, 1 + len(actions)):
+      fe[f'total_{key}_{span}'] = counts[:, j]
+      fe[f'{key}_mean_{span}'] = np.where(num_shows > 0, (counts[:, j] + a) / (num_shows + b), default_vals.get(key, 0.))
+
+  return dict((key, val.tolist()) for key, val in fe.items())
+
+def get_out_dir():
   mark = FLAGS.day or FLAGS.mark
   if FLAGS.pred_file:
     mark = f'pred{mark}'
   out_dir = f'../input/{FLAGS.records_name}/{mark}'
   if FLAGS.neg_parts:
     out_dir += f'-{FLAGS.neg_parts}-{FLAGS.neg_part}'
-  gezi.try_mkdir(out_dir)
-  if index == 0:
-    # notice ic() will cause tfrecord data loss when reading, might due to multiprocess conflict of icecream, to not use it here
-    print(out_dir)
-  ofile = f'{out_dir}/{index}.tfrec'
+  return out_dir
 
-  total = len(df)
-  start, end = gezi.get_fold(total, FLAGS.num_records, index)
-  df_ = df.iloc[start:end]
+def build_features(df_):
+  his = get_histories(df_) if (FLAGS.use_history or FLAGS.use_feed_history) else None
+  dyn = get_doc_dynamic_feats(df_) if FLAGS.use_doc_dynamic else None
+  for i, row in enumerate(df_.itertuples()):
+    yield build_feature(row._asdict(), i, his, dyn)
 
-  doc_dynamic_feats = {}
+def build_feature(row, i, his, dyn):
+  is_neg_row = is_neg(row)
+  if FLAGS.neg_parts:
+    if is_neg_row:
+      rand_int = np.random.randint(FLAGS.neg_parts)
+      if rand_int != FLAGS.neg_part:
+        return None
+  fe = {}
+  fe['version'] = int(row['version']) if 'version' in 'row' else 2
+  fe['userid'] = int(row['userid'])
+  fe['feedid'] = int(row['feedid'])
+  fe['doc'] = doc_vocab.id(fe['feedid'])
+  fe['user'] = user_vocab.id(fe['userid'])
+  assert(fe['doc'] > 1)
+  assert(fe['user'] > 1)
+  fe['date'] = int(row['date_']) if 'date_' in row else FLAGS.test_day
+  fe['day'] = fe['date'] % 7
+  fe['device'] = row['device']
+
+  fe['finish_rate'] = row['finish_rate'] if 'finish_rate' in row else 1.
+  fe['stay_rate'] = row['stay_rate'] if 'stay_rate' in row else 1.
+  fe['is_first'] = row['is_first'] if 'is_first' in row else 1
+  fe['is_neg'] = int(is_neg_row)
+  fe['num_actions'] = row['actions'] if 'actions' in row else 0
+
+  # ------feed静态特征
+  feed = feeds[fe['feedid']]
+
+  video_time = int(feed['videoplayseconds'])
+  if video_time > 120:
+    video_time = 62
+  elif video_time > 60:
+    video_time = 61
+  fe['video_time'] = video_time + 1
+
+  video_time2 = int(video_time / 10)
+  if video_time > 120:
+    video_time2 = 8
+  elif video_time > 60:
+    video_time2 = 7
+
+  fe['video_time2'] = video_time2 + 1
+  video_display = min(video_time, 60) / 60.
+  fe['video_display'] = video_display
+
+  for key in DOC_STATIC_FEATS:
+    fe[key] = feed[key]
+
+  fe['fresh'] = fe['date'] - feed['start_day'] if 'start_day' in feed else FLAGS.test_day
+
+  # doc dynamic features
+  if FLAGS.use_doc_dynamic:
+    for key in dyn:
+      fe[key] = dyn[key][i]
 
-  # buffer_size = None if not 'train' in FLAGS.mark or FLAGS.sort_method else 10000
-  buffer_size = FLAGS.buf_size # much faster with buffer_size so less write to disk
-  with melt.tfrecords.Writer(ofile, buffer_size=buffer_size, shuffle=False) as writer:
-    t = tqdm(df_.itertuples(), total=len(df_), desc=f'index:{index}', ascii=False)
-    for row in t:
-      # t.set_postfix({'index': index}) # this is slow..
-      row = row._asdict()
-      is_neg_row = is_neg(row)
-      if FLAGS.neg_parts:
-        if is_neg_row:
-          rand_int = np.random.randint(FLAGS.neg_parts)
-          if rand_int != FLAGS.neg_part:
-            continue
-      fe = {}
-      fe['version'] = int(row['version']) if 'version' in 'row' else 2
-      fe['userid'] = int(row['userid'])
-      fe['feedid'] = int(row['feedid'])
-      fe['doc'] = doc_vocab.id(fe['feedid'])
-      fe['user'] = user_vocab.id(fe['userid'])
-      assert(fe['doc'] > 1)
-      assert(fe['user'] > 1)
-      fe['date'] = int(row['date_']) if 'date_' in row else FLAGS.test_day
-      fe['day'] = fe['date'] % 7
-      fe['device'] = row['device']
-
-      fe['finish_rate'] = row['finish_rate'] if 'finish_rate' in row else 1.
-      fe['stay_rate'] = row['stay_rate'] if 'stay_rate' in row else 1.
-      fe['is_first'] = row['is_first'] if 'is_first' in row else 1
-      fe['is_neg'] = int(is_neg_row)
-      fe['num_actions'] = row['actions'] if 'actions' in row else 0
-
-      # ------feed静态特征
-      feed = feeds[fe['feedid']]
-
-      video_time = int(feed['videoplayseconds'])
-      if video_time > 120:
-        video_time = 62
-      elif video_time > 60:
-        video_time = 61
-      fe['video_time'] = video_time + 1
-
-      video_time2 = int(video_time / 10)
-      if video_time > 120:
-        video_time2 = 8
-      elif video_time > 60:
-        video_time2 = 7
-
-      fe['video_time2'] = video_time2 + 1
-      video_display = min(video_time, 60) / 60.
-      fe['video_display'] = video_display
-
-      for key in DOC_STATIC_FEATS:
-        fe[key] = feed[key]
-
-      fe['fresh'] = fe['date'] - feed['start_day'] if 'start_day' in feed else FLAGS.test_day
-
-      # doc dynamic features
-      if FLAGS.use_doc_dynamic:
-        fd = doc_dynamic_feature[fe['feedid']]
-        fe.update(get_doc_dynamic_feats(fd, fe['feedid'], fe['date'], doc_dynamic_feats))     
-
-      # label
-      for key in KEYS:
-        fe[key] = float(row[key]) if key in row else 0.
+  # label
+  for key in KEYS:
+    fe[key] = float(row[key]) if key in row else 0.
 
-      if FLAGS.use_history:
-        for action in HIS_ACTIONS:
-          # 注意per day的history_{day}.pkl是转换docid之后的
-          fe[f'{action}s'], fe[f'{action}s_spans'] = get_history(fe['userid'], fe['doc'], action, fe['date'], bool(fe['is_first']))
+  if FLAGS.use_history:
+    for action in HIS_ACTIONS:
+      fe[f'{action}s'] = get_history(his, f'{action}s', i)
+      fe[f'{action}s_spans'] = get_history(his, f'{action}s_spans', i)
 
-      if FLAGS.use_feed_history:
-        for action in HIS_ACTIONS:
-          # 注意per day的history_{day}.pkl是转换docid之后的
-          ret = get_feed_history(fe['user'], fe['feedid'], action, fe['date'], bool(fe['is_first']))
-          if ret is not None:
-            fe[f'u_{action}s'] = ret
-        
-      if FLAGS.use_today:
-        fe['todays'] = gezi.pad([doc_vocab.id(x) for x in todays[fe['date']][fe['userid']] if x != fe['feedid']], MAX_SHOWS)
-        if FLAGS.use_feed_history:
-          fe['u_todays'] = gezi.pad([user_vocab.id(x) for x in todays2[fe['date']][fe['feedid']] if x != fe['userid']], MAX_SHOWS)
-      
-      if doc_info:
-        for key in doc_info:
-          fe[key] = list(doc_info[key][fe['doc']])
+  if FLAGS.use_feed_history:
+    for action in HIS_ACTIONS:
+      # 没有该action的feed不写入
+      if his[f'u_{action}s'][2][i]:
+        fe[f'u_{action}s'] = get_history(his, f'u_{action}s', i)
+    
+  if FLAGS.use_today:
+    fe['todays'] = gezi.pad([doc_vocab.id(x) for x in todays[fe['date']][fe['userid']] if x != fe['feedid']], MAX_SHOWS)
+    if FLAGS.use_feed_history:
+      fe['u_todays'] = gezi.pad([user_vocab.id(x) for x in todays2[fe['date']][fe['feedid']] if x != fe['userid']], MAX_SHOWS)
+  
+  if doc_info:
+    for key in doc_info:
+      fe[key] = list(doc_info[key][fe['doc']])
 
-      writer.write_feature(fe)
+  return fe
 
 def main(data_dir):
   global df, user_vocab, doc_vocab, history, history_days
-  global doc_info, doc_dynamic_feature, default_vals, DAYS, HIS_ACTIONS
+  global doc_info, doc_stats, default_vals, DAYS, HIS_ACTIONS
   FLAGS.version = FLAGS.version_
   np.random.seed(FLAGS.seed_)
 
-  user_vocab = gezi.Vocab('../input/user_vocab.txt')
-  doc_vocab = gezi.Vocab('../input/doc_vocab.txt')
+  # memory-mapped, workers share the pages
+  user_vocab = gezi.ArrayVocab('../input/user_vocab.txt', cache_dir='../input/user_vocab.arr')
+  doc_vocab = gezi.ArrayVocab('../input/doc_vocab.txt', cache_dir='../input/doc_vocab.arr')
 
   if FLAGS.write_docinfo:
     doc_lookup_file = '../input/doc_lookup.npy' if FLAGS.rare_unk else '../input/doc_ori_lookup.npy'
@@ -436,14 +421,15 @@ def main(data_dir):
   if FLAGS.mark != 'test':
     ic('non_first rate', len(df[df.is_first == 0]) / len(df))
 
+  # history index is built once from history_{day}.pkl and then memory-mapped, shared by all workers
   if FLAGS.use_history:
     for day in tqdm(DAYS, desc='read history_days'):
       history_file = f'../input/history_{day}.pkl'
       ic(day, history_file)
-      history_days[day] = gezi.read_pickle(history_file)
+      history_days[day] = get_day_index(history_file, f'../input/history_index/{day}')
 
     if not HIS_ACTIONS:
-      HIS_ACTIONS = list(list(history_days[list(DAYS)[0]].values())[0].keys())
+      HIS_ACTIONS = list(history_days[list(DAYS)[0]].keys())
       HIS_ACTIONS = [x for x in HIS_ACTIONS if x not in FLAGS.excl_actions]
       ic('his_actions', HIS_ACTIONS)
 
@@ -451,12 +437,25 @@ def main(data_dir):
     for day in tqdm(DAYS, desc='read feed history_days'):
       history_file = f'../input/feed_history_{day}.pkl'
       ic(day, history_file)
-      feed_history_days[day] = gezi.read_pickle(history_file)
+      feed_history_days[day] = get_day_index(history_file, f'../input/feed_history_index/{day}', with_spans=False)
 
   if FLAGS.use_doc_dynamic:
     ic('load doc dynamic feature')
+    # prefix sums are built once from the pickle and memory-mapped by all workers and later runs
+    doc_stats_dir = '../input/doc_dynamic_stats'
     doc_dynamic_feature_file = '../input/doc_dynamic_feature.pkl'
-    doc_dynamic_feature = gezi.load_pickle(doc_dynamic_feature_file)
+    names = ['shows', 'actions'] + ACTIONS + ['finish_rate', 'stay_rate']
+    # rebuilt when the pickle (or names) changed
+    stat = os.stat(doc_dynamic_feature_file)
+    source = dict(mtime=stat.st_mtime, size=stat.st_size, names=names)
+    source_file = f'{doc_stats_dir}/source.json'
+    if not os.path.exists(source_file) or json.load(open(source_file)) != source:
+      doc_dynamic_feature = gezi.load_pickle(doc_dynamic_feature_file)
+      gezi.WindowStats.from_dict(doc_dynamic_feature, names).save(doc_stats_dir)
+      del doc_dynamic_feature
+      with open(source_file, 'w') as f:
+        json.dump(source, f)
+    doc_stats = gezi.WindowStats.load(doc_stats_dir)
 
   if FLAGS.use_today:
     today_shows = df.groupby(['userid', 'date_'])['feedid'].progress_apply(list).reset_index(name='feedids')
@@ -497,36 +496,19 @@ def main(data_dir):
   # elif FLAGS.mark == 'train-all':
   #   FLAGS.num_records *= 20
 
+  if FLAGS.debug:
+    FLAGS.records_name = 'tfrecords.debug'
+  out_dir = get_out_dir()
+  ic(out_dir)
+  index = 0 if FLAGS.debug else FLAGS.index
+  # buffer_size = None if not 'train' in FLAGS.mark or FLAGS.sort_method else 10000
+  buffer_size = FLAGS.buf_size # much faster with buffer_size so less write to disk
   with gezi.Timer('build_feature'):
-    if FLAGS.debug:
-      FLAGS.records_name = 'tfrecords.debug'
-      build_features(0)
-    elif FLAGS.index is not None:
-      build_features(FLAGS.index)
-    else:
-      nw = max(min(cpu_count() - FLAGS.ignore_cpus, FLAGS.num_records), 1)
-      if nw == FLAGS.num_records:
-        ic(FLAGS.num_records)
-        with Pool(FLAGS.num_records) as p:
-          p.map(build_features, range(FLAGS.num_records))
-      else:
-        #这里注意要有足够的num_records数目 使得一次进程处理的数据量足够小 运行时间不要太长 否则一次并行会hang 
-        # 预计简单使用openmp效果一样
-        FLAGS.num_records = -(-FLAGS.num_records // nw) * nw
-        ic('cpu_count:', cpu_count(), 'num_records', FLAGS.num_records)
-        l = np.array_split(range(FLAGS.num_records), int(FLAGS.num_records / nw))
-        for i in tqdm(range(len(l))):
-          with Pool(len(l[i])) as p:
-            p.map(build_features, l[i])
-#       else:
-#         FLAGS.num_records = -(-FLAGS.num_records // nw) * nw
-#         ic('cpu_count:', cpu_count(), 'num_records', FLAGS.num_records)
-#         l = np.array_split(range(FLAGS.num_records), int(FLAGS.num_records / nw))
-#   #     ic(l)
-#         for i in tqdm(range(len(l))):
-#           with pymp.Parallel(len(l[i])) as p:
-#             for j in p.range(len(l[i])):
-#               build_feautres(l[i][j])
+    melt.tfrecords.gen_records(out_dir, data=df, chunk_fn=build_features, 
+                               num_shards=FLAGS.num_records, 
+                               num_workers=cpu_count() - FLAGS.ignore_cpus,
+                               buffer_size=buffer_size, shuffle=False, 
+                               index=index)
 
 if __name__ == '__main__':
   flags.DEFINE_string('mark', 'train', 'train or valid or test or train_all')
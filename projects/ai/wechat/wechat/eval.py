@@ -74,38 +74,17 @@ def uAUC_(index, labels, preds, user_id_list):
 
 def uAUC(labels, preds, user_id_list, index=None):
     """Calculate user AUC"""
-
-    user_pred = defaultdict(lambda: [])
-    user_truth = defaultdict(lambda: [])
-    for idx, truth in tqdm(enumerate(labels), ascii=False, desc='uAUC', total=len(labels), leave=False):
-        user_id = user_id_list[idx]
-        pred = preds[idx]
-        truth = labels[idx]
-        user_pred[user_id].append(pred)
-        user_truth[user_id].append(truth)
+    _, aucs, user_ids = gezi.metrics.grouped_auc(labels, preds, user_id_list)
+    aucs = aucs[:, 0]
 
     if index is not None:
       start, end = gezi.get_fold(len(user_id_list), FLAGS.auc_threads, index)
-      user_id_list = user_id_list[start: end]
-
-    user_flag = defaultdict(lambda: False)
-    for user_id in set(user_id_list):
-        truths = user_truth[user_id]
-        flag = False
-        # 若全是正样本或全是负样本，则flag为False
-        for i in range(len(truths) - 1):
-            if truths[i] != truths[i + 1]:
-                flag = True
-                break
-        user_flag[user_id] = flag
-
-    total_auc = 0.0
-    size = 0.0
-    for user_id in user_flag:
-        if user_flag[user_id]:
-            auc = fast_auc(np.asarray(user_truth[user_id]), np.asarray(user_pred[user_id]))
-            total_auc += auc 
-            size += 1.0
+      aucs = aucs[np.isin(user_ids, np.asarray(user_id_list[start: end]))]
+
+    # 若全是正样本或全是负样本，则auc为nan 不参与计算
+    aucs = aucs[~np.isnan(aucs)]
+    total_auc = aucs.sum()
+    size = float(len(aucs))
     
     user_auc = float(total_auc)/size if size > 0 else 0.5
 
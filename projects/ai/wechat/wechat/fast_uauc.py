@@ -1,9 +1,9 @@
 import os
 import numpy as np
 import pandas as pd
+import gezi
 from numba import njit
 from scipy.stats import rankdata
-from joblib import Parallel, delayed
 
 @njit
 def _auc(actual, pred_ranks):
@@ -18,26 +18,6 @@ def auc(actual, predicted):
     return _auc(actual, pred_ranks)
 
 def uAUC(y_true, y_pred, userids, weights):
-    num_labels = y_pred.shape[1]
-
-    def uAUC_infunc(i):
-        uauc_df = pd.DataFrame()
-        uauc_df['userid'] = userids
-        uauc_df['y_true'] = y_true[:, i]
-        uauc_df['y_pred'] = y_pred[:, i]
-
-        label_nunique = uauc_df.groupby(by='userid')['y_true'].transform('nunique')
-        uauc_df = uauc_df[label_nunique == 2]
-        
-        aucs = uauc_df.groupby(by='userid').apply(
-            lambda x: auc(x['y_true'].values, x['y_pred'].values))
-        return np.mean(aucs)
-
-    ## Parallel will hang on v100 machine, _pickle.PicklingError: Could not pickle the task to send it to the workers.
-    # if 'tione' in os.environ['PATH']: 
-    uauc = np.asarray([uAUC_infunc(i) for i in range(num_labels)])
-    # else:
-    #   uauc = Parallel(n_jobs=len(weights))(delayed(uAUC_infunc)(i) for i in range(num_labels))
-
+    # all actions share one sort by userid, see gezi.metrics.grouped_auc
+    uauc, _, _ = gezi.metrics.grouped_auc(y_true, y_pred, userids)
     return np.average(uauc, weights=weights), uauc
-  
\ No newline at end of file
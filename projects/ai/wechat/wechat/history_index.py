@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   history_index.py
+#        \author   chenghuige
+#          \date   2021-10-14 11:02:35.716820
+#   \Description   CSR history index per day and action, built once from
+#                  history_{day}.pkl / feed_history_{day}.pkl, saved as .npy
+#                  and memory-mapped by gen-records workers
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import numpy as np
+from numba import njit
+
+import gezi
+from gezi import tqdm
+
+# no valid feed/user id equals this, used as exclude for is_first rows
+NO_EXCLUDE = np.iinfo(np.int64).min
+
+@njit
+def _lookup(keys, offsets, values, spans, query_keys, excludes, max_len,
+            out_values, out_spans, lengths, found):
+  n = len(query_keys)
+  pos = np.searchsorted(keys, query_keys)
+  for i in range(n):
+    if pos[i] >= len(keys) or keys[pos[i]] != query_keys[i]:
+      continue
+    found[i] = True
+    k = 0
+    for j in range(offsets[pos[i]], offsets[pos[i] + 1]):
+      if values[j] == excludes[i]:
+        continue
+      out_values[i, k] = values[j]
+      if spans is not None:
+        out_spans[i, k] = spans[j]
+      k += 1
+      if k == max_len:
+        break
+    lengths[i] = k
+
+
+class HistoryIndex(object):
+  """
+  Histories of one action as CSR: rows of keys[i] (userid or feedid, sorted) are
+  values[offsets[i]:offsets[i + 1]] (doc or user ids, same order as the pickled lists)
+  and optional spans.
+  """
+  def __init__(self, keys, offsets, values, spans=None):
+    self.keys = keys
+    self.offsets = offsets
+    self.values = values
+    self.spans = spans
+
+  @staticmethod
+  def build(history, action, with_spans=True):
+    """history: dict key -> dict action -> values list or (values, spans) lists, keys without action are absent"""
+    keys = np.asarray(sorted(key for key in history if action in history[key]), dtype=np.int64)
+    lengths = np.zeros(len(keys), dtype=np.int64)
+    values, spans = [], []
+    for i, key in enumerate(keys):
+      item = history[key][action]
+      if with_spans:
+        values_, spans_ = item
+        spans.extend(spans_)
+      else:
+        values_ = item
+      values.extend(values_)
+      lengths[i] = len(values_)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return HistoryIndex(keys, offsets, np.asarray(values, dtype=np.int32),
+                        np.asarray(spans, dtype=np.int32) if with_spans else None)
+
+  def save(self, path):
+    np.save(f'{path}.keys.npy', self.keys)
+    np.save(f'{path}.offsets.npy', self.offsets)
+    np.save(f'{path}.values.npy', self.values)
+    if self.spans is not None:
+      np.save(f'{path}.spans.npy', self.spans)
+    else:
+      # from an earlier build with spans
+      gezi.try_remove(f'{path}.spans.npy')
+
+  @staticmethod
+  def load(path, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    spans_file = f'{path}.spans.npy'
+    return HistoryIndex(np.load(f'{path}.keys.npy', mmap_mode=mmap_mode),
+                        np.load(f'{path}.offsets.npy', mmap_mode=mmap_mode),
+                        np.load(f'{path}.values.npy', mmap_mode=mmap_mode),
+                        np.load(spans_file, mmap_mode=mmap_mode) if os.path.exists(spans_file) else None)
+
+  def lookup(self, keys, excludes=None, max_len=50):
+    """
+    For each keys[i], first max_len values not equal to excludes[i], zero padded.
+    Returns values [n, max_len] int32, spans [n, max_len] int32 or None, lengths [n], found [n] bool
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    n = len(keys)
+    if excludes is None:
+      excludes = np.full(n, NO_EXCLUDE, dtype=np.int64)
+    out_values = np.zeros((n, max_len), dtype=np.int32)
+    out_spans = np.zeros((n, max_len), dtype=np.int32) if self.spans is not None else None
+    lengths = np.zeros(n, dtype=np.int64)
+    found = np.zeros(n, dtype=np.bool_)
+    _lookup(self.keys, self.offsets, self.values, self.spans, keys,
+            np.asarray(excludes, dtype=np.int64), max_len, out_values, out_spans, lengths, found)
+    return out_values, out_spans, lengths, found
+
+
+def build_day_index(history, with_spans=True, actions=None):
+  if actions is None:
+    actions = set()
+    for key in history:
+      actions.update(history[key].keys())
+    actions = sorted(actions)
+  return {action: HistoryIndex.build(history, action, with_spans) \
+            for action in tqdm(actions, desc='build_history_index', leave=False)}
+
+
+def save_day_index(index, dir):
+  os.makedirs(dir, exist_ok=True)
+  for action in index:
+    index[action].save(f'{dir}/{action}')
+  with open(f'{dir}/actions.json', 'w') as f:
+    json.dump(list(index.keys()), f)
+
+
+def load_day_index(dir, mmap=True):
+  actions = json.load(open(f'{dir}/actions.json'))
+  return {action: HistoryIndex.load(f'{dir}/{action}', mmap) for action in actions}
+
+
+def get_day_index(pickle_file, index_dir, with_spans=True):
+  """
+  Load memory-mapped index from index_dir, build it from pickle_file on first use
+  and again when the pickle (mtime, size) or with_spans changed
+  """
+  stat = os.stat(pickle_file)
+  source = dict(mtime=stat.st_mtime, size=stat.st_size, with_spans=with_spans)
+  source_file = f'{index_dir}/source.json'
+  if not os.path.exists(f'{index_dir}/actions.json') or not os.path.exists(source_file) \
+      or json.load(open(source_file)) != source:
+    history = gezi.read_pickle(pickle_file)
+    save_day_index(build_day_index(history, with_spans), index_dir)
+    del history
+    with open(source_file, 'w') as f:
+      json.dump(source, f)
+  return load_day_index(index_dir)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   history_index_test.py
+#        \author   chenghuige
+#          \date   2021-10-20 15:02:44.873310
+#   \Description   python -m pytest history_index_test.py (in this dir, utils in PYTHONPATH)
+#                  CSR lookups against the old dict based get_history
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import numpy as np
+
+import gezi
+from history_index import HistoryIndex, build_day_index, get_day_index, NO_EXCLUDE
+
+def _gen_history(seed=0, num_keys=50, actions=('read_comment', 'like', 'click')):
+  rng = np.random.default_rng(seed)
+  history = {}
+  for key in rng.choice(1000, num_keys, replace=False).tolist():
+    history[key] = {}
+    for action in actions:
+      if rng.random() < 0.7:
+        n = int(rng.integers(0, 30))
+        history[key][action] = (rng.integers(1, 20, n).tolist(), rng.integers(0, 100, n).tolist())
+  return history
+
+def _get_history(history, key, action, exclude, len_):
+  # old gen-records get_history, not dynamic_len
+  feeds, spans = history[key][action]
+  feeds_, spans_ = [], []
+  for feed, span in zip(feeds, spans):
+    if feed == exclude:
+      continue
+    feeds_.append(feed)
+    spans_.append(span)
+    if len(feeds_) == len_:
+      break
+  return gezi.pad(feeds_, len_), gezi.pad(spans_, len_)
+
+def test_lookup_same_as_dict():
+  history = _gen_history()
+  index = build_day_index(history)
+  keys = list(history) + [-5, 100000]
+  len_ = 8
+  for action in index:
+    excludes = np.asarray([history[key][action][0][0] if key in history and action in history[key] and history[key][action][0] 
+                           else NO_EXCLUDE for key in keys], dtype=np.int64)
+    values, spans, lengths, found = index[action].lookup(keys, excludes, len_)
+    for i, key in enumerate(keys):
+      assert found[i] == (key in history and action in history[key])
+      if not found[i]:
+        assert lengths[i] == 0 and not values[i].any()
+        continue
+      feeds, spans_ = _get_history(history, key, action, excludes[i], len_)
+      assert values[i].tolist() == feeds and spans[i].tolist() == spans_
+      assert lengths[i] == np.count_nonzero(np.asarray(feeds))
+
+def test_no_spans():
+  history = dict((key, dict((action, feeds) for action, (feeds, _) in item.items()))
+                 for key, item in _gen_history(1).items())
+  index = HistoryIndex.build(history, 'like', with_spans=False)
+  values, spans, lengths, found = index.lookup(list(history), max_len=100)
+  assert spans is None
+  for i, key in enumerate(history):
+    if 'like' in history[key]:
+      assert values[i, :lengths[i]].tolist() == history[key]['like']
+
+def test_rebuild_when_pickle_changes(tmp_path):
+  pickle_file, index_dir = str(tmp_path / 'history.pkl'), str(tmp_path / 'index')
+  history = _gen_history(2)
+  gezi.save_pickle(history, pickle_file)
+  key = next(key for key in history if 'like' in history[key] and history[key]['like'][0])
+  index = get_day_index(pickle_file, index_dir)
+  assert index['like'].lookup([key], max_len=100)[0][0, 0] == history[key]['like'][0][0]
+  history[key]['like'] = ([777], [1])
+  gezi.save_pickle(history, pickle_file)
+  # a different mtime even on coarse clocks
+  os.utime(pickle_file, (time.time() + 10, time.time() + 10))
+  assert get_day_index(pickle_file, index_dir)['like'].lookup([key])[0][0, 0] == 777
+  # rebuilt without spans, spans files of the earlier build are gone
+  history = dict((key, dict((action, feeds) for action, (feeds, _) in item.items())) for key, item in history.items())
+  gezi.save_pickle(history, pickle_file)
+  index = get_day_index(pickle_file, index_dir, with_spans=False)
+  assert index['like'].spans is None and index['like'].lookup([key])[0][0, 0] == 777
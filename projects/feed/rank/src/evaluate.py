@@ -86,33 +86,23 @@ def eval(durations, pred, uids, selected_uids=None, group=False, mode='all',
   # logits = pred
   # prob = gezi.sigmoid(logits)
 
-  try:
-    auc = roc_auc_score(y_true, prob)
-  except Exception:
-    auc = np.nan
-
-  try:
-    loss = log_loss(y_true, prob)
-  except Exception:
-    loss = np.nan
+  # sort preds once, all auc/time_auc/loss below reuse the order on full set or subsets (masks)
+  ranked = gezi.metrics.RankedPreds(prob)
+  auc = ranked.auc(y_true)
+  loss = ranked.log_loss(y_true)
 
   # TODO dur prob calc should use same code as loss.py
   dur_flags = durations >= 0
   durations2 = durations[dur_flags]
   dur_prob_true = np.minimum(durations / float(max_duration or FLAGS.max_duration), 1.)
   dur_prob_true2 = dur_prob_true[dur_flags]
-  prob2 = prob[dur_flags]
-  prob2 = np.minimum(prob2, 1.) # online ori lr score might has 1.+ 
-  try:
-    loss_dur = torch.nn.BCELoss()(torch.as_tensor(prob2, dtype=torch.float), torch.as_tensor(dur_prob_true2, dtype=torch.float)).numpy()
-  except Exception:
-    logging.warning(traceback.format_exc())
-    loss_dur = np.nan
+  # online ori lr score might has 1.+ 
+  ranked2 = ranked if not len(prob) or prob.max() <= 1. else gezi.metrics.RankedPreds(np.minimum(prob, 1.))
+  loss_dur = ranked2.bce(dur_prob_true, dur_flags)
   logging.debug('auc', auc, 'loss', loss, 'loss_dur', loss_dur)
   
-  # timer = gezi.Timer('inverse_ratio', True)
-  inv_ratio = gezi.metrics.inverse_ratio(durations2, prob2)
-  mse, mae = mean_squared_error(dur_prob_true2, prob2), mean_absolute_error(dur_prob_true2, prob2)
+  inv_ratio = ranked2.inverse_ratio(durations, dur_flags)
+  mse, mae = ranked2.mse_mae(dur_prob_true, dur_flags)
    
   result = dict(auc=auc, 
                 mse=mse, 
@@ -124,11 +114,11 @@ def eval(durations, pred, uids, selected_uids=None, group=False, mode='all',
   if video_times is not None:
     try:
       vtime_stats = {}
-      inv_ratio_vtime = gezi.metrics.inverse_ratio(video_times, prob)
+      inv_ratio_vtime = ranked.inverse_ratio(video_times)
       # if one video is viewed by more then max_duration(600s) then finish ratio is also 1
       # finish_ratios = np.minimum(durations / np.maximum(np.minimum(video_times, FLAGS.max_duration), FLAGS.min_video_time), 1.)
       finish_ratios = np.minimum(durations / np.minimum(video_times, FLAGS.max_duration), 1.)
-      inv_ratio_finish = gezi.metrics.inverse_ratio(finish_ratios, prob)
+      inv_ratio_finish = ranked.inverse_ratio(finish_ratios)
       vtime_stats = dict(vtime_auc=1. - inv_ratio_vtime,
                         finish_auc=1. - inv_ratio_finish)
       result.update(vtime_stats)
@@ -137,11 +127,11 @@ def eval(durations, pred, uids, selected_uids=None, group=False, mode='all',
 
   if read_completion_rates is not None:
     rcr_flags = read_completion_rates >= 0.
-    inv_ratio_rcr = gezi.metrics.inverse_ratio(read_completion_rates[rcr_flags], prob[rcr_flags])
+    inv_ratio_rcr = ranked.inverse_ratio(read_completion_rates, rcr_flags)
     result['rcr_auc'] = 1. - inv_ratio_rcr
 
   if page_times is not None:
-    inv_ratio_ptime = gezi.metrics.inverse_ratio(page_times, prob)
+    inv_ratio_ptime = ranked.inverse_ratio(page_times)
     result['ptime_auc'] = 1. - inv_ratio_ptime
   
   click_flag = durations != 0
@@ -149,7 +139,6 @@ def eval(durations, pred, uids, selected_uids=None, group=False, mode='all',
   durations_click = durations[click_flag]
   durations_click2 = durations[click_flag2]
   prob_click = prob[click_flag]
-  prob_click2 = prob[click_flag2]
   assert len(durations_click) > 0, 'all druations 0?'
   if len(durations_click) == 0:
     logging.warning('all durations 0')
@@ -177,14 +166,10 @@ def eval(durations, pred, uids, selected_uids=None, group=False, mode='all',
     stats_result = gezi.dict_prefix(stats_result, 'stats/')
     result.update(stats_result)
 
-  inv_ratio_click = gezi.metrics.inverse_ratio(durations_click2, prob_click2)  
+  inv_ratio_click = ranked.inverse_ratio(durations, click_flag2)
 
-  dur_prob_true_click2 = dur_prob_true[click_flag2]
-  try:
-    loss_dur_click = torch.nn.BCELoss()(torch.as_tensor(prob_click2, dtype=torch.float), torch.as_tensor(dur_prob_true_click2, dtype=torch.float)).numpy()
-  except Exception:
-    loss_dur_click = np.nan
-  mse_click, mae_click = mean_squared_error(dur_prob_true_click2, prob_click2), mean_absolute_error(dur_prob_true_click2, prob_click2)
+  loss_dur_click = ranked.bce(dur_prob_true, click_flag2)
+  mse_click, mae_click = ranked.mse_mae(dur_prob_true, click_flag2)
 
   result['click/concordant'] = (1. - inv_ratio_click)
   result['click/loss/dur'] = loss_dur_click 
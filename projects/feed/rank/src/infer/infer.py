@@ -191,30 +191,30 @@ def main(_):
           index, value, field = x['index'], x['value'], x['field']
           assert len(predictor.graph.get_collection('index_feed')) == 1
           feed_dict = {
-                        predictor.graph.get_collection('index_feed')[-1]: index,
-                        predictor.graph.get_collection('value_feed')[-1]: value,
-                        predictor.graph.get_collection('field_feed')[-1]: field,
-                        predictor.graph.get_collection('uid_feed')[-1]: uid.reshape(-1, 1),
-                        predictor.graph.get_collection('did_feed')[-1]: did.reshape(-1, 1),
-                        #predictor.graph.get_collection('doc_idx_feed')[-1]: history,
+                        predictor.get_tensor('index_feed'): index,
+                        predictor.get_tensor('value_feed'): value,
+                        predictor.get_tensor('field_feed'): field,
+                        predictor.get_tensor('uid_feed'): uid.reshape(-1, 1),
+                        predictor.get_tensor('did_feed'): did.reshape(-1, 1),
+                        #predictor.get_tensor('doc_idx_feed'): history,
                       } 
 
           try:
             feed_dict.update({
-                        predictor.graph.get_collection('time_interval_feed')[-1]: x['time_interval'].reshape(-1, 1),
-                        predictor.graph.get_collection('time_weekday_feed')[-1]: x['time_weekday'].reshape(-1, 1),
-                        predictor.graph.get_collection('timespan_interval_feed')[-1]: x['timespan_interval'].reshape(-1, 1),             
-                        predictor.graph.get_collection('product_feed')[-1]: product_.reshape(-1, 1),
-                        predictor.graph.get_collection('doc_kw_idx_feed')[-1]: x['doc_keyword'],
-                        predictor.graph.get_collection('doc_topic_idx_feed')[-1]: x['doc_topic'].reshape(-1,1),
-                        predictor.graph.get_collection('tw_history_feed')[-1]: x['tw_history'],
-                        predictor.graph.get_collection('tw_history_topic_feed')[-1]: x['tw_history_topic'],
-                        predictor.graph.get_collection('tw_history_rec_feed')[-1]: x['tw_history_rec'],
-                        predictor.graph.get_collection('tw_history_kw_feed')[-1]: x['tw_history_kw'],
-                        predictor.graph.get_collection('vd_history_feed')[-1]: x['vd_history'],
-                        predictor.graph.get_collection('vd_history_topic_feed')[-1]: x['vd_history_topic'],
-                        predictor.graph.get_collection('user_active_feed')[-1]: x['user_active'].reshape(-1,1),
-                        predictor.graph.get_collection('rea_feed')[-1]: x['rea'].astype(int).reshape(-1,1)
+                        predictor.get_tensor('time_interval_feed'): x['time_interval'].reshape(-1, 1),
+                        predictor.get_tensor('time_weekday_feed'): x['time_weekday'].reshape(-1, 1),
+                        predictor.get_tensor('timespan_interval_feed'): x['timespan_interval'].reshape(-1, 1),             
+                        predictor.get_tensor('product_feed'): product_.reshape(-1, 1),
+                        predictor.get_tensor('doc_kw_idx_feed'): x['doc_keyword'],
+                        predictor.get_tensor('doc_topic_idx_feed'): x['doc_topic'].reshape(-1,1),
+                        predictor.get_tensor('tw_history_feed'): x['tw_history'],
+                        predictor.get_tensor('tw_history_topic_feed'): x['tw_history_topic'],
+                        predictor.get_tensor('tw_history_rec_feed'): x['tw_history_rec'],
+                        predictor.get_tensor('tw_history_kw_feed'): x['tw_history_kw'],
+                        predictor.get_tensor('vd_history_feed'): x['vd_history'],
+                        predictor.get_tensor('vd_history_topic_feed'): x['vd_history_topic'],
+                        predictor.get_tensor('user_active_feed'): x['user_active'].reshape(-1,1),
+                        predictor.get_tensor('rea_feed'): x['rea'].astype(int).reshape(-1,1)
               })
           except Exception:
             print("mktest infer error1111111", traceback.format_exc(), file=sys.stderr)
@@ -223,19 +223,19 @@ def main(_):
 
           try:
             feed_dict.update({
-                        predictor.graph.get_collection('mktest_distribution_id_feed')[-1]: x['mktest_distribution_id_feed'].reshape(-1, 1),
+                        predictor.get_tensor('mktest_distribution_id_feed'): x['mktest_distribution_id_feed'].reshape(-1, 1),
 
-                        predictor.graph.get_collection('mktest_tw_history_kw_feed')[-1]: x['mktest_tw_history_kw_feed'],
-                        predictor.graph.get_collection('mktest_vd_history_kw_feed')[-1]: x['mktest_vd_history_kw_feed'],
-                        predictor.graph.get_collection('mktest_rel_vd_history_kw_feed')[-1]: x['mktest_rel_vd_history_kw_feed'],
-                        predictor.graph.get_collection('mktest_tw_long_term_kw_feed')[-1]: x['mktest_tw_long_term_kw_feed'],
-                        predictor.graph.get_collection('mktest_vd_long_term_kw_feed')[-1]: x['mktest_vd_long_term_kw_feed'],
-                        predictor.graph.get_collection('mktest_long_search_kw_feed')[-1]: x['mktest_long_search_kw_feed'],
-                        predictor.graph.get_collection('mktest_new_search_kw_feed')[-1]: x['mktest_new_search_kw_feed'],
-                        predictor.graph.get_collection('mktest_user_kw_feed')[-1]: x['mktest_user_kw_feed'],
+                        predictor.get_tensor('mktest_tw_history_kw_feed'): x['mktest_tw_history_kw_feed'],
+                        predictor.get_tensor('mktest_vd_history_kw_feed'): x['mktest_vd_history_kw_feed'],
+                        predictor.get_tensor('mktest_rel_vd_history_kw_feed'): x['mktest_rel_vd_history_kw_feed'],
+                        predictor.get_tensor('mktest_tw_long_term_kw_feed'): x['mktest_tw_long_term_kw_feed'],
+                        predictor.get_tensor('mktest_vd_long_term_kw_feed'): x['mktest_vd_long_term_kw_feed'],
+                        predictor.get_tensor('mktest_long_search_kw_feed'): x['mktest_long_search_kw_feed'],
+                        predictor.get_tensor('mktest_new_search_kw_feed'): x['mktest_new_search_kw_feed'],
+                        predictor.get_tensor('mktest_user_kw_feed'): x['mktest_user_kw_feed'],
 
-                        predictor.graph.get_collection('mktest_doc_kw_feed')[-1]: x['mktest_doc_kw_feed'],
-                        predictor.graph.get_collection('mktest_doc_kw_secondary_feed')[-1]: x['mktest_doc_kw_secondary_feed'],
+                        predictor.get_tensor('mktest_doc_kw_feed'): x['mktest_doc_kw_feed'],
+                        predictor.get_tensor('mktest_doc_kw_secondary_feed'): x['mktest_doc_kw_secondary_feed'],
               })
           except Exception:
             print("mktest infer error", traceback.format_exc(), file=sys.stderr)
@@ -16,8 +16,7 @@ import sys
 import os
 
 import math
-import subprocess
-import linecache
+import mmap
 from tqdm import tqdm
 
 import tensorflow as tf 
@@ -32,15 +31,82 @@ import numpy as np
 
 from projects.feed.rank.src.config import *
 
+class LineFile(object):
+  """
+  Random access to lines of a large text file without loading it.
+  Line start offsets are built once by one chunked scan and saved next to the file as <file>.idx.npy (uint64),
+  line i is bytes [offsets[i], offsets[i + 1]), read from a memory map opened lazily in each process (DataLoader worker).
+  """
+  def __init__(self, filename, index_file=None, chunk_size=1 << 26):
+    self.filename = filename
+    self.index_file = index_file or f'{filename}.idx.npy'
+    self.chunk_size = chunk_size
+    self.offsets = self.load_index()
+    self._mm = None
+    self._pid = None
+
+  def build_index(self):
+    starts = [np.zeros(1, dtype=np.uint64)]
+    size = 0
+    with open(self.filename, 'rb') as f:
+      while True:
+        chunk = f.read(self.chunk_size)
+        if not chunk:
+          break
+        starts.append((np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10) + size + 1).astype(np.uint64))
+        size += len(chunk)
+    offsets = np.concatenate(starts)
+    # last line without newline
+    if offsets[-1] != size:
+      offsets = np.append(offsets, np.uint64(size))
+    return offsets
+
+  def load_index(self):
+    if os.path.exists(self.index_file) and os.path.getmtime(self.index_file) >= os.path.getmtime(self.filename):
+      return np.load(self.index_file, mmap_mode='r')
+    offsets = self.build_index()
+    try:
+      np.save(f'{self.index_file}.tmp.npy', offsets)
+      os.replace(f'{self.index_file}.tmp.npy', self.index_file)
+    except OSError:
+      # read only dir, keep index in memory
+      pass
+    return offsets
+
+  @property
+  def mm(self):
+    if self._mm is None or self._pid != os.getpid():
+      with open(self.filename, 'rb') as f:
+        self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.filename) else b''
+      self._pid = os.getpid()
+    return self._mm
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, idx):
+    return self.mm[int(self.offsets[idx]):int(self.offsets[idx + 1])].rstrip(b'\n')
+
+  def lines(self, start, end):
+    """contiguous rows [start, end) with one read"""
+    if end <= start:
+      return []
+    data = self.mm[int(self.offsets[start]):int(self.offsets[end])]
+    # only the last newline, empty lines inside the block are kept
+    if data.endswith(b'\n'):
+      data = data[:-1]
+    return data.split(b'\n')
+
 # text dataset is slow when file is large (each line with more features like dense embedding 128)
 class TextDataset(Dataset):
   def __init__(self, filename, td):
     self._filename = filename
-    self._total_data = int(subprocess.check_output("wc -l " + filename, shell=True).split()[0]) 
+    self.lines = LineFile(filename)
+    self._total_data = len(self.lines)
     self.td = td 
 
   def __getitem__(self, idx):
-    line = linecache.getline(self._filename, idx + 1)
+    line = self.lines[idx]
     # lis, list, list, scalar, scalar
     feat_id, feat_field, feat_value, [label], [id] = self.td.parse_line(line, decode=False)
     ## this will use lele.NpDictPadCollate
@@ -48,21 +114,45 @@ class TextDataset(Dataset):
     duration = 123
     
     return {'index': feat_id, 'field': feat_field, 'value': feat_value, 'id': id, 'duration': duration}, label
-  
-    X = {'index': torch.tensor(feat_id), 'field': torch.tensor(feat_field), 'value': torch.tensor(feat_value), 'id': id} 
-    
-    if FLAGS.use_doc_emb:
-      X['doc_emb'] = torch.tensor(doc_emb)
-    if FLAGS.use_user_emb:
-      X['user_emb'] = torch.tensor(user_emb)
-
-    y = torch.tensor(label)
 
-    return X, y
+  def __getitems__(self, idxes):
+    """
+    Batched fetch used by DataLoader (torch >= 2.0), contiguous blocks (see lele.BlockShuffleSampler) are one read,
+    rows are not truncated to max_feat_len, same as __getitem__
+    """
+    idxes = np.asarray(idxes)
+    start, end = int(idxes.min()), int(idxes.max()) + 1
+    if end - start <= 2 * len(idxes):
+      block = self.lines.lines(start, end)
+      lines = [block[i - start] for i in idxes]
+    else:
+      lines = [self.lines[i] for i in idxes]
+    feat_ids, feat_fields, feat_values, labels, ids, lengths = self.td.parse_batch(lines, len(lines), return_lengths=True, truncate=False)
+    res = []
+    for i in range(len(lines)):
+      len_ = int(lengths[i])
+      res.append(({'index': feat_ids[i, :len_], 'field': feat_fields[i, :len_], 'value': feat_values[i, :len_], 
+                   'id': ids[i], 'duration': 123}, labels[i, 0]))
+    return res
     
   def __len__(self):
     return self._total_data
 
+class ConcatTextDataset(ConcatDataset):
+  """ConcatDataset of TextDataset files, a batch is split by file and each part fetched with that file's __getitems__"""
+  def __getitems__(self, idxes):
+    idxes = np.asarray(idxes, dtype=np.int64)
+    idxes = np.where(idxes < 0, idxes + len(self), idxes)
+    file_idxes = np.searchsorted(self.cumulative_sizes, idxes, side='right')
+    starts = np.asarray([0] + self.cumulative_sizes[:-1], dtype=np.int64)
+    res = [None] * len(idxes)
+    for file_idx in np.unique(file_idxes):
+      positions = np.flatnonzero(file_idxes == file_idx)
+      items = self.datasets[file_idx].__getitems__(idxes[positions] - starts[file_idx])
+      for pos, item in zip(positions, items):
+        res[pos] = item
+    return res
+
 # Lmdb is slow, depreciated
 class LmdbDataset(Dataset):
   def __init__(self, dir):
@@ -186,7 +276,7 @@ def get_dataset(files, td=None, shuffle=False):
 def get_text_dataset(files, td):
   assert files
   datasets = [TextDataset(x, td) for x in files]
-  return ConcatDataset(datasets)
+  return ConcatTextDataset(datasets)
 
 def get_lmdb_dataset(files):
   assert files
@@ -40,6 +40,8 @@ class Dataset(melt.Dataset):
     self.feat_to_field = {} # feat id -> field id
     self.feat_to_field_val = {} # feat id -> field value
     self.feat_to_field_name = {}
+    # dense feat id -> field id, for vectorized parse
+    self.field_of = None
     if not FLAGS.hash_encoding:
       self.load_feature_files()
     self.batch_size = melt.batch_size() 
@@ -73,6 +75,9 @@ class Dataset(melt.Dataset):
 
     logging.info('----num fields', len(self.field_id))
 
+    self.field_of = np.zeros(max(self.feat_to_field.keys(), default=0) + 1, dtype=np.int64)
+    self.field_of[list(self.feat_to_field.keys())] = list(self.feat_to_field.values())
+
     # self.doc_emb_field_id = -1
     # self.user_emb_field_id = -1
 
@@ -163,17 +168,26 @@ class Dataset(melt.Dataset):
   #-----------by this way decode line by line , more powerfull, but slower if batch parse then you must have fixed batch size! 1epoch:[2.69h] batch parse 2.03h
   # batch parse means the final batch is also batch_size not smaller, so it will contains empty examples like id=='', see read-test3.py
   def parse_line(self, line, decode=True):
-    # tf will convert as bytes... so need decode at first
-    if decode:
-      line = line.decode()
-    fields = line.split('\t')
+    # tf gives bytes, parse_lines accepts both bytes and str
+    # all features of the line, not truncated to max_feat_len (parse_batch truncates)
+    res = melt.tfrecords.libsvm_decode.parse_lines([line], self.start, self._num_tokens([line]), self.field_of)
+    heads = res['heads']
     #need np.float32 if float32 tf complain double .., but np.lofat32 is much slower then float
-    label = np.float32(fields[0])
-    id = '{}\t{}'.format(fields[2], fields[3])
-    feat_id, feat_field, feat_value = self.get_feat(fields[self.start:])
+    label = np.float32(heads[0][0])
+    id = '{}\t{}'.format(heads[2][0], heads[3][0])
+    feat_id, feat_field, feat_value = res['index'][0], self._get_field(res)[0], res['value'][0]
     # need [label] consider tfrecord generation
     return feat_id, feat_field, feat_value, [label], [id]
 
+  def _num_tokens(self, lines):
+    # upper bound of id:value tokens of the lines
+    return max([len(line.split()) for line in lines] + [1])
+
+  def _get_field(self, res):
+    if 'field' in res:
+      return res['field']
+    return np.zeros_like(res['index'])
+
 
   def line_parse_(self, line):
     feat_id, feat_field, feat_value, label, id = \
@@ -188,50 +202,26 @@ class Dataset(melt.Dataset):
     return {'index': feat_id, 'field': feat_field, 'value': feat_value, 'id': tf.squeeze(id, -1)}, tf.squeeze(label, -1)
 
   # https://stackoverflow.com/questions/52284951/tensorflow-py-func-typeerror-with-tf-data-dataset-output
-  def parse_batch(self, feat_list, batch_size):
-    feat_ids = np.zeros((batch_size, self.max_feat_len), dtype=np.int64)
-    feat_fields = np.zeros((batch_size, self.max_feat_len), dtype=np.int64)
-    feat_values = np.zeros((batch_size, self.max_feat_len), dtype=np.float32)
-    labels = np.zeros(batch_size, dtype=np.float32)
-    ids = [''] * batch_size # ''means not effective id, usefull for batch_parse + not repeat final batch with padding elments
-
-    # doc_embs = [None] * batch_size
-    # user_embs = [None] * batch_size
-
-    cur_max_feat_len = 0
-    for i, feat_line in enumerate(feat_list):
-      # python 3 need decode
-      fields = feat_line.decode().split('\t')
-      assert len(fields) > self.start, fields
-      #fields = feat_line.split('\t')
-      labels[i] = float(fields[0])
-      ids[i] = '{}\t{}'.format(fields[2], fields[3])
-
-      # feat_id, feat_field, feat_value, doc_emb, user_emb = self.get_feat(fields[self.start:])
-      feat_id, feat_field, feat_value = self.get_feat(fields[self.start:])
-
-      #assert len(feat_id) == len(feat_value), "len(feat_id) == len(feat_value) -----------------"
-      trunc_len = min(len(feat_id), self.max_feat_len)
-      #---也许是因为批量写速度比逐个访问numpy数组位置快(原地逐个访问)
-      feat_ids[i, :trunc_len] = feat_id[:trunc_len]
-      feat_fields[i, :trunc_len] = feat_field[:trunc_len]
-      feat_values[i, :trunc_len] = feat_value[:trunc_len]
-      cur_max_feat_len = max(cur_max_feat_len, trunc_len)
-      # doc_embs[i] = doc_emb
-      # user_embs[i] = user_emb
-
-    ## even here [:i, :cur..] still final batch size is same not small 
-    # feat_ids = feat_ids[:i, :cur_max_feat_len]
-    # feat_fields = feat_fields[:i, :cur_max_feat_len]
-    # feat_values = feat_values[:i, :cur_max_feat_len]
-    feat_ids = feat_ids[:, :cur_max_feat_len]
-    feat_fields = feat_fields[:, :cur_max_feat_len]
-    feat_values = feat_values[:, :cur_max_feat_len]
-    # doc_embs = np.array(doc_embs)
-    # user_embs = np.array(user_embs)
+  def parse_batch(self, feat_list, batch_size, return_lengths=False, truncate=True):
+    # all lines parsed in one call, token parsing in numba and feat id -> field by dense array,
+    # rows after len(feat_list) are padding with id '' (not effective), usefull for batch_parse + not repeat final batch
+    for feat_line in feat_list:
+      assert feat_line.count(b'\t') >= self.start, feat_line
+    max_len = self.max_feat_len if truncate else self._num_tokens(feat_list)
+    res = melt.tfrecords.libsvm_decode.parse_lines(feat_list, self.start, max_len, self.field_of, batch_size)
+    heads = res['heads']
+    labels = np.asarray([float(x) if x else 0. for x in heads[0]], dtype=np.float32)
+    ids = ['{}\t{}'.format(x, y) if x or y else '' for x, y in zip(heads[2], heads[3])]
+
+    feat_ids = res['index']
+    feat_fields = self._get_field(res)
+    feat_values = res['value']
 
     labels = labels.reshape(-1, 1)
     # return feat_ids, feat_fields, feat_values, doc_embs, user_embs, labels, ids
+    if return_lengths:
+      # number of features of each row, feat ids may be 0
+      return feat_ids, feat_fields, feat_values, labels, ids, res['lengths']
     return feat_ids, feat_fields, feat_values, labels, ids
 
 
@@ -49,9 +49,10 @@ def main(_):
 
   loss_fn = nn.BCEWithLogitsLoss()
 
-  td = None
-
   train_files = gezi.list_files(FLAGS.train_input)
+  # libsvm text lines are read by offset index (pyt.dataset.TextDataset), tfrecords by dali
+  td = text_dataset.Dataset('train') if not any('record' in os.path.basename(x) for x in train_files) else None
+
   train_ds = get_dataset(train_files, td=td)
   
   ## speed up a bit with pin_memory==True
@@ -68,7 +69,9 @@ def main(_):
   # pin_memory = False
   #kwargs = {'num_workers': num_workers, 'pin_memory': pin_memory, 'collate_fn': lele.DictPadCollate()}
   
-  train_dl = DataLoader(train_ds, FLAGS.batch_size, shuffle=True, **kwargs)
+  # text files, shuffle by blocks so batches read nearby lines (fit calls sampler.set_epoch each epoch)
+  sampler = lele.BlockShuffleSampler(len(train_ds), seed=FLAGS.seed or 0) if td is not None else None
+  train_dl = DataLoader(train_ds, FLAGS.batch_size, shuffle=sampler is None, sampler=sampler, **kwargs)
 
   #kwargs['num_workers'] = max(1, num_workers)
   #logging.info('num train examples', len(train_ds), len(train_dl))
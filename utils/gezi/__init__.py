@@ -15,6 +15,11 @@ from __future__ import print_function
 import warnings
 warnings.simplefilter("ignore") 
 
+# heavy submodules (big tables, tensorflow, plotting, metrics) load on first access, python -m gezi.lazy gezi to profile
+from gezi.lazy import LazyModules
+_lazy = LazyModules(globals())
+__getattr__, __dir__ = _lazy.getattr, _lazy.dir
+
 import gezi.utils 
 from gezi.utils import *
 
@@ -28,13 +33,16 @@ from gezi.timer import *
 from gezi.nowarning import * 
 from gezi.gezi_util import * 
 from gezi.avg_score import *
-from gezi.zhtools import *
+_lazy.add('gezi.zhtools', star=True)
 from gezi.util import * 
 from gezi.rank_metrics import *
 from gezi.topn import *
 from gezi.vocabulary import Vocabulary, Vocab
-from gezi.word_counter import WordCounter
+_lazy.add('gezi.array_vocabulary', ['ArrayVocabulary', 'ArrayVocab'])
+from gezi.word_counter import WordCounter, count_files
+from gezi.window_stats import WindowStats
 from gezi.ngram import *
+_lazy.add('gezi.ngram_hash', ['NgramHasher'])
 from gezi.hash import *
 
 #if using baidu segmentor set encoding='gbk'
@@ -47,12 +55,11 @@ encoding='utf8'
 # except Exception:
 #   pass 
 
-import gezi.summary
-from gezi.summary import SummaryWriter, EagerSummaryWriter
+_lazy.add('gezi.summary', ['SummaryWriter', 'EagerSummaryWriter'])
 
 import traceback
 
-from gezi.segment import *
+_lazy.add('gezi.segment', star=True)
 #try:
 #  from gezi.libgezi_util import *
 #  import gezi.libgezi_util as libgezi_util
@@ -74,16 +81,12 @@ try:
 except Exception:
   print(traceback.format_exc(), file=sys.stderr)
 
-try:
-  import gezi.metrics
-except Exception:
-  print(traceback.format_exc(), file=sys.stderr) 
+_lazy.add('gezi.metrics')
 
 # TODO remove multiprocessing/context.py import ...
 from gezi.util import Manager 
 
-import gezi.plot
-from gezi.plot import line, enable_plotly_in_cell
+_lazy.add('gezi.plot', ['line', 'enable_plotly_in_cell'])
 
 
 from shutil import make_archive
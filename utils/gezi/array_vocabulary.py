@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   array_vocabulary.py
+#        \author   chenghuige
+#          \date   2021-10-19 10:25:41.337019
+#   \Description   Array backed Vocabulary, utf8 blob + offsets + hash table index,
+#                  saved as npy files and memory-mapped, so forked or separate
+#                  processes share one copy, vectorized encode_batch/decode_batch
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+
+import numpy as np
+from numba import njit
+
+from gezi.vocabulary import Vocabulary, hash as mmh3_hash
+
+_FNV_OFFSET = np.uint64(14695981039346656037)
+_FNV_PRIME = np.uint64(1099511628211)
+
+@njit(nogil=True, cache=True)
+def _fnv1a(data, start, end):
+  h = _FNV_OFFSET
+  for i in range(start, end):
+    h ^= np.uint64(data[i])
+    h *= _FNV_PRIME
+  return h
+
+@njit(nogil=True, cache=True)
+def _hash_all(data, offsets):
+  n = len(offsets) - 1
+  hashes = np.empty(n, dtype=np.uint64)
+  for i in range(n):
+    hashes[i] = _fnv1a(data, offsets[i], offsets[i + 1])
+  return hashes
+
+@njit(nogil=True, cache=True)
+def _build_table(hashes, ids, capacity):
+  """open addressing (linear probe) table of capacity (power of 2) slots, slot -> (hash, id), id -1 empty"""
+  slot_hashes = np.zeros(capacity, dtype=np.uint64)
+  slot_ids = np.full(capacity, -1, dtype=np.int32)
+  mask = np.uint64(capacity - 1)
+  for i in range(len(hashes)):
+    slot = hashes[i] & mask
+    while slot_ids[slot] >= 0:
+      slot = (slot + np.uint64(1)) & mask
+    slot_hashes[slot], slot_ids[slot] = hashes[i], ids[i]
+  return slot_hashes, slot_ids
+
+@njit(nogil=True, cache=True)
+def _lookup(blob, offsets, slot_hashes, slot_ids, data, data_offsets, default):
+  """ids of the words in data (utf8 blob + offsets), default (-1) for missing"""
+  n = len(data_offsets) - 1
+  ids = np.empty(n, dtype=np.int64)
+  mask = np.uint64(len(slot_ids) - 1)
+  for i in range(n):
+    start, end = data_offsets[i], data_offsets[i + 1]
+    h = _fnv1a(data, start, end)
+    slot = h & mask
+    ids[i] = default
+    while slot_ids[slot] >= 0:
+      # equal hashes are rare collisions, compare bytes to be sure
+      if slot_hashes[slot] == h:
+        id_ = slot_ids[slot]
+        word_start, word_end = offsets[id_], offsets[id_ + 1]
+        if word_end - word_start == end - start:
+          same = True
+          for k in range(end - start):
+            if blob[word_start + k] != data[start + k]:
+              same = False
+              break
+          if same:
+            ids[i] = id_
+            break
+      slot = (slot + np.uint64(1)) & mask
+  return ids
+
+@njit(nogil=True, cache=True)
+def _gather(blob, offsets, ids, sep):
+  """utf8 bytes of the words of ids, each followed by sep"""
+  total = 0
+  for i in range(len(ids)):
+    total += offsets[ids[i] + 1] - offsets[ids[i]] + 1
+  buf = np.empty(total, dtype=np.uint8)
+  pos = 0
+  for i in range(len(ids)):
+    for j in range(offsets[ids[i]], offsets[ids[i] + 1]):
+      buf[pos] = blob[j]
+      pos += 1
+    buf[pos] = sep
+    pos += 1
+  return buf
+
+def _to_blob(words):
+  """list of str -> utf8 uint8 blob, int64 offsets [n + 1]"""
+  encoded = list(map(str.encode, words))
+  offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+  np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+  return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+# meta saved in meta.json, the rest of the state is arrays
+_META_KEYS = ['num_reserved_ids', 'num_insert_words', 'num_append_words', 'ori_size', 'start_word', 'end_word',
+              'unk_word', '_unk_id', '_start_id', '_end_id', '_buckets']
+_ARRAYS = ['blob', 'offsets', 'slot_hashes', 'slot_ids', 'counts']
+
+class ArrayVocabulary(Vocabulary):
+  """
+  Same ids and api as Vocabulary (built from the same vocab.txt and args, reserved/unk/start/end included),
+  but words are a utf8 blob + offsets and word -> id an open addressing table of 64 bit fnv hashes and ids
+  (collisions checked by bytes),
+  counts an int32 (int64 if needed) array. No per word python objects, so it can be memory-mapped and shared.
+
+    vocab = ArrayVocabulary('vocab.txt', cache_dir='vocab.arr')   # build once and save, then mmap
+    vocab = ArrayVocabulary('vocab.arr')                          # saved dir, mmap
+    ids = vocab.encode_batch(df.word.values)                       # np.int64 array, same shape
+    words = vocab.decode_batch(ids)
+
+  Immutable, add is not supported.
+  """
+  def __init__(self, vocab_file=None, cache_dir=None, mmap_mode='r', **kwargs):
+    if vocab_file and os.path.isdir(vocab_file):
+      cache_dir, vocab_file = vocab_file, None
+    if cache_dir and self._valid_cache(cache_dir, vocab_file, kwargs):
+      self._load(cache_dir, mmap_mode)
+      return
+    assert vocab_file, 'need vocab_file or a saved cache_dir'
+    self._from_vocabulary(Vocabulary(vocab_file, **kwargs))
+    if cache_dir:
+      self.save_arrays(cache_dir, source=self._source(vocab_file, kwargs))
+      self._load(cache_dir, mmap_mode)
+
+  @staticmethod
+  def _source(vocab_file, kwargs):
+    if not vocab_file:
+      return None
+    stat = os.stat(vocab_file)
+    return dict(file=os.path.abspath(vocab_file), mtime=stat.st_mtime, size=stat.st_size,
+                kwargs=dict((key, kwargs[key]) for key in sorted(kwargs)))
+
+  def _valid_cache(self, cache_dir, vocab_file, kwargs):
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+      return False
+    if not vocab_file:
+      return True
+    with open(meta_file) as f:
+      source = json.load(f).get('source')
+    # rebuilt if the text vocab or the args changed
+    return source == json.loads(json.dumps(self._source(vocab_file, kwargs)))
+
+  @classmethod
+  def from_vocabulary(cls, vocab):
+    """From a loaded Vocabulary (or Vocab), ids kept as is"""
+    self = cls.__new__(cls)
+    self._from_vocabulary(vocab)
+    return self
+
+  def _from_vocabulary(self, vocab):
+    for key in _META_KEYS:
+      setattr(self, key, getattr(vocab, key, None))
+    self.blob, self.offsets = _to_blob(vocab.reverse_vocab)
+    # duplicated words (repeated pad_word) map to the id the dict kept
+    words = list(vocab.vocab.keys())
+    ids = np.fromiter(vocab.vocab.values(), dtype=np.int32, count=len(words))
+    hashes = _hash_all(*_to_blob(words))
+    # load factor <= 2/3
+    capacity = 1 << max(int(np.ceil(np.log2(len(words) * 1.5 + 1))), 1)
+    self.slot_hashes, self.slot_ids = _build_table(hashes, ids, capacity)
+    counts = getattr(vocab, 'counts', None)
+    self.counts = None
+    if counts:
+      counts = np.asarray(counts, dtype=np.int64)
+      self.counts = counts.astype(np.int32) if counts.max() < 2**31 else counts
+    self._init_views()
+
+  def _init_views(self):
+    self._size = len(self.offsets) - 1
+
+  def save_arrays(self, path, source=None):
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+      os.remove(os.path.join(path, 'meta.json'))
+    for name in _ARRAYS:
+      if getattr(self, name) is not None:
+        np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+      elif os.path.exists(os.path.join(path, f'{name}.npy')):
+        os.remove(os.path.join(path, f'{name}.npy'))
+    meta = dict((key, getattr(self, key)) for key in _META_KEYS)
+    meta['source'] = source
+    # meta last, its presence marks a complete dir
+    with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+      json.dump(meta, f, ensure_ascii=False)
+    os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+
+  def _load(self, path, mmap_mode='r'):
+    with open(os.path.join(path, 'meta.json')) as f:
+      meta = json.load(f)
+    for key in _META_KEYS:
+      setattr(self, key, meta.get(key))
+    for name in _ARRAYS:
+      file = os.path.join(path, f'{name}.npy')
+      setattr(self, name, np.load(file, mmap_mode=mmap_mode) if os.path.exists(file) else None)
+    self._init_views()
+
+  @classmethod
+  def load(cls, path, mmap_mode='r'):
+    return cls(path, mmap_mode=mmap_mode)
+
+  def _lookup(self, words):
+    data, data_offsets = _to_blob(words)
+    return _lookup(self.blob, self.offsets, self.slot_hashes, self.slot_ids, data, data_offsets, -1)
+
+  def encode_batch(self, words, default=None):
+    """
+    words: list or np.ndarray (any shape) of words (non str are str()ed, as id()) -> np.int64 ids of the same shape,
+    or list of lists -> list of np arrays. Unknown words get default, unk id or the hash bucket as id()
+    """
+    if isinstance(words, (list, tuple)) and words and isinstance(words[0], (list, tuple, np.ndarray)):
+      lens = np.cumsum([len(x) for x in words])[:-1]
+      return np.split(self.encode_batch([word for x in words for word in x], default), lens)
+    words_ = np.asarray(words) if not isinstance(words, (list, tuple)) else None
+    shape = words_.shape if words_ is not None else (len(words),)
+    if words_ is not None:
+      words = words_.reshape(-1).tolist()
+      if words_.dtype.kind != 'U':
+        # python ints and strs str() as numpy scalars would
+        words = list(map(str, words))
+    elif not all(type(word) is str for word in words):
+      words = list(map(str, words))
+    ids = self._lookup(words)
+    missing = np.flatnonzero(ids < 0)
+    if len(missing):
+      if default is not None:
+        ids[missing] = default
+      elif not self._buckets:
+        ids[missing] = self._unk_id
+      else:
+        ids[missing] = [self._size + mmh3_hash(words[i]) % self._buckets for i in missing]
+    return ids.reshape(shape)
+
+  def decode_batch(self, ids):
+    """ids (list or np.ndarray, any shape) -> list of words, np object array if ids is an array, out of range as unk"""
+    ids_ = np.asarray(ids, dtype=np.int64)
+    flat = ids_.reshape(-1)
+    flat = np.where((flat >= self._size) | (flat < 0), self._unk_id, flat)
+    # words never contain '\n', decode once then split
+    buf = _gather(self.blob, self.offsets, flat, ord('\n'))
+    words = buf.tobytes().decode('utf8').split('\n')[:-1]
+    if isinstance(ids, np.ndarray):
+      res = np.empty(len(words), dtype=object)
+      res[:] = words
+      return res.reshape(ids_.shape)
+    return words
+
+  def has(self, word):
+    return self._lookup([str(word)])[0] >= 0
+
+  def __contains__(self, word):
+    return self.has(word)
+
+  def id(self, word, default=None):
+    """Returns the integer word id of a word string."""
+    word = str(word)
+    id_ = self._lookup([word])[0]
+    if id_ >= 0:
+      return int(id_)
+    if default is not None:
+      return default
+    if not self._buckets:
+      return self._unk_id
+    return self._size + mmh3_hash(word) % self._buckets
+
+  def word_to_id(self, word):
+    return self.id(word)
+
+  def key(self, word_id):
+    """Returns the word string of an integer word id."""
+    if word_id >= self._size:
+      word_id = self._unk_id
+    return self.blob[self.offsets[word_id]:self.offsets[word_id + 1]].tobytes().decode('utf8')
+
+  def id_to_word(self, word_id):
+    return self.key(word_id)
+
+  def count(self, word_id):
+    if self.counts is None:
+      return 1
+    return int(self.counts[word_id])
+
+  def size(self, min_count=0):
+    if not min_count or self.counts is None:
+      return self._size
+    below = np.flatnonzero(self.counts < min_count)
+    return int(below[0]) if len(below) else len(self.counts)
+
+  def __len__(self):
+    return self._size
+
+  def start_id(self):
+    return self._start_id
+
+  def end_id(self):
+    return self._end_id
+
+  def words(self):
+    return self.decode_batch(list(range(self.num_reserved_ids, self._size)))
+
+  @property
+  def reverse_vocab(self):
+    return self.decode_batch(list(range(self._size)))
+
+  def add(self, word):
+    raise NotImplementedError('ArrayVocabulary is immutable, add to a Vocabulary then from_vocabulary')
+
+
+class ArrayVocab(ArrayVocabulary):
+  def __init__(self, vocab_file=None, cache_dir=None, num_reserved_ids=1, min_count=None, max_words=None,
+               mmap_mode='r', **kwargs):
+    kwargs.update(num_reserved_ids=num_reserved_ids, min_count=min_count, max_words=max_words,
+                  start_word=None, end_word=None)
+    super(ArrayVocab, self).__init__(vocab_file, cache_dir, mmap_mode, **kwargs)
@@ -94,14 +94,16 @@ class HashFamily():
         bins (int): Number of bins to hash to. Better if a prime number.
         mask_zero (bool, optional): Whether the 0 input is a special "padding" value to mask out.
         moduler (int,optional): Temporary hashing. Has to be a prime number.
+        seed (int, optional): if set params are drawn from its own RandomState instead of global np.random
     """
 
-    def __init__(self, bins, mask_zero=True, moduler=None):
+    def __init__(self, bins, mask_zero=True, moduler=None, seed=None):
         if moduler and moduler <= bins:
             raise ValueError("p (moduler) should be >> m (buckets)")
 
         self.bins = bins
-        self.moduler = moduler if moduler else self._next_prime(np.random.randint(self.bins + 1, 2**32))
+        self.rng = np.random.RandomState(seed) if seed is not None else np.random
+        self.moduler = moduler if moduler else self._next_prime(self.rng.randint(self.bins + 1, 2**32))
         self.mask_zero = mask_zero
 
         # do not allow same a and b, as it could mean shifted hashes
@@ -122,20 +124,24 @@ class HashFamily():
 
         return n
 
-    def draw_hash(self, a=None, b=None):
-        """Draws a single hash function from the family."""
+    def _draw_ab(self, a=None, b=None):
         if a is None:
             while a is None or a in self.sampled_a:
-                a = np.random.randint(1, self.moduler - 1)
+                a = self.rng.randint(1, self.moduler - 1)
                 assert len(self.sampled_a) < self.moduler - 2, "please give a bigger moduler"
 
             self.sampled_a.add(a)
         if b is None:
             while b is None or b in self.sampled_b:
-                b = np.random.randint(0, self.moduler - 1)
+                b = self.rng.randint(0, self.moduler - 1)
                 assert len(self.sampled_b) < self.moduler - 1, "please give a bigger moduler"
 
             self.sampled_b.add(b)
+        return a, b
+
+    def draw_hash(self, a=None, b=None):
+        """Draws a single hash function from the family."""
+        a, b = self._draw_ab(a, b)
 
         if self.mask_zero:
             # The return doesn't set 0 to 0 because that's taken into account in the hash embedding
@@ -149,3 +155,75 @@ class HashFamily():
         """Draws n hash function from the family."""
         return [self.draw_hash() for i in range(n)]
 
+    def draw_multi_hash(self, n):
+        """Draws n hash functions (same params as draw_hashes would) as one vectorized MultiHash."""
+        a, b = zip(*[self._draw_ab() for i in range(n)])
+        return MultiHash(self.bins, a, b, self.moduler, self.mask_zero)
+
+
+class MultiHash(object):
+    r"""
+    k universal hashes h_i(x) = ((a_i x + b_i) mod p) mod m, (mod (m - 1)) + 1 if mask_zero, as in HashFamily,
+    params are arrays so one call hashes a whole id array for all k functions, 
+    x of shape S -> buckets of shape S + (k,), x can be numpy array, torch tensor or tf tensor.
+    a_i x mod p is computed by 16 bit split of a_i so that int64 never overflows for p < 2**32,
+    results equal the python int closures of HashFamily.draw_hash for any int64 x.
+    Use MultiHash.create(bins, k, seed) or get_config/from_config so offline and online buckets match.
+    """
+
+    def __init__(self, bins, a, b, moduler, mask_zero=True):
+        self.bins = int(bins)
+        self.a = np.asarray(a, dtype=np.int64)
+        self.b = np.asarray(b, dtype=np.int64)
+        self.moduler = int(moduler)
+        self.mask_zero = mask_zero
+        assert self.moduler < 2**32, "moduler should be < 2**32"
+        assert self.a.shape == self.b.shape and self.a.ndim == 1
+        self.a_hi = self.a >> 16
+        self.a_lo = self.a & 0xffff
+        self._cache = {}
+
+    @property
+    def num_hashes(self):
+        return len(self.a)
+
+    @staticmethod
+    def create(bins, num_hashes, seed=None, mask_zero=True, moduler=None):
+        """Deterministic for the same seed, independent of the global numpy random state"""
+        return HashFamily(bins, mask_zero, moduler, seed=seed).draw_multi_hash(num_hashes)
+
+    def get_config(self):
+        return dict(bins=self.bins, a=self.a.tolist(), b=self.b.tolist(), 
+                    moduler=self.moduler, mask_zero=self.mask_zero)
+
+    @staticmethod
+    def from_config(config):
+        return MultiHash(**config)
+
+    def _hash(self, x, a_hi, a_lo, b, mod):
+        p = self.moduler
+        x = mod(x, p)
+        h = mod(mod(x * a_hi, p) * 65536 + x * a_lo, p)
+        h = mod(h + b, p)
+        if self.mask_zero:
+            return mod(h, self.bins - 1) + 1
+        return mod(h, self.bins)
+
+    def _params(self, key, convert):
+        if key not in self._cache:
+            self._cache[key] = [convert(x) for x in (self.a_hi, self.a_lo, self.b)]
+        return self._cache[key]
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray) or np.isscalar(x) or isinstance(x, (list, tuple)):
+            x = np.asarray(x, dtype=np.int64)[..., None]
+            return self._hash(x, self.a_hi, self.a_lo, self.b, np.mod)
+        module = type(x).__module__
+        if module.startswith('torch'):
+            import torch
+            params = self._params(('torch', str(x.device)), lambda v: torch.as_tensor(v, device=x.device))
+            return self._hash(x.long().unsqueeze(-1), *params, torch.remainder)
+        else:
+            import tensorflow as tf
+            params = self._params('tf', lambda v: tf.constant(v, dtype=tf.int64))
+            return self._hash(tf.expand_dims(tf.cast(x, tf.int64), -1), *params, tf.math.floormod)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   lazy.py
+#        \author   chenghuige
+#          \date   2021-10-18 09:21:45.103562
+#   \Description   Lazy submodules for package __init__ (module __getattr__, PEP 562)
+#                  and import time profile, python -m gezi.lazy melt
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import ast
+import importlib
+import importlib.util
+import subprocess
+from collections import defaultdict
+
+def _module_file(module):
+  # walk the package dirs, find_spec('a.b.c') would import a.b (the lazy module itself maybe)
+  top, *parts = module.split('.')
+  spec = importlib.util.find_spec(top)
+  if spec is None or spec.origin is None:
+    return None
+  file = spec.origin
+  for part in parts:
+    if os.path.basename(file) != '__init__.py':
+      return None
+    base = os.path.join(os.path.dirname(file), part)
+    file = os.path.join(base, '__init__.py') if os.path.isdir(base) else base + '.py'
+  return file if os.path.exists(file) else None
+
+def star_names(module, _seen=None):
+  """
+  Names `from module import *` would bind, found by parsing the source (module is not imported).
+  __all__ if it is a literal, else public top level defs, classes, assignments and imports (also inside if/try),
+  star imports of modules in the same top package are followed.
+  Returns dict name -> True if defined (def/class) in the module itself, False if imported or assigned.
+  """
+  _seen = _seen if _seen is not None else set()
+  if module in _seen:
+    return {}
+  _seen.add(module)
+  file = _module_file(module)
+  if not file or not file.endswith('.py'):
+    return {}
+  tree = ast.parse(open(file, 'rb').read(), file)
+  package = module if os.path.basename(file) == '__init__.py' else module.rsplit('.', 1)[0]
+  names = {}
+
+  def _add(name, defined=False):
+    if not name.startswith('_'):
+      names[name] = defined or names.get(name, False)
+
+  def _visit(body):
+    for node in body:
+      if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        _add(node.name, True)
+      elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        for target in targets:
+          for elt in (target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]):
+            if isinstance(elt, ast.Name):
+              if elt.id == '__all__' and isinstance(node.value, (ast.List, ast.Tuple)):
+                names['__all__'] = [e.value for e in node.value.elts if isinstance(e, ast.Constant)]
+              _add(elt.id)
+      elif isinstance(node, ast.Import):
+        for alias in node.names:
+          _add(alias.asname or alias.name.split('.')[0])
+      elif isinstance(node, ast.ImportFrom):
+        if node.level:
+          base = package.rsplit('.', node.level - 1)[0] if node.level > 1 else package
+          from_module = f'{base}.{node.module}' if node.module else base
+        else:
+          from_module = node.module
+        for alias in node.names:
+          if alias.name == '*':
+            if from_module and from_module.split('.')[0] == module.split('.')[0]:
+              for name, defined in star_names(from_module, _seen).items():
+                _add(name, defined)
+          else:
+            _add(alias.asname or alias.name)
+      elif isinstance(node, ast.If):
+        _visit(node.body)
+        _visit(node.orelse)
+      elif isinstance(node, ast.Try):
+        _visit(node.body)
+        for handler in node.handlers:
+          _visit(handler.body)
+        _visit(node.orelse)
+        _visit(node.finalbody)
+      elif isinstance(node, ast.With):
+        _visit(node.body)
+
+  _visit(tree.body)
+  if '__all__' in names:
+    all_ = names.pop('__all__')
+    names = dict((name, names.get(name, False)) for name in all_)
+  return names
+
+
+class LazyModules(object):
+  """
+  Submodules of a package imported on first attribute access instead of in __init__.
+
+    _lazy = LazyModules(globals())
+    __getattr__, __dir__ = _lazy.getattr, _lazy.dir
+    _lazy.add('gezi.summary', ['SummaryWriter'])   # gezi.summary, gezi.SummaryWriter
+    _lazy.add('gezi.segment', star=True)           # as from gezi.segment import *
+
+  add() goes where the eager import was, so override order is kept: functions and classes the lazy
+  module defines are removed from the package if bound before (they were overridden by the star import),
+  names bound by later eager imports win as before. Modules already imported (e.g. by another submodule)
+  still resolve through the same path.
+  """
+  def __init__(self, package_globals):
+    self.globals = package_globals
+    self.package = package_globals['__name__']
+    self.names = {}
+    self.modules = []
+
+  def add(self, module, names=(), star=False, attr=None):
+    """
+    names: list of names or dict alias -> name, as from module import name as alias
+    attr: package attribute for the module itself, default its last name if a direct child
+    """
+    parent, _, child = module.rpartition('.')
+    if attr is None and parent == self.package:
+      attr = child
+    if attr:
+      self.names[attr] = (module, None)
+    if star:
+      for name, defined in star_names(module).items():
+        if name in self.names and self.names[name][1] is None:
+          continue
+        self.names[name] = (module, name)
+        if defined and name in self.globals:
+          del self.globals[name]
+    for alias, name in (names.items() if isinstance(names, dict) else zip(names, names)):
+      self.names[alias] = (module, name)
+      self.globals.pop(alias, None)
+    self.modules.append(module)
+
+  def load(self, module):
+    return importlib.import_module(module)
+
+  def getattr(self, name):
+    if name not in self.names:
+      raise AttributeError(f"module '{self.package}' has no attribute '{name}'")
+    module, attr = self.names[name]
+    obj = self.load(module)
+    if attr is not None:
+      try:
+        obj = getattr(obj, attr)
+      except AttributeError:
+        raise AttributeError(f"module '{self.package}' has no attribute '{name}' ({module} has no {attr})")
+    self.globals[name] = obj
+    return obj
+
+  def dir(self):
+    return sorted(set(self.globals) | set(self.names))
+
+  def load_all(self):
+    """Import every lazy module (e.g. before fork, so workers do not each pay for it)"""
+    for module in self.modules:
+      self.load(module)
+
+
+def profile_imports(module='gezi', load_lazy=False, top=30, depth=2, python=None):
+  """
+  Import module in a fresh interpreter with -X importtime, Returns [(name, cumulative ms, self ms)]
+  grouped by module name prefix of depth parts (gezi.metrics.image -> gezi.metrics),
+  sorted by cumulative time, first row is the total. load_lazy also loads its lazy modules.
+  """
+  code = f'import {module}'
+  if load_lazy:
+    code += f'; _lazy = getattr({module}, "_lazy", None); _lazy and _lazy.load_all()'
+  total = 0.
+  res = subprocess.run([python or sys.executable, '-X', 'importtime', '-c', code],
+                       stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True,
+                       env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+  cumulative, self_times = defaultdict(float), defaultdict(float)
+  for line in res.stderr.splitlines():
+    if not line.startswith('import time:') or 'imported package' in line:
+      continue
+    self_us, cum_us, name = line[len('import time:'):].split('|')
+    name = name.strip()
+    group = '.'.join(name.split('.')[:depth])
+    self_times[group] += int(self_us) / 1000.
+    # nested imports are included in the outer one's cumulative time
+    cumulative[group] = max(cumulative[group], int(cum_us) / 1000.)
+    if name == module:
+      total = int(cum_us) / 1000.
+  if res.returncode != 0:
+    print(res.stderr.splitlines()[-1] if res.stderr else 'import failed', file=sys.stderr)
+  rows = sorted(((name, cumulative[name], self_times[name]) for name in self_times), key=lambda x: -x[1])
+  return [(code, total, sum(self_times.values()))] + rows[:top]
+
+
+def print_profile(rows):
+  print(f'{"module":50s} {"cumulative(ms)":>15s} {"self(ms)":>10s}')
+  for name, cumulative, self_time in rows:
+    print(f'{name:50s} {cumulative:15.1f} {self_time:10.1f}')
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='import time profile of a package')
+  parser.add_argument('module', nargs='?', default='gezi')
+  parser.add_argument('--load_lazy', action='store_true', help='also load lazy modules')
+  parser.add_argument('--top', type=int, default=30)
+  parser.add_argument('--depth', type=int, default=2, help='group by module name prefix of depth parts')
+  args = parser.parse_args()
+  print_profile(profile_imports(args.module, args.load_lazy, args.top, args.depth))
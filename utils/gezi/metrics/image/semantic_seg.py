@@ -12,128 +12,231 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import sklearn
+from numba import njit
 
 import gezi
 from gezi import logging, tqdm
 
+@njit(nogil=True)
+def _bincount_matrix(gt, pred, num_classes, cm):
+    for j in range(gt.shape[0]):
+        g, p = gt[j], pred[j]
+        # remove classes from unlabeled pixels in gt image and predict
+        if g >= 0 and g < num_classes and p >= 0 and p < num_classes:
+            cm[g, p] += 1
+    return cm
+
+@njit(nogil=True)
+def _bincount_matrices(gt, pred, num_classes, cms):
+    for i in range(gt.shape[0]):
+        _bincount_matrix(gt[i], pred[i], num_classes, cms[i])
+    return cms
+
+def _as_labels(image):
+    """the kernel takes integer labels, float (e.g. fp16 dataset) masks are truncated as astype('int') did,
+    negative or nan labels stay ignored"""
+    image = np.asarray(image)
+    if image.dtype.kind in 'iu':
+        return image
+    return np.where(image >= 0, image, -1).astype(np.int64)
+
+def generate_matrix(gt_image, pre_image, num_classes):
+    cm = np.zeros((num_classes, num_classes), dtype=np.int64)
+    gt_image, pre_image = _as_labels(gt_image), _as_labels(pre_image)
+    return _bincount_matrix(np.ascontiguousarray(gt_image).reshape(-1), np.ascontiguousarray(pre_image).reshape(-1), num_classes, cm)
+
+def generate_matrices(gt_images, pre_images, num_classes, num_threads=1):
+    """
+    [N, ...] label and pred images -> [N, num_classes, num_classes] int64 confusion matrices in one pass,
+    the numba kernel releases the gil so num_threads threads count slices of the batch
+    (threads not processes, so also fine inside forked workers)
+    """
+    n = len(gt_images)
+    gt = np.ascontiguousarray(_as_labels(gt_images)).reshape(n, -1)
+    pred = np.ascontiguousarray(_as_labels(pre_images)).reshape(n, -1)
+    cms = np.zeros((n, num_classes, num_classes), dtype=np.int64)
+    num_threads = min(num_threads, n)
+    if num_threads <= 1:
+        return _bincount_matrices(gt, pred, num_classes, cms)
+    bounds = np.linspace(0, n, num_threads + 1).astype(int)
+    def _count(i):
+        start, end = bounds[i], bounds[i + 1]
+        _bincount_matrices(gt[start:end], pred[start:end], num_classes, cms[start:end])
+    with ThreadPoolExecutor(num_threads) as executor:
+        list(executor.map(_count, range(num_threads)))
+    return cms
+
+def _calc_iu(cm):
+    diag = np.diagonal(cm, axis1=-2, axis2=-1)
+    return diag / (cm.sum(-1) + cm.sum(-2) - diag)
+
+def _calc_freq(cm):
+    return cm.sum(-1) / cm.sum((-2, -1))[..., None]
+
+def _calc_fwiou(freq, iu):
+    return np.where(freq > 0, freq * np.nan_to_num(iu), 0.).sum(-1)
+
+def _add_range(span):
+    # images (or loaders) of add_batches are inherited by fork not pickled
+    ctx = gezi.fork_ctx()
+    start, end = span
+    gt_images, pre_images = ctx['gt_images'], ctx['pre_images']
+    num_classes = ctx['num_classes']
+    cms = np.empty((end - start, num_classes, num_classes), dtype=np.int64)
+    for i in range(start, end):
+        gt, pred = (gt_images[i], pre_images[i]) if ctx['load_fn'] is None else ctx['load_fn'](gt_images[i])
+        cms[i - start] = generate_matrix(gt, pred, num_classes)
+    return start, cms if ctx['return_each'] else cms.sum(0)
+
 # https://cg.cs.tsinghua.edu.cn/jittor/tutorial/2020-3-17-09-55-segmentation/
 class Evaluator(object):
-    def __init__(self, num_classes, eval_each=False):
+    """
+    confusion_matrix is int64 [num_classes, num_classes] (rows gt, cols pred), evaluators over shards
+    of the data merge by summation (merge), so metrics are exactly the same as one serial pass.
+    Batches (add_batch, eval_each) are counted by num_workers threads,
+    add_batches reads and counts image lists in num_workers forked processes.
+    """
+    def __init__(self, num_classes, eval_each=False, num_workers=None):
         self.class_names = []
         if isinstance(num_classes, (list, tuple)):
             self.class_names = num_classes
             self.num_classes = len(self.class_names)
         else:
             self.num_classes = num_classes
-        self.confusion_matrix = np.zeros((self.num_classes,)*2)
+        self.confusion_matrix = np.zeros((self.num_classes,)*2, dtype=np.int64)
         self.eval_each_ = eval_each
+        self.confusion_matrixes = []
+        self.num_workers = num_workers or cpu_count()
         self.iu = None
         self.inited = False
 
-    def Pixel_Accuracy(self):
-        Acc = np.diag(self.confusion_matrix).sum() / self.confusion_matrix.sum()
+    def Pixel_Accuracy(self, confusion_matrix=None):
+        cm = self.confusion_matrix if confusion_matrix is None else confusion_matrix
+        Acc = np.diagonal(cm, axis1=-2, axis2=-1).sum(-1) / cm.sum((-2, -1))
         return Acc
 
-    def Pixel_Accuracy_Class(self):
-        Acc = np.diag(self.confusion_matrix) / self.confusion_matrix.sum(axis=1)
-        Acc = np.nanmean(Acc)
+    def Pixel_Accuracy_Class(self, confusion_matrix=None):
+        cm = self.confusion_matrix if confusion_matrix is None else confusion_matrix
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Acc = np.diagonal(cm, axis1=-2, axis2=-1) / cm.sum(-1)
+            Acc = np.nanmean(Acc, -1)
         return Acc
 
-    def _calc_iu(self):
-        return np.diag(self.confusion_matrix) / (
-            np.sum(self.confusion_matrix, axis=1) + 
-            np.sum(self.confusion_matrix, axis=0)-
-            np.diag(self.confusion_matrix))
+    def _calc_iu(self, confusion_matrix=None):
+        return _calc_iu(self.confusion_matrix if confusion_matrix is None else confusion_matrix)
 
-    def Mean_Intersection_over_Union(self):
+    def Mean_Intersection_over_Union(self, confusion_matrix=None):
         # [(TP+FN)/(TP+FP+TN+FN)] *[TP / (TP + FP + FN)]
-        iu =  self._calc_iu()
-        MIoU = np.nanmean(iu)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            iu =  self._calc_iu(confusion_matrix)
+            MIoU = np.nanmean(iu, -1)
         return MIoU
 
-    def Frequency_Weighted_Intersection_over_Union(self):
-        freq = np.sum(self.confusion_matrix, axis=1) / np.sum(self.confusion_matrix)
-        iu = self._calc_iu()
-        FWIoU = (freq[freq > 0] * iu[freq > 0]).sum()
+    def Frequency_Weighted_Intersection_over_Union(self, confusion_matrix=None):
+        cm = self.confusion_matrix if confusion_matrix is None else confusion_matrix
+        with np.errstate(divide='ignore', invalid='ignore'):
+            FWIoU = _calc_fwiou(_calc_freq(cm), _calc_iu(cm))
         return FWIoU
 
-    def iou(self):
-        iu =  self._calc_iu()
-        MIoU = np.nanmean(iu)
-        freq = np.sum(self.confusion_matrix, axis=1) / np.sum(self.confusion_matrix)
-        FWIoU = (freq[freq > 0] * iu[freq > 0]).sum()
+    def iou(self, confusion_matrix=None):
+        cm = self.confusion_matrix if confusion_matrix is None else confusion_matrix
+        with np.errstate(divide='ignore', invalid='ignore'):
+            iu =  _calc_iu(cm)
+            MIoU = np.nanmean(iu, -1)
+            FWIoU = _calc_fwiou(_calc_freq(cm), iu)
         return MIoU, FWIoU, iu
 
     def _generate_matrix(self, gt_image, pre_image):
-        # remove classes from unlabeled pixels in gt image and predict
-        mask = (gt_image >= 0) & (gt_image < self.num_classes)
-        label = self.num_classes * gt_image[mask].astype('int') + pre_image[mask]
-        count = np.bincount(label, minlength=self.num_classes**2)
-        confusion_matrix = count.reshape(self.num_classes, self.num_classes)
-        # confusion_matrix = sklearn.metrics.confusion_matrix(y_true=label.reshape(-1), y_pred=pre_image.reshape(-1))
-        return confusion_matrix
+        return generate_matrix(gt_image, pre_image, self.num_classes)
+
+    def _generate_matrices(self, gt_image, pre_image):
+        return generate_matrices(gt_image, pre_image, self.num_classes, self.num_workers)
+
+    def merge(self, other):
+        """Add another Evaluator's or a (per worker, per image) confusion matrix"""
+        cm = other.confusion_matrix if isinstance(other, Evaluator) else np.asarray(other)
+        if cm.ndim == 3:
+            cm = cm.sum(0)
+        self.confusion_matrix += cm.astype(np.int64)
+        self.inited = True
+        return self
 
     def add_batch(self, gt_image, pre_image):
         assert gt_image.shape == pre_image.shape, f'{gt_image.shape} {pre_image.shape}'
-        if not self.eval_each_:
-            self.confusion_matrix += self._generate_matrix(gt_image, pre_image)
-        else:
-            for i in tqdm(range(len(gt_image)), 'confusion_matrixes'):
-                self.confusion_matrixes += [self._generate_matrix(gt_image[i], pre_image[i])]
-            self.confusion_matrix = np.sum(self.confusion_matrixes)
+        if gt_image.ndim == 2:
+            gt_image, pre_image = gt_image[np.newaxis], pre_image[np.newaxis]
+        cms = self._generate_matrices(gt_image, pre_image)
+        if self.eval_each_:
+            self.confusion_matrixes += list(cms)
+        return self.merge(cms)
+
+    def add_batches(self, gt_images, pre_images=None, load_fn=None, num_workers=None, chunk_size=8, return_each=False):
+        """
+        gt_images, pre_images: sequences of [H, W] images (list, array or memmap), sizes may differ,
+        or gt_images is a list of keys and load_fn(key) -> (gt_image, pre_image) reads them in workers.
+        Chunks of chunk_size images run in num_workers (default self.num_workers) forked processes,
+        their matrices are merged here. Returns self or [N, num_classes, num_classes] per image matrices if return_each.
+        """
+        assert pre_images is not None or load_fn is not None
+        num_images = len(gt_images)
+        num_workers = max(min(num_workers or self.num_workers, -(-num_images // chunk_size)), 1)
+        ctx = dict(gt_images=gt_images, pre_images=pre_images, load_fn=load_fn,
+                   num_classes=self.num_classes, return_each=return_each)
+        spans = [(i, min(i + chunk_size, num_images)) for i in range(0, num_images, chunk_size)]
+        cms = np.zeros((num_images, self.num_classes, self.num_classes), dtype=np.int64) if return_each else None
+        for start, cm in gezi.fork_map(_add_range, spans, ctx, num_workers, ordered=False):
+            self._add_result(start, cm, cms)
         self.inited = True
-        return self
+        return cms if return_each else self
+
+    def _add_result(self, start, cm, cms):
+        if cms is not None:
+            cms[start:start + len(cm)] = cm
+        self.merge(cm)
 
     def reset(self):
-        self.confusion_matrix = np.zeros((self.num_classes,) * 2)
+        self.confusion_matrix = np.zeros((self.num_classes,) * 2, dtype=np.int64)
+        self.confusion_matrixes = []
         self.inited = False
 
-    def eval_once(self, metric=None):
+    def eval_once(self, metric=None, confusion_matrix=None):
+        """confusion_matrix: [..., num_classes, num_classes] to score instead of the accumulated one"""
     #   with gezi.Timer('semantic seg eval', print_fn=logging.info):
-        assert self.inited, 'call add_batch(label_image, pred) first'
+        assert self.inited or confusion_matrix is not None, 'call add_batch(label_image, pred) first'
 
         if metric is not None:
             if metric.lower() == 'fwiou':
-                metric = 'Frequency_Weighted_Intersection_over_Union' 
+                metric = 'Frequency_Weighted_Intersection_over_Union'
             elif metric.lower() == 'miou' or metric.lower() == 'iou':
                 metric = 'Mean_Intersection_over_Union'
             metric_fn = getattr(self, metric)
-            return metric_fn()
+            return metric_fn(confusion_matrix)
 
         res = {}
-        iou, fwiou, iu = self.iou()
+        iou, fwiou, iu = self.iou(confusion_matrix)
         res['FWIoU'] = fwiou
         res['MIoU'] = iou
-        res['ACC/pixel'] = self.Pixel_Accuracy()
-        res['ACC/class'] = self.Pixel_Accuracy_Class()
+        res['ACC/pixel'] = self.Pixel_Accuracy(confusion_matrix)
+        res['ACC/class'] = self.Pixel_Accuracy_Class(confusion_matrix)
         if self.class_names:
             for i in range(len(self.class_names)):
                 class_name = self.class_names[i]
-                res[f'IoU/{class_name}'] = iu[i]
+                res[f'IoU/{class_name}'] = np.take(iu, i, -1)
         return res
 
     def eval_each(self, gt_image, pre_image, metric=None):
+        """Accumulate the batch and return per image metric list (or dict of lists), all from one counting pass"""
         assert gt_image.shape == pre_image.shape, f'{gt_image.shape} {pre_image.shape}'
-        confusion_matrix = self.confusion_matrix
-        res_all = {} if not metric else []
-        self.inited = True
-        # for i in tqdm(range(len(gt_image)),  ascii=True, desc='eval_each'):
-        for i in range(len(gt_image)):
-            self.confusion_matrix = self._generate_matrix(gt_image[i], pre_image[i])
-            confusion_matrix += self.confusion_matrix
-            res = self.eval_once(metric)
-            if not metric:
-                for key in res:
-                    if key not in res_all:
-                        res_all[key] = [res[key]]  
-                    else:
-                        res_all[key] += [res[key]]
-            else:
-                res_all += [res]
-        self.confusion_matrix = confusion_matrix
-        return res_all
+        cms = self._generate_matrices(gt_image, pre_image)
+        self.merge(cms)
+        res = self.eval_once(metric, cms)
+        if metric:
+            return list(res)
+        return dict((key, list(val)) for key, val in res.items())
 
     def eval(self, gt_image, pre_image, return_all=False):
         if not return_all:
@@ -143,19 +246,6 @@ class Evaluator(object):
             return self.eval_all(gt_image, pre_image)
 
     def eval_all(self, gt_image, pre_image):
-        res_all = {}
-        confusion_matrix = np.zeros((self.num_classes,) * 2)
-        self.inited = True
-        for i in tqdm(range(len(gt_image)), ascii=True, desc='confusion_matrixes'):
-            self.confusion_matrix = self._generate_matrix(gt_image[i], pre_image[i])
-            confusion_matrix += self.confusion_matrix
-            res = self.eval_once()
-            for key in res:
-                if key not in res_all:
-                    res_all[key] = [res[key]]  
-                else:
-                    res_all[key] += [res[key]]
-        self.confusion_matrix = confusion_matrix
+        res_all = self.eval_each(gt_image, pre_image)
         res = self.eval_once()
         return res, res_all
-
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   semantic_seg_test.py
+#        \author   chenghuige
+#          \date   2021-10-20 15:12:08.503217
+#   \Description   python -m pytest gezi/metrics/image/semantic_seg_test.py
+#                  numba confusion matrices against the old bincount version
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from gezi.metrics.image.semantic_seg import Evaluator, generate_matrix, generate_matrices
+
+NUM_CLASSES = 5
+
+def _bincount_matrix(gt_image, pre_image, num_classes=NUM_CLASSES):
+    # as the old Evaluator._generate_matrix
+    mask = (gt_image >= 0) & (gt_image < num_classes)
+    label = num_classes * gt_image[mask].astype('int') + pre_image[mask]
+    count = np.bincount(label, minlength=num_classes**2)
+    return count.reshape(num_classes, num_classes)
+
+def _old_metrics(cm):
+    iu = np.diag(cm) / (np.sum(cm, axis=1) + np.sum(cm, axis=0) - np.diag(cm))
+    freq = np.sum(cm, axis=1) / np.sum(cm)
+    return {
+        'FWIoU': (freq[freq > 0] * iu[freq > 0]).sum(),
+        'MIoU': np.nanmean(iu),
+        'ACC/pixel': np.diag(cm).sum() / cm.sum(),
+        'ACC/class': np.nanmean(np.diag(cm) / cm.sum(axis=1)),
+    }
+
+def _gen_images(seed, n=12, size=24):
+    rng = np.random.default_rng(seed)
+    gt = rng.integers(0, NUM_CLASSES, (n, size, size))
+    # unlabeled pixels, and a class never predicted so some iu are nan
+    gt[rng.random(gt.shape) < 0.1] = 255
+    pred = rng.integers(0, NUM_CLASSES - 1, (n, size, size))
+    return gt, pred
+
+def test_generate_matrix():
+    gt, pred = _gen_images(0)
+    for i in range(len(gt)):
+        assert (generate_matrix(gt[i], pred[i], NUM_CLASSES) == _bincount_matrix(gt[i], pred[i])).all()
+    cms = generate_matrices(gt, pred, NUM_CLASSES, num_threads=3)
+    assert (cms == np.stack([_bincount_matrix(gt[i], pred[i]) for i in range(len(gt))])).all()
+
+def test_float_labels():
+    # fp16 dataset masks, truncated as astype('int')
+    gt, pred = _gen_images(1)
+    gt = gt.astype(np.float16)
+    gt[0, 0, :3] = [-1., 2.5, np.nan]
+    assert (generate_matrix(gt[0], pred[0], NUM_CLASSES) == _bincount_matrix(gt[0], pred[0])).all()
+    assert (generate_matrix(gt, pred.astype(np.float32), NUM_CLASSES) == _bincount_matrix(gt, pred)).all()
+
+def test_evaluator():
+    gt, pred = _gen_images(2)
+    cm = _bincount_matrix(gt, pred)
+    expected = _old_metrics(cm)
+    evaluators = [Evaluator(NUM_CLASSES, num_workers=1).add_batch(gt, pred),
+                  Evaluator(NUM_CLASSES, num_workers=3).add_batches(gt, pred, chunk_size=5),
+                  Evaluator(NUM_CLASSES).merge(Evaluator(NUM_CLASSES).add_batch(gt[:5], pred[:5]))
+                                        .merge(Evaluator(NUM_CLASSES).add_batch(gt[5:], pred[5:]))]
+    for evaluator in evaluators:
+        assert (evaluator.confusion_matrix == cm).all()
+        res = evaluator.eval_once()
+        for key in expected:
+            assert np.isclose(res[key], expected[key], equal_nan=True), key
+
+def test_eval_each():
+    gt, pred = _gen_images(3)
+    res = Evaluator(NUM_CLASSES).eval_each(gt, pred)
+    for i in range(len(gt)):
+        expected = _old_metrics(_bincount_matrix(gt[i], pred[i]))
+        for key in expected:
+            assert np.isclose(res[key][i], expected[key], equal_nan=True), key
@@ -23,20 +23,15 @@ import numpy as np
 # from multiprocessing import Manager
 # import pymp
 from gezi import tqdm
+from scipy.stats import norm
 from scipy.stats import weightedtau, kendalltau
-from scipy.stats._stats import _kendall_dis
 import math
 
 import gezi
 
 logging = gezi.logging
 
-try:
-  from gezi.metrics._stats import _weighted_inverse_sort
-except Exception:
-  pass
-
-from numba import njit
+from numba import njit, prange
 from scipy.stats import rankdata
 
 
@@ -60,60 +55,335 @@ def pr_auc(labels, preds):
   return area
 
 
+def group_segments(groups):
+  """Stable sort by group, return (perm, offsets, group_ids)
+
+  rows of group i are perm[offsets[i]:offsets[i + 1]], group_ids[i] is its id
+  """
+  groups = np.asarray(groups)
+  perm = np.argsort(groups, kind='mergesort')
+  sorted_groups = groups[perm]
+  flags = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+  starts = np.nonzero(flags)[0]
+  offsets = np.r_[starts, len(groups)].astype(np.int64)
+  return perm, offsets, sorted_groups[starts]
+
+
+@njit
+def _segment_ranks(pred):
+  # 1 based average ranks, same as scipy rankdata(method='average')
+  n = len(pred)
+  order = np.argsort(pred, kind='mergesort')
+  ranks = np.empty(n, dtype=np.float64)
+  i = 0
+  while i < n:
+    j = i
+    while j + 1 < n and pred[order[j + 1]] == pred[order[i]]:
+      j += 1
+    rank = (i + j) / 2. + 1.
+    for k in range(i, j + 1):
+      ranks[order[k]] = rank
+    i = j + 1
+  return ranks
+
+
+@njit(parallel=True)
+def _segment_aucs(labels, preds, offsets):
+  num_groups = len(offsets) - 1
+  num_labels = labels.shape[1]
+  shared_pred = preds.shape[1] == 1
+  aucs = np.full((num_groups, num_labels), np.nan)
+  for g in prange(num_groups):
+    start, end = offsets[g], offsets[g + 1]
+    ranks = np.empty(0, dtype=np.float64)
+    for k in range(num_labels):
+      if k == 0 or not shared_pred:
+        ranks = _segment_ranks(preds[start:end, k])
+      n_pos = 0
+      rank_sum = 0.
+      for i in range(end - start):
+        if labels[start + i, k]:
+          n_pos += 1
+          rank_sum += ranks[i]
+      n_neg = end - start - n_pos
+      if n_pos > 0 and n_neg > 0:
+        aucs[g, k] = (rank_sum - n_pos * (n_pos + 1) / 2.) / (n_pos * n_neg)
+  return aucs
+
+
+def grouped_auc(labels, preds, groups, weights=None):
+  """Vectorized group auc, one sort by group and per group ranking in numba
+
+  labels: [N] or [N, K], label > 0 as positive, K label columns share one group sort
+  preds: [N] or [N, K], [N] preds are shared by all label columns
+  groups: [N] group ids (uid, impression id...)
+  weights: [N] instance weights, group weight is the sum of its instances,
+    None means each group weight 1
+
+  Groups with all positive or all negative labels get nan auc and are ignored.
+  Returns (scores [K], aucs [num_groups, K], group_ids [num_groups])
+  """
+  labels = np.asarray(labels)
+  preds = np.asarray(preds)
+  if len(groups) != len(labels) or len(preds) != len(labels):
+    raise ValueError('{} {} {}'.format(len(groups), len(labels), len(preds)))
+  if labels.ndim == 1:
+    labels = labels[:, None]
+  if preds.ndim == 1:
+    preds = preds[:, None]
+  if preds.shape[1] != 1 and preds.shape[1] != labels.shape[1]:
+    raise ValueError('{} {}'.format(labels.shape, preds.shape))
+
+  perm, offsets, group_ids = group_segments(groups)
+  labels = np.ascontiguousarray(labels[perm] > 0)
+  preds = np.ascontiguousarray(preds[perm].astype(np.float64, copy=False))
+  aucs = _segment_aucs(labels, preds, offsets)
+
+  if weights is None:
+    group_weights = np.ones(len(group_ids))
+  else:
+    weights = np.asarray(weights, dtype=np.float64)[perm]
+    group_weights = np.add.reduceat(weights, offsets[:-1])
+
+  valid = ~np.isnan(aucs)
+  total_weights = (group_weights[:, None] * valid).sum(0)
+  total_aucs = (group_weights[:, None] * np.where(valid, aucs, 0.)).sum(0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    scores = total_aucs / total_weights
+  logging.debug('num instances', len(labels), 'num groups', len(group_ids),
+                'num groups with auc', valid.sum(0))
+  return scores, aucs, group_ids
+
+
 def group_auc(labels, preds, uids, weighted=True):
   """Calculate group auc"""
   if len(uids) != len(labels):
     raise ValueError('{} {}'.format(len(uids), len(labels)))
 
-  group_pred = defaultdict(lambda: [])
-  group_truth = defaultdict(lambda: [])
-  for idx, truth in tqdm(enumerate(labels),
-                         total=len(labels),
-                         ascii=True,
-                         desc='make group',
-                         leave=False):
-    uid = uids[idx]
-    score = preds[idx]
-    truth = labels[idx]
-    group_pred[uid].append(score)
-    group_truth[uid].append(truth)
-
-  group_flag = defaultdict(lambda: False)
-  for uid in tqdm(set(uids),
-                  total=len(set(uids)),
-                  ascii=True,
-                  desc='group flag',
-                  leave=False):
-    group_pred[uid] = np.array(group_pred[uid])
-    group_truth[uid] = np.array(group_truth[uid])
-    sum_truths = np.sum(group_truth[uid])
-    group_flag[uid] = sum_truths > 0 and sum_truths < len(group_truth[uid])
-
-  uids = [uid for uid in group_flag.keys() if group_flag[uid]]
-  num_users = len(uids)
-  # num instances 4544790 num users 811209 num users with auc 272392
-  logging.debug('num instances', len(labels), 'num users', len(group_flag),
-                'num users with auc', num_users)
-
-  auc_scores = [None] * num_users
-  impressions = [None] * num_users
-  #auc_scores = Manager().list(auc_scores)
-  #impressions = Manager().list(impressions)
-  #num_cores = multiprocessing.cpu_count()
-
-  #with pymp.Parallel(num_cores) as p:
-  #  for i in tqdm(p.range(num_users)):
-  for i in tqdm(range(num_users), total=num_users, ascii=True, desc='auc'):
-    # auc_scores[i] = roc_auc_score(group_truth[uids[i]], group_pred[uids[i]])
-    auc_scores[i] = fast_auc(group_truth[uids[i]], group_pred[uids[i]])
-    impressions[i] = len(group_truth[uids[i]]) if weighted else 1
-    auc_scores[i] *= impressions[i]
-
-  total_auc = sum(auc_scores)
-  total_impression = sum(impressions)
-  # print('total_impression', total_impression)
-  group_auc = float(total_auc) / total_impression
-  return group_auc
+  weights = np.ones(len(labels)) if weighted else None
+  scores, _, _ = grouped_auc(labels, preds, uids, weights)
+  return float(scores[0])
+
+
+@njit
+def _merge_count(src, dst, left, mid, right, weighted):
+  # merge sorted src[left:mid] and src[mid:right] to dst, count pairs i < j with src[i] > src[j],
+  # weighted also sums src[i] - src[j] of these pairs
+  dis = 0
+  dis_w = 0.
+  left_sum = 0.
+  if weighted:
+    for i in range(left, mid):
+      left_sum += src[i]
+  i, j, k = left, mid, left
+  while i < mid and j < right:
+    if src[i] <= src[j]:
+      dst[k] = src[i]
+      if weighted:
+        left_sum -= src[i]
+      i += 1
+    else:
+      dst[k] = src[j]
+      dis += mid - i
+      if weighted:
+        dis_w += left_sum - (mid - i) * src[j]
+      j += 1
+    k += 1
+  while i < mid:
+    dst[k] = src[i]
+    i += 1
+    k += 1
+  while j < right:
+    dst[k] = src[j]
+    j += 1
+    k += 1
+  return dis, dis_w
+
+
+@njit
+def _count_inversions(a):
+  # pairs i < j with a[i] > a[j], bottom up merge sort
+  n = len(a)
+  src = a.copy()
+  dst = np.empty_like(src)
+  dis = 0
+  width = 1
+  while width < n:
+    for left in range(0, n, 2 * width):
+      dis += _merge_count(src, dst, left, min(left + width, n), min(left + 2 * width, n), False)[0]
+    src, dst = dst, src
+    width *= 2
+  return dis
+
+
+@njit(parallel=True)
+def _parallel_count_inversions(a, weighted):
+  # same as _count_inversions, merges of each level run in parallel
+  n = len(a)
+  src = a.copy()
+  dst = np.empty_like(src)
+  dis = 0
+  dis_w = 0.
+  width = 1
+  while width < n:
+    num_merges = (n + 2 * width - 1) // (2 * width)
+    counts = np.zeros(num_merges, dtype=np.int64)
+    weighted_counts = np.zeros(num_merges)
+    for m in prange(num_merges):
+      left = m * 2 * width
+      counts[m], weighted_counts[m] = _merge_count(src, dst, left, min(left + width, n), 
+                                                   min(left + 2 * width, n), weighted)
+    dis += counts.sum()
+    dis_w += weighted_counts.sum()
+    src, dst = dst, src
+    width *= 2
+  return dis, dis_w
+
+
+def count_inversions(x, weighted=False):
+  """Number of pairs i < j with x[i] > x[j], parallel merge sort in numba
+
+  weighted: also return sum of x[i] - x[j] over these pairs
+  """
+  x = np.ascontiguousarray(x)
+  if weighted:
+    x = x.astype(np.float64, copy=False)
+  dis, dis_w = _parallel_count_inversions(x, weighted)
+  return (dis, dis_w) if weighted else dis
+
+
+@njit
+def _count_ties(sorted_vals):
+  ties = 0
+  run = 1
+  for i in range(1, len(sorted_vals) + 1):
+    if i < len(sorted_vals) and sorted_vals[i] == sorted_vals[i - 1]:
+      run += 1
+    else:
+      ties += run * (run - 1) // 2
+      run = 1
+  return ties
+
+
+@njit
+def _segment_inverse_ratio(x, y):
+  # same as inverse_ratio(x, y)
+  n = len(x)
+  order = np.argsort(y, kind='mergesort')
+  ys = y[order]
+  y_ranks = np.empty(n, dtype=np.int64)
+  rank = 0
+  for i in range(n):
+    if i > 0 and ys[i] != ys[i - 1]:
+      rank += 1
+    y_ranks[i] = rank
+  xs = x[order]
+  perm = np.argsort(xs, kind='mergesort')
+  xs = xs[perm]
+  y_ranks2 = y_ranks[perm]
+  dis = _count_inversions(y_ranks2)
+  xtie = _count_ties(xs)
+  ytie = _count_ties(y_ranks)
+  ntie = 0
+  run = 1
+  for i in range(1, n + 1):
+    if i < n and xs[i] == xs[i - 1] and y_ranks2[i] == y_ranks2[i - 1]:
+      run += 1
+    else:
+      ntie += run * (run - 1) // 2
+      run = 1
+  tot = n * (n - 1) // 2
+  if xtie == tot or ytie == tot:
+    return np.nan
+  con = tot - dis - xtie - ytie + ntie
+  if con + dis == 0:
+    return np.nan
+  return dis / (con + dis)
+
+
+@njit
+def _dcg(r, k):
+  dcg = 0.
+  for i in range(min(k, len(r))):
+    dcg += r[i] / np.log2(i + 2.)
+  return dcg
+
+
+@njit
+def _ndcg(r, best, k):
+  dcg_max = _dcg(best, k)
+  if dcg_max == 0:
+    return 0.
+  return _dcg(r, k) / dcg_max
+
+
+# columns of _segment_scores output
+_GROUP_STATS = ('n', 'n_pos', 'n_pos2', 'auc',
+                'top1_click', 'top3_click', 'top3_impressions', 'top1_click_best', 'top3_click_best',
+                'first_click_position', 'last_click_position',
+                'ndcg3_click', 'ndcg7_click', 'ndcg14_click', 'ndcg_click',
+                'n_dur', 'top1_score', 'top3_score', 'top3_impressions_dur', 'top1_best', 'top3_best',
+                'ndcg3_dur', 'ndcg7_dur', 'ndcg14_dur', 'ndcg_dur', 'inv_ratio')
+
+@njit(parallel=True)
+def _segment_scores(labels, preds, binary, binary2, offsets, calc_auc, corellation, top_score, topn):
+  num_groups = len(offsets) - 1
+  stats = np.full((num_groups, len(_GROUP_STATS)), np.nan)
+  for g in prange(num_groups):
+    start, end = offsets[g], offsets[g + 1]
+    n = end - start
+    label, pred = labels[start:end], preds[start:end]
+    clicks = binary[start:end].astype(np.float64)
+    n_pos = clicks.sum()
+    n_pos2 = binary2[start:end].sum()
+    stats[g, 0] = n
+    stats[g, 1] = n_pos
+    stats[g, 2] = n_pos2
+
+    if calc_auc and n_pos > 0 and n_pos < n:
+      ranks = _segment_ranks(pred)
+      rank_sum = (ranks * clicks).sum()
+      stats[g, 3] = (rank_sum - n_pos * (n_pos + 1) / 2.) / (n_pos * (n - n_pos))
+
+    if top_score and n_pos > 0:
+      r = clicks[np.argsort(-pred, kind='mergesort')]
+      best = np.sort(clicks)[::-1]
+      k = min(n, topn)
+      stats[g, 4] = r[0]
+      stats[g, 5] = r[:k].sum()
+      stats[g, 6] = k
+      stats[g, 7] = best[0]
+      stats[g, 8] = best[:k].sum()
+      positions = np.nonzero(r)[0]
+      stats[g, 9] = positions[0]
+      stats[g, 10] = positions[-1]
+      stats[g, 11] = _ndcg(r, best, 3)
+      stats[g, 12] = _ndcg(r, best, 7)
+      stats[g, 13] = _ndcg(r, best, 14)
+      stats[g, 14] = _ndcg(r, best, n)
+
+    if n_pos2 > 0 and (top_score or corellation):
+      # duration metrics only on rows with known duration
+      valid = label >= 0
+      label, pred = label[valid], pred[valid]
+      m = len(label)
+      stats[g, 15] = m
+      if top_score:
+        r = label[np.argsort(-pred, kind='mergesort')]
+        best = np.sort(label)[::-1]
+        k = min(m, topn)
+        stats[g, 16] = r[0]
+        stats[g, 17] = r[:k].sum()
+        stats[g, 18] = k
+        stats[g, 19] = best[0]
+        stats[g, 20] = best[:k].sum()
+        stats[g, 21] = _ndcg(r, best, 3)
+        stats[g, 22] = _ndcg(r, best, 7)
+        stats[g, 23] = _ndcg(r, best, 14)
+        stats[g, 24] = _ndcg(r, best, m)
+      if corellation:
+        stats[g, 25] = _segment_inverse_ratio(label, pred)
+  return stats
 
 
 def group_scores(labels,
@@ -126,330 +396,92 @@ def group_scores(labels,
                  min_click_duration=None,
                  topn=6,
                  weighted=False):
-  """Calculate group auc"""
+  """Calculate group auc, time auc(concordant), top click/duration scores and ndcg
+
+  labels are durations, 0 means no click, < 0 means click with unknown duration,
+  one stable sort by uid and per uid stats in parallel numba loops (_segment_scores)
+  selected_uids: dict name -> uids, auc breakdown of these uids (uid prefix before '\\t')
+  """
   if len(uids) != len(labels):
     raise ValueError('{} {}'.format(len(uids), len(labels)))
 
-  if selected_uids:
-    sunames, suids = zip(*(selected_uids.items()))
-    num_suids = len(suids)
+  perm, offsets, group_ids = group_segments(uids)
+  labels = np.asarray(labels)[perm].astype(np.float64)
+  preds = np.asarray(preds)[perm].astype(np.float64)
+  if not min_click_duration:
+    binary = labels != 0
+    binary2 = labels > 0
   else:
-    suids = None
-    num_suids = 0
-
-  group_pred = defaultdict(lambda: [])
-  group_truth = defaultdict(lambda: [])
-  group_truth_binary = defaultdict(lambda: [])
-  group_truth_binary2 = defaultdict(lambda: [])
-
-  for idx, truth in tqdm(enumerate(labels),
-                         total=len(labels),
-                         ascii=True,
-                         desc='make group',
-                         leave=False):
-    uid = uids[idx]
-    score = preds[idx]
-    truth = labels[idx]
-    group_pred[uid].append(score)
-    group_truth[uid].append(truth)
-
-  group_flag = {}  # with click
-  group_flag2 = {}  # with click and has valid duration
-  group_flag_auc = {}
-  for uid in tqdm(uids, ascii=True, desc='group flag', leave=False):
-    group_pred[uid] = np.asarray(group_pred[uid])
-    group_truth[uid] = np.asarray(group_truth[uid])
-    if not min_click_duration:
-      group_truth_binary[uid] = (group_truth[uid] != 0).astype(int)
-      group_truth_binary2[uid] = (group_truth[uid] > 0).astype(int)
-    else:
-      group_truth_binary[
-          uid] = group_truth[uid] >= min_click_duration or group_truth[uid] < 0
-      group_truth_binary2[uid] = group_truth[uid] >= min_click_duration
-    sum_truths = np.sum(group_truth_binary[uid])
-    sum_truths2 = np.sum(group_truth_binary2[uid])
-    group_flag[uid] = sum_truths > 0
-    group_flag2[uid] = sum_truths2 > 0
-    if calc_auc:
-      group_flag_auc[uid] = sum_truths > 0 and sum_truths < len(
-          group_truth_binary[uid])
-
-  num_total_users = len(group_flag)
-  logging.debug('num instances', len(labels), 'num users', num_total_users,
-                'docs per user',
-                len(labels) / num_total_users)
-
-  if calc_auc:
-    uids_auc = [uid for uid in group_flag_auc.keys() if group_flag_auc[uid]]
-    num_users_auc = len(uids_auc)
-
-    logging.debug('num users with auc', num_users_auc, 'auc user ratio',
-                  num_users_auc / num_total_users)
-
-    total_auc = 0.
-    total_auc2 = 0.
-    total_positive = 0
-    total_impression = 0.
-
-    total_aucs = [0.] * num_suids
-    total_aucs2 = [0.] * num_suids
-    total_positives = [0] * num_suids
-    total_impressions = [0] * num_suids
-    total_users = [0] * num_suids
-
-    for i in tqdm(range(num_users_auc), ascii=True, desc='auc', leave=False):
-      # auc
-      truth = group_truth_binary[uids_auc[i]]
-      pred = group_pred[uids_auc[i]]
-      auc = roc_auc_score(truth, pred)
-      impressions = len(truth)
-      num_positive = sum(truth)
-
-      total_auc += auc * impressions
-      total_auc2 += auc
-      total_positive += num_positive
-      total_impression += impressions
-
-      for j in range(num_suids):
-        if uids_auc[i].split('\t')[0] in suids[j]:
-          total_aucs[j] += auc * impressions
-          total_aucs2[j] += auc
-          total_positives[j] += num_positive
-          total_impressions[j] += impressions
-          total_users[j] += 1
-
-    # auc
-    group_auc = total_auc / total_impression
-    group_auc2 = total_auc2 / num_users_auc
-    pos_ratio = total_positive / total_impression
-
-    group_aucs = [0.] * num_suids
-    group_aucs2 = [0.] * num_suids
-    pos_ratios = [0.] * num_suids
-    impression_rates = [0.] * num_suids
-    user_rates = [0.] * num_suids
-
-    for j in range(num_suids):
-      if total_impressions[j]:
-        group_aucs[j] = total_aucs[j] / total_impressions[j]
-        group_aucs2[j] = total_aucs2[j] / total_users[j]
-        pos_ratios[j] = total_positives[j] / total_impressions[j]
-      impression_rates[j] = total_impressions[j] / total_impression
-      user_rates[j] = total_users[j] / num_users_auc
-
-  if top_score:
-    uids = [uid for uid in group_flag.keys() if group_flag[uid]]
-    num_users = len(uids)
-
-    top1_scores = [None] * num_users
-    top1_clicks = [None] * num_users
-    top3_clicks = [None] * num_users
-    top3_impressions = [None] * num_users
-    first_click_positions = [None] * num_users
-    last_click_positions = [None] * num_users
-
-    top1_scores_best = [None] * num_users
-    top1_clicks_best = [None] * num_users
-    top3_clicks_best = [None] * num_users
-
-    # TODO maybe config 3,7,14..
-    ndcgs_3 = [None] * num_users
-    ndcgs_7 = [None] * num_users
-    ndcgs_14 = [None] * num_users
-    ndcgs = [None] * num_users
-
-    for i in tqdm(range(num_users), ascii=True, desc='top click', leave=False):
-      pred = group_pred[uids[i]]
-      truth = group_truth_binary[uids[i]]
-      index = np.argsort(-pred)
-      top1_scores[i] = truth[index[0]]
-      top1_clicks[i] = int(top1_scores[i] != 0)
-
-      for j in range(len(index)):
-        if truth[index[j]] != 0:
-          first_click_positions[i] = j
-          break
-      for j in reversed(range(len(index))):
-        if truth[index[j]] != 0:
-          last_click_positions[i] = j
-          break
-
-      index_truth = np.argsort(-truth)
-
-      scores = [truth[index[j]] for j in range(min(len(index), topn))]
-      clicks = [int(x != 0) for x in scores]
-      top3_clicks[i] = np.sum(clicks)
-      top3_impressions[i] = len(scores)
-
-      top1_scores_best[i] = truth[index_truth[0]]
-      top1_clicks_best[i] = int(top1_scores_best[i] != 0)
-      top3_clicks_best[i] = np.sum([
-          int(truth[index_truth[j]] != 0)
-          for j in range(min(len(index_truth), topn))
-      ])
-
-      best = truth[index_truth]
-      r = truth[index]
-      dcg_max_3 = gezi.dcg_at_k(best, 3)
-      dcg_max_7 = gezi.dcg_at_k(best, 7)
-      dcg_max_14 = gezi.dcg_at_k(best, 14)
-      dcg_max = gezi.dcg_at_k(best, len(r))
-      ndcgs_3[i] = gezi.dcg_at_k(r, 3) / dcg_max_3 if dcg_max_3 else 0.
-      ndcgs_7[i] = gezi.dcg_at_k(r, 7) / dcg_max_7 if dcg_max_7 else 0.
-      ndcgs_14[i] = gezi.dcg_at_k(r, 14) / dcg_max_14 if dcg_max_14 else 0.
-      ndcgs[i] = gezi.dcg_at_k(r, len(r)) / dcg_max if dcg_max else 0.
-
-    # top
-    num_top3_impressions = np.sum(top3_impressions)
-    top1_click = np.sum(top1_clicks) / num_users
-    top3_click = np.sum(top3_clicks) / num_top3_impressions
-
-    top1_click_best = np.sum(top1_clicks_best) / num_users
-    top3_click_best = np.sum(top3_clicks_best) / num_top3_impressions
-
-    first_click_position = np.sum(first_click_positions) / num_users
-    last_click_position = np.sum(last_click_positions) / num_users
-
-    ndcg_3 = np.sum(ndcgs_3) / num_users
-    ndcg_7 = np.sum(ndcgs_7) / num_users
-    ndcg_14 = np.sum(ndcgs_14) / num_users
-    ndcg = np.sum(ndcgs) / num_users
-
-    uids = [uid for uid in group_flag2.keys() if group_flag2[uid]]
-    num_users = len(uids)
-
-    top1_scores = [None] * num_users
-    top3_scores = [None] * num_users
-    top3_impressions = [None] * num_users
-
-    top1_scores_best = [None] * num_users
-    top3_scores_best = [None] * num_users
-
-    ndcgs_3 = [None] * num_users
-    ndcgs_7 = [None] * num_users
-    ndcgs_14 = [None] * num_users
-    ndcgs = [None] * num_users
-
-    for i in tqdm(range(num_users), ascii=True, desc='top score', leave=False):
-      pred = group_pred[uids[i]]
-      truth = group_truth[uids[i]]
-      flags = truth >= 0
-      pred = pred[flags]
-      truth = truth[flags]
-
-      # top1 duration score
-      index = np.argsort(-pred)
-      top1_scores[i] = truth[index[0]]
-
-      # top3 duration score
-      scores = [truth[index[j]] for j in range(min(len(index), topn))]
-      top3_scores[i] = np.sum(scores)
-      top3_impressions[i] = len(scores)
-
-      index_truth = np.argsort(-truth)
-      top1_scores_best[i] = truth[index_truth[0]]
-      top3_scores_best[i] = np.sum(
-          [truth[index_truth[j]] for j in range(min(len(index_truth), topn))])
-
-      best = truth[index_truth]
-      r = truth[index]
-      dcg_max_3 = gezi.dcg_at_k(best, 3)
-      dcg_max_7 = gezi.dcg_at_k(best, 7)
-      dcg_max_14 = gezi.dcg_at_k(best, 14)
-      dcg_max = gezi.dcg_at_k(best, len(r))
-      ndcgs_3[i] = gezi.dcg_at_k(r, 3) / dcg_max_3 if dcg_max_3 else 0.
-      ndcgs_7[i] = gezi.dcg_at_k(r, 7) / dcg_max_7 if dcg_max_7 else 0.
-      ndcgs_14[i] = gezi.dcg_at_k(r, 14) / dcg_max_14 if dcg_max_14 else 0.
-      ndcgs[i] = gezi.dcg_at_k(r, len(r)) / dcg_max if dcg_max else 0.
-
-    # top
-    num_top3_impressions = np.sum(top3_impressions)
-    top1_score = np.sum(top1_scores) / num_users
-    top3_score = np.sum(top3_scores) / num_top3_impressions
-
-    top1_score_best = np.sum(top1_scores_best) / num_users
-    top3_score_best = np.sum(top3_scores_best) / num_top3_impressions
-
-    ndcg_dur_3 = np.sum(ndcgs_3) / num_users
-    ndcg_dur_7 = np.sum(ndcgs_7) / num_users
-    ndcg_dur_14 = np.sum(ndcgs_14) / num_users
-    ndcg_dur = np.sum(ndcgs) / num_users
-
-    logging.debug('top1 score best:', top1_score_best, 'top3 score best:',
-                  top3_score_best)
-
-  concordant = np.nan
-  weighted_concordant = np.nan
-  if corellation:
-    uids = [uid for uid in group_flag2.keys() if group_flag2[uid]]
-    num_users = len(uids)
-    logging.debug('num users with click', num_users, 'click users ratio',
-                  num_users / num_total_users)
+    binary = (labels >= min_click_duration) | (labels < 0)
+    binary2 = labels >= min_click_duration
 
-    inv_ratios = [None] * num_users
-    weighted_invs = [None] * num_users
-    # weighted_kendalls = [None] * num_users
-    corellation_impressions = [None] * num_users
+  stats = _segment_scores(labels, preds, binary, binary2, offsets, 
+                          calc_auc, corellation, top_score, topn)
+  stats = dict(zip(_GROUP_STATS, stats.T))
 
-    for i in tqdm(range(num_users), ascii=True, desc='correlation',
-                  leave=False):
-      truth = group_truth[uids[i]]
-      pred = group_pred[uids[i]]
-
-      flags = truth >= 0
-      pred = pred[flags]
-      truth = truth[flags]
-
-      corellation_impressions[i] = len(truth)
-
-      inv_ratio = inverse_ratio(truth, pred)
-      if weighted:
-        weighted_inv = weighted_inverse(truth, pred)
-      # weighted_kendall, _ = weightedtau(truth, pred)  # will core...
+  num_total_users = len(group_ids)
+  logging.debug('num instances', len(labels), 'num users', num_total_users,
+                'docs per user', len(labels) / num_total_users)
 
-      inv_ratios[i] = inv_ratio * corellation_impressions[i]
-      if weighted:
-        weighted_invs[i] = weighted_inv * corellation_impressions[i]
-      # weighted_kendalls[i] = weighted_kendall * corellation_impressions[i]
+  with_click = stats['n_pos'] > 0
+  with_click2 = stats['n_pos2'] > 0
 
-    filter_flag = np.asarray([not math.isnan(x) for x in inv_ratios])
-    inv_ratios = np.asarray(inv_ratios)
-    if weighted:
-      weighted_invs = np.asarray(weighted_invs)
-    # weighted_kendalls = np.asarray(weighted_kendalls)
-    corellation_impressions = np.asarray(corellation_impressions)
+  def _mean(key, mask):
+    return np.mean(stats[key][mask]) if mask.any() else np.nan
 
-    inv_ratios = inv_ratios[filter_flag]
-    if weighted:
-      weighted_invs = weighted_invs[filter_flag]
-    # weighted_kendalls = weighted_kendalls[filter_flag]
-    corellation_impressions = corellation_impressions[filter_flag]
-    logging.debug('Num valid users for correlation',
-                  len(corellation_impressions))
-
-    total_impressions = np.sum(corellation_impressions)
-    inv_ratio = np.sum(inv_ratios) / total_impressions
-    if weighted:
-      weighted_inv = np.sum(weighted_invs) / total_impressions
-    # weighted_kendall = np.sum(weighted_kendalls) / total_impressions
+  def _ratio(key, base, mask):
+    return stats[key][mask].sum() / stats[base][mask].sum() if mask.any() else np.nan
 
   result = {}
   if calc_auc:
-    result.update(dict(auc=group_auc, auc2=group_auc2, pos_ratio=pos_ratio))
-    if suids:
-      for i in range(len(suids)):
-        uname = sunames[i]
-        result[f'auc/{uname}'] = group_aucs[i]
-        result[f'auc2/{uname}'] = group_aucs2[i]
-        result[f'pos_ratio/{uname}'] = pos_ratios[i]
-        result[f'impresssion_rate/{uname}'] = impression_rates[i]
-        result[f'user_rate/{uname}'] = user_rates[i]
+    with_auc = ~np.isnan(stats['auc'])
+    num_users_auc = with_auc.sum()
+    logging.debug('num users with auc', num_users_auc, 'auc user ratio',
+                  num_users_auc / num_total_users)
+    impressions = stats['n'] * with_auc
+    total_impression = impressions.sum()
+    weighted_aucs = np.where(with_auc, stats['auc'], 0.) * stats['n']
+    result['auc'] = weighted_aucs.sum() / total_impression if num_users_auc else np.nan
+    result['auc2'] = _mean('auc', with_auc)
+    result['pos_ratio'] = _ratio('n_pos', 'n', with_auc)
+
+    if selected_uids:
+      keys = [str(uid).split('\t')[0] for uid in group_ids]
+      for uname, suids in selected_uids.items():
+        mask = with_auc & np.asarray([key in suids for key in keys], dtype=bool)
+        num_impressions = impressions[mask].sum()
+        result[f'auc/{uname}'] = weighted_aucs[mask].sum() / num_impressions if num_impressions else 0.
+        result[f'auc2/{uname}'] = _mean('auc', mask) if mask.any() else 0.
+        result[f'pos_ratio/{uname}'] = _ratio('n_pos', 'n', mask) if mask.any() else 0.
+        result[f'impresssion_rate/{uname}'] = num_impressions / total_impression
+        result[f'user_rate/{uname}'] = mask.sum() / num_users_auc
 
   if corellation:
-    result['concordant'] = 1. - inv_ratio
+    logging.debug('num users with click', with_click2.sum(), 'click users ratio',
+                  with_click2.sum() / num_total_users)
+    mask = with_click2 & ~np.isnan(stats['inv_ratio'])
+    logging.debug('Num valid users for correlation', mask.sum())
+    total_impressions = stats['n_dur'][mask].sum()
+    result['concordant'] = 1. - (stats['inv_ratio'][mask] * stats['n_dur'][mask]).sum() / total_impressions
     if weighted:
-      result['weighted_concordant'] = 1. - weighted_inv
+      weighted_invs = np.zeros(len(group_ids))
+      for i in np.nonzero(mask)[0]:
+        label, pred = labels[offsets[i]:offsets[i + 1]], preds[offsets[i]:offsets[i + 1]]
+        valid = label >= 0
+        weighted_invs[i] = weighted_inverse(label[valid], pred[valid]) * stats['n_dur'][i]
+      result['weighted_concordant'] = 1. - weighted_invs[mask].sum() / total_impressions
+
   if top_score:
+    top1_score = _mean('top1_score', with_click2)
+    top3_score = _ratio('top3_score', 'top3_impressions_dur', with_click2)
+    top1_score_best = _mean('top1_best', with_click2)
+    top3_score_best = _ratio('top3_best', 'top3_impressions_dur', with_click2)
+    logging.debug('top1 score best:', top1_score_best, 'top3 score best:',
+                  top3_score_best)
+    top1_click = _mean('top1_click', with_click)
+    top3_click = _ratio('top3_click', 'top3_impressions', with_click)
+    top1_click_best = _mean('top1_click_best', with_click)
+    top3_click_best = _ratio('top3_click_best', 'top3_impressions', with_click)
     result.update(
         dict(
             top1_score=top1_score,
@@ -464,16 +496,16 @@ def group_scores(labels,
             top3_click_best=top3_click_best,
             top1_click_rate=(top1_click / top1_click_best),
             top3_click_rate=(top3_click / top3_click_best),
-            first_click_position=first_click_position,
-            last_click_position=last_click_position,
-            ndcg3_click=ndcg_3,
-            ndcg7_click=ndcg_7,
-            ndcg14_click=ndcg_14,
-            ndcg_click=ndcg,
-            ndcg3_dur=ndcg_dur_3,
-            ndcg7_dur=ndcg_dur_7,
-            ndcg14_dur=ndcg_dur_14,
-            ndcg_dur=ndcg_dur,
+            first_click_position=_mean('first_click_position', with_click),
+            last_click_position=_mean('last_click_position', with_click),
+            ndcg3_click=_mean('ndcg3_click', with_click),
+            ndcg7_click=_mean('ndcg7_click', with_click),
+            ndcg14_click=_mean('ndcg14_click', with_click),
+            ndcg_click=_mean('ndcg_click', with_click),
+            ndcg3_dur=_mean('ndcg3_dur', with_click2),
+            ndcg7_dur=_mean('ndcg7_dur', with_click2),
+            ndcg14_dur=_mean('ndcg14_dur', with_click2),
+            ndcg_dur=_mean('ndcg_dur', with_click2),
         ))
 
   return result
@@ -482,192 +514,45 @@ def group_scores(labels,
 class CountInverse:
 
   def inverse_pairs(self, data):
-    data = np.asarray(data)
-    temp = np.zeros_like(data)
-    return self.sort(data, 0, len(data) - 1, temp)
-
-  def sort(self, data, left, right, temp):
-    if right - left < 1:
-      return 0
-
-    if right - left == 1:
-      if data[left] <= data[right]:
-        return 0
-      else:
-        print('reverse', data[left], data[right])
-        data[left], data[right] = data[right], data[left]
-        return 1
-
-    mid = (left + right) // 2
-    dis = self.sort(data, left, mid, temp) + self.sort(data, mid + 1, right,
-                                                       temp)
-
-    # gezi.sprint(left)
-    # gezi.sprint(right)
-    # gezi.sprint(data)
-    # gezi.sprint(temp)
-
-    i = left
-    j = mid + 1
-    index = left
-
-    while i <= mid and j <= right:
-      if data[i] <= data[j]:
-        temp[index] = data[i]
-        i += 1
-      else:
-        # for k in range(i, mid + 1):
-        #   print('reverse', data[k], data[j])
-        temp[index] = data[j]
-        dis += mid - i + 1
-        j += 1
-      index += 1
-
-    while i <= mid:
-      temp[index] = data[i]
-      i += 1
-      index += 1
-
-    while j <= right:
-      temp[index] = data[j]
-      j += 1
-      index += 1
-
-    data, temp = temp, data
-
-    return dis
+    return count_inversions(data)
 
 
 class CountInverseWeightedBase:
 
   def inverse_pairs(self, data):
-    weight_dis = np.asarray([-1] * len(data))
-    data = np.asarray(data)
-    temp = np.zeros_like(data)
-    return self.sort(data, 0, len(data) - 1, temp, weight_dis)
-
-  def sort(self, data, left, right, temp, weight_dis):
-    if right - left < 1:
-      return 0
-
-    if right - left == 1:
-      if data[left] <= data[right]:
-        return 0
-      else:
-        data[left], data[right] = data[right], data[left]
-        return data[right] - data[left]
-
-    mid = (left + right) // 2
-    dis_w = self.sort(data, left, mid, temp, weight_dis) + self.sort(
-        data, mid + 1, right, temp, weight_dis)
-
-    #print(f'111{data[left:mid + 1]},{data[mid + 1:right + 1]}--{temp[left:mid + 1]},{temp[mid + 1:right + 1]}')
-
-    weight_dis[mid] = data[mid]
-    for i in reversed(range(left, mid)):
-      weight_dis[i] = weight_dis[i + 1] + data[i]
-
-    i = left
-    j = mid + 1
-    index = left
-
-    while i <= mid and j <= right:
-      if data[i] <= data[j]:
-        temp[index] = data[i]
-        i += 1
-      else:
-        temp[index] = data[j]
-        dis_w += weight_dis[i] - (mid - i + 1) * data[j]
-        j += 1
-      index += 1
-
-    while i <= mid:
-      temp[index] = data[i]
-      i += 1
-      index += 1
-
-    while j <= right:
-      temp[index] = data[j]
-      j += 1
-      index += 1
-
-    #print(f'222{data[left:mid + 1]},{data[mid + 1:right + 1]}--{temp[left:mid + 1]},{temp[mid + 1:right + 1]}')
-
-    i = left
-    while i <= right:
-      data[i] = temp[i]
-      i += 1
-
-    #print(f'333{data[left:mid + 1]},{data[mid + 1:right + 1]}--{temp[left:mid + 1]},{temp[mid + 1:right + 1]}')
+    return count_inversions(data, weighted=True)[1]
 
-    return dis_w
 
-
-class CountInverseWeighted:
-
-  def inverse_pairs(self, data):
-    weight_dis = np.asarray([-1] * len(data))
-    data = np.asarray(data)
-    temp = np.zeros_like(data)
-    return _weighted_inverse_sort(data, 0, len(data) - 1, temp, weight_dis)
+class CountInverseWeighted(CountInverseWeightedBase):
+  pass
 
 
 def calc_inverse(x, y):
-  #gezi.sprint(x)
-  #gezi.sprint(y)
   index = np.argsort(y, kind='mergesort')
-  #gezi.sprint(index)
-  x = x[index]
-  gezi.sprint(x)
-
-  #print(l)
-
-  calc = CountInverse()
-  return calc.inverse_pairs(x)
+  x = np.asarray(x)[index]
+  return count_inversions(x)
 
 
 def calc_inverse_weighted(x, y):
-  #gezi.sprint(x)
-  #gezi.sprint(y)
   index = np.argsort(y, kind='mergesort')
-  #gezi.sprint(index)
-  x = x[index]
-  #gezi.sprint(x)
-
-  #print(l)
-
-  calc = CountInverseWeighted()
-  return calc.inverse_pairs(x)
+  x = np.asarray(x)[index]
+  return count_inversions(x, weighted=True)[1]
 
 
 def weighted_inverse_base(x, y):
-  index = np.argsort(y, kind='mergesort')
-  x = x[index]
-  calc = CountInverseWeightedBase()
-  dis_w = calc.inverse_pairs(x)
-
-  gezi.sprint(x)
-  gezi.sprint(dis_w)
-
   n = len(x)
   tot = n * (n - 1) // 2
-
+  dis_w = calc_inverse_weighted(x, y)
   weighted_inv = dis_w / tot
-
   return weighted_inv
 
 
 def weighted_inverse(x, y):
+  x = np.asarray(x)
   n = len(x)
   tot = n * (n - 1) // 2
   xtie = count_rank_tie(x)
-  index = np.argsort(y, kind='mergesort')
-  x = x[index]
-
-  calc = CountInverseWeighted()
-  dis_w = calc.inverse_pairs(x)
-
-  #gezi.sprint(dis_w)
+  dis_w = calc_inverse_weighted(x, y)
 
   tot -= xtie
 
@@ -766,19 +651,23 @@ def inverse_ratio(x, y):
   if isinstance(y, (list, tuple)):
     y = np.asarray(y)
 
-  n = len(x)
-  tot = n * (n - 1) // 2
-
   perm = np.argsort(y)  # sort on y and convert y to dense ranks
   x, y = x[perm], y[perm]
   y = np.r_[True, y[1:] != y[:-1]].cumsum(dtype=np.intp)
+  return _inverse_ratio_sorted(x, y)
+
+
+def _inverse_ratio_sorted(x, y):
+  """x sorted by y, y dense ranks (ascending)"""
+  n = len(x)
+  tot = n * (n - 1) // 2
 
   # stable sort on x and convert x to dense ranks
   perm = np.argsort(x, kind='mergesort')
   x, y = x[perm], y[perm]
   x = np.r_[True, x[1:] != x[:-1]].cumsum(dtype=np.intp)
 
-  dis = _kendall_dis(x, y)
+  dis = count_inversions(y)
 
   obs = np.r_[True, (x[1:] != x[:-1]) | (y[1:] != y[:-1]), True]
   cnt = np.diff(np.nonzero(obs)[0]).astype('int64', copy=False)
@@ -800,18 +689,72 @@ def inverse_ratio(x, y):
 
   con = tot - dis - xtie - ytie + ntie
 
-  inv_ratio = dis / (con + dis)
-
   if con + dis == 0:
-    inv_ratio = np.nan
-    # tau = np.nan
-
-  # if math.isnan(tau):
-  #   inv_ratio = np.nan
-  # if math.isnan(inv_ratio):
-  #   tau = np.nan
+    return np.nan
 
-  return inv_ratio
+  return dis / (con + dis)
+
+
+class RankedPreds(object):
+  """
+  Predictions sorted once, the order and dense ranks are reused by auc, inverse_ratio and losses 
+  of several targets (click, duration, video time...) or row subsets (mask), no more sorting of preds
+  """
+  def __init__(self, preds):
+    self.preds = np.asarray(preds)
+    self.order = np.argsort(self.preds, kind='mergesort')
+    sorted_preds = self.preds[self.order]
+    self.dense_ranks = np.empty(len(self.preds), dtype=np.intp)
+    self.dense_ranks[self.order] = np.r_[True, sorted_preds[1:] != sorted_preds[:-1]].cumsum(dtype=np.intp)
+
+  def __len__(self):
+    return len(self.preds)
+
+  def sorted_index(self, mask=None):
+    """row indexes of mask in preds order, O(n) filter of the global order"""
+    if mask is None:
+      return self.order
+    return self.order[np.asarray(mask)[self.order]]
+
+  def auc(self, labels, mask=None):
+    """roc auc, labels > 0 as positive, nan if only one class"""
+    index = self.sorted_index(mask)
+    labels = np.asarray(labels)[index] > 0
+    ranks = self.dense_ranks[index]
+    # 1 based average ranks of the (masked) sorted preds
+    starts = np.flatnonzero(np.r_[True, ranks[1:] != ranks[:-1]])
+    counts = np.diff(np.r_[starts, len(ranks)])
+    avg_ranks = np.repeat(starts + (counts + 1) / 2., counts)
+    n_pos = labels.sum()
+    n_neg = len(labels) - n_pos
+    if not n_pos or not n_neg:
+      return np.nan
+    return (avg_ranks[labels].sum() - n_pos * (n_pos + 1) / 2.) / (n_pos * n_neg)
+
+  def inverse_ratio(self, x, mask=None):
+    """same as inverse_ratio(x[mask], preds[mask])"""
+    index = self.sorted_index(mask)
+    return _inverse_ratio_sorted(np.asarray(x)[index], self.dense_ranks[index])
+
+  def log_loss(self, labels, mask=None, eps=1e-15):
+    """sklearn log_loss for binary labels"""
+    preds = self.preds if mask is None else self.preds[mask]
+    labels = np.asarray(labels) if mask is None else np.asarray(labels)[mask]
+    preds = np.clip(preds, eps, 1 - eps)
+    return -np.mean(labels * np.log(preds) + (1 - labels) * np.log(1 - preds))
+
+  def bce(self, targets, mask=None):
+    """torch.nn.BCELoss, soft targets and log clamped to >= -100"""
+    preds = self.preds if mask is None else self.preds[mask]
+    targets = np.asarray(targets) if mask is None else np.asarray(targets)[mask]
+    with np.errstate(divide='ignore'):
+      log_p = np.maximum(np.log(preds), -100.)
+      log_1_p = np.maximum(np.log(1. - preds), -100.)
+    return -np.mean(targets * log_p + (1. - targets) * log_1_p)
+
+  def mse_mae(self, targets, mask=None):
+    diff = (self.preds if mask is None else self.preds[mask]) - (np.asarray(targets) if mask is None else np.asarray(targets)[mask])
+    return np.mean(diff * diff), np.mean(np.abs(diff))
 
 
 inverse_rate = inverse_ratio
@@ -825,6 +768,49 @@ def inverse_ratio_click(labels, preds):
   return inverse_ratio(labels, preds)
 
 
+def _sample_pairs(n, num_pairs, seed):
+  rng = np.random.default_rng(seed)
+  return rng.integers(0, n, num_pairs), rng.integers(0, n, num_pairs)
+
+
+def inverse_ratio_sampled(x, y, num_pairs=1000000, seed=None, confidence=0.95):
+  """Approximate inverse_ratio from num_pairs random pairs, for monitoring on very large arrays
+
+  Returns (inv_ratio, (lower, upper)) with Wilson score interval at confidence
+  """
+  x, y = np.asarray(x), np.asarray(y)
+  i, j = _sample_pairs(len(x), num_pairs, seed)
+  judge = np.sign(x[i] - x[j]) * np.sign(y[i] - y[j])
+  m = np.count_nonzero(judge)
+  if not m:
+    return np.nan, (np.nan, np.nan)
+  p = np.count_nonzero(judge < 0) / m
+  z = norm.ppf((1. + confidence) / 2.)
+  center = (p + z * z / (2 * m)) / (1 + z * z / m)
+  half = z * np.sqrt(p * (1 - p) / m + z * z / (4 * m * m)) / (1 + z * z / m)
+  return p, (center - half, center + half)
+
+
+def weighted_inverse_sampled(x, y, num_pairs=1000000, seed=None, confidence=0.95):
+  """Approximate weighted_inverse from num_pairs random pairs, pairs tied in y are not counted as inverse
+
+  Returns (weighted_inv, (lower, upper)) with normal interval at confidence
+  """
+  x, y = np.asarray(x), np.asarray(y)
+  i, j = _sample_pairs(len(x), num_pairs, seed)
+  diff = (x[i] - x[j]).astype(np.float64)
+  valid = diff != 0
+  if not valid.any():
+    return np.nan, (np.nan, np.nan)
+  diff, y_diff = diff[valid], y[i][valid] - y[j][valid]
+  weights = np.abs(diff) * (np.sign(diff) * np.sign(y_diff) < 0)
+  scale = np.mean(x[x != 0])
+  mean = weights.mean() / scale
+  z = norm.ppf((1. + confidence) / 2.)
+  half = z * weights.std() / np.sqrt(len(weights)) / scale
+  return mean, (mean - half, mean + half)
+
+
 def kendall_dis(x, y):
   perm = np.argsort(y)  # sort on y and convert y to dense ranks
   x, y = x[perm], y[perm]
@@ -835,12 +821,13 @@ def kendall_dis(x, y):
   x, y = x[perm], y[perm]
   x = np.r_[True, x[1:] != x[:-1]].cumsum(dtype=np.intp)
 
-  dis = _kendall_dis(x, y)  # discordant pairs
+  dis = count_inversions(y)  # discordant pairs
   return dis
 
 
 def count_rank_tie(ranks):
-  cnt = np.bincount(ranks).astype('int64', copy=False)
+  """Pairs of equal values, ranks of any dtype (float durations too), counted by sorting"""
+  cnt = np.unique(np.asarray(ranks), return_counts=True)[1].astype('int64', copy=False)
   cnt = cnt[cnt > 1]
   return (cnt * (cnt - 1) // 2).sum()
 
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   metrics_test.py
+#        \author   chenghuige
+#          \date   2021-10-20 11:05:42.219384
+#   \Description   python -m pytest gezi/metrics/metrics_test.py
+#                  numba kernels against brute force (old python loop) versions
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import defaultdict
+
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+from gezi.metrics.metrics import (count_inversions, count_rank_tie, inverse_ratio, inverse_ratio_simple,
+                                  weighted_inverse, group_scores, group_auc, grouped_auc)
+
+def _pairs(n):
+  return [(i, j) for i in range(n - 1) for j in range(i + 1, n)]
+
+def _weighted_inverse_loop(x, y):
+  # as the old CountInverseWeighted: x ordered by y (stable), sum of x[i] - x[j] over inverted pairs
+  x = np.asarray(x, dtype=np.float64)[np.argsort(y, kind='mergesort')]
+  n = len(x)
+  dis_w = sum(x[i] - x[j] for i, j in _pairs(n) if x[i] > x[j])
+  tot = n * (n - 1) // 2 - sum(x[i] == x[j] for i, j in _pairs(n))
+  return dis_w / tot / np.mean(x[x != 0]) if tot else np.nan
+
+def _group_auc_loop(labels, preds, uids, weighted=True):
+  # as the old group_auc: dict of lists per uid, groups with one class are skipped
+  group_pred, group_truth = defaultdict(list), defaultdict(list)
+  for uid, truth, pred in zip(uids, labels, preds):
+    group_truth[uid].append(truth)
+    group_pred[uid].append(pred)
+  total_auc, total_impression = 0., 0.
+  for uid in group_truth:
+    truths = np.asarray(group_truth[uid])
+    if 0 < truths.sum() < len(truths):
+      impression = len(truths) if weighted else 1
+      total_auc += roc_auc_score(truths, group_pred[uid]) * impression
+      total_impression += impression
+  return total_auc / total_impression
+
+def _gen_groups(rng, num_groups, n):
+  uids = rng.integers(0, num_groups, n)
+  # rounded preds for ties within groups
+  return uids, rng.integers(0, 2, n), rng.random(n).round(1)
+
+def test_count_inversions():
+  rng = np.random.default_rng(0)
+  for n in [0, 1, 2, 7, 100, 1000]:
+    x = rng.integers(0, 20, n)
+    dis = sum(x[i] > x[j] for i, j in _pairs(n))
+    dis_w = sum(x[i] - x[j] for i, j in _pairs(n) if x[i] > x[j])
+    assert count_inversions(x) == dis
+    assert count_inversions(x, weighted=True) == (dis, dis_w)
+
+def test_count_rank_tie_any_dtype():
+  x = np.array([3, 1, 3, 3, 2, 1])
+  assert count_rank_tie(x) == 4
+  assert count_rank_tie(x.astype(np.float64) + 0.5) == 4
+  assert count_rank_tie(x - 10) == 4
+  assert count_rank_tie(np.array([], dtype=np.float32)) == 0
+
+def test_inverse_ratio():
+  rng = np.random.default_rng(1)
+  for _ in range(20):
+    n = int(rng.integers(2, 60))
+    x, y = rng.integers(0, 5, n), rng.random(n).round(1)
+    expected = inverse_ratio_simple(x, y)[0] if len(set(x)) > 1 and len(set(y)) > 1 else np.nan
+    assert np.allclose(inverse_ratio(x, y), expected, equal_nan=True)
+
+def test_weighted_inverse_float_durations():
+  rng = np.random.default_rng(2)
+  for _ in range(20):
+    n = int(rng.integers(2, 60))
+    # durations in seconds, with ties and zeros
+    x = rng.choice([0., 1.5, 2.25, 30., 61.75], n)
+    y = rng.random(n)
+    assert np.allclose(weighted_inverse(x, y), _weighted_inverse_loop(x, y), equal_nan=True)
+    assert np.allclose(weighted_inverse(x.astype(np.int64), y), _weighted_inverse_loop(x.astype(np.int64), y), equal_nan=True)
+
+def test_group_scores_weighted_float_durations():
+  rng = np.random.default_rng(3)
+  uids = np.repeat(np.arange(30), 8)
+  labels = rng.choice([0., 0., 3.5, 12.25, 60.], len(uids))
+  preds = rng.random(len(uids))
+  res = group_scores(labels, preds, uids, weighted=True)
+  assert 0. <= res['weighted_concordant'] <= 1.
+
+def test_group_auc():
+  rng = np.random.default_rng(4)
+  for num_groups, n in [(1, 10), (5, 50), (50, 2000)]:
+    uids, labels, preds = _gen_groups(rng, num_groups, n)
+    for weighted in [True, False]:
+      assert np.isclose(group_auc(labels, preds, uids, weighted), _group_auc_loop(labels, preds, uids, weighted))
+  uids, labels, preds = _gen_groups(rng, 20, 500)
+  uids = np.asarray(['u%d' % x for x in uids])
+  assert np.isclose(group_auc(labels, preds, uids), _group_auc_loop(labels, preds, uids))
+
+def test_grouped_auc_columns():
+  # several label columns sharing one group sort, as wechat uAUC over actions
+  rng = np.random.default_rng(5)
+  uids, _, _ = _gen_groups(rng, 40, 3000)
+  labels = rng.integers(0, 2, (len(uids), 3))
+  preds = rng.random((len(uids), 3)).round(2)
+  scores, aucs, group_ids = grouped_auc(labels, preds, uids)
+  assert (group_ids == np.unique(uids)).all()
+  for k in range(3):
+    assert np.isclose(scores[k], _group_auc_loop(labels[:, k], preds[:, k], uids, weighted=False))
+    for i, uid in enumerate(group_ids):
+      mask = uids == uid
+      if len(set(labels[mask, k])) == 2:
+        assert np.isclose(aucs[i, k], roc_auc_score(labels[mask, k], preds[mask, k]))
+      else:
+        assert np.isnan(aucs[i, k])
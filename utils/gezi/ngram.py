@@ -36,7 +36,8 @@ def get_ngrams(input, minn=3, maxn=3, start='<', end='>'):
 
   return ngrams
 
-from gezi import hash  
+# the function, gezi.hash is still the module while gezi/__init__ imports this
+from gezi.hash import hash
 
 # defaut 3, 6 according to fasttext default ngram, but may use 3, 3 only trigram 
 def get_ngrams_hash(input, buckets, minn=3, maxn=6, start='<', end='>', reserve=0):
@@ -55,3 +56,7 @@ def fasttext_ids(word, vocab, buckets, minn=3, maxn=6, start='<', end='>'):
   return ids
   
 
+def get_ngrams_hash_batch(words, buckets, minn=3, maxn=6, start='<', end='>', reserve=0, compat=False):
+  """n-gram ids of a list of words as (ids, offsets) flat arrays, compat for the buckets of get_ngrams_hash, see NgramHasher"""
+  from gezi.ngram_hash import NgramHasher
+  return NgramHasher(buckets, minn, maxn, start, end, reserve, compat).hash_words(words)
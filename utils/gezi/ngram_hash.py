@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   ngram_hash.py
+#        \author   chenghuige
+#          \date   2021-10-19 20:05:33.810472
+#   \Description   Batch fasttext style char n-gram hashing, words (or a token
+#                  stream with offsets) -> flat bucket ids + offsets
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+from numba import njit
+
+from gezi.ngram import get_ngrams
+from gezi.hash import hash as mmh3_hash
+
+_FNV_OFFSET = np.uint64(14695981039346656037)
+_FNV_PRIME = np.uint64(1099511628211)
+
+@njit(nogil=True, cache=True)
+def _hash_ngrams(chars, starts, lens, start, end, minn, maxn, buckets, reserve):
+  """fnv1a 64 over the code points of each n-gram of start + word + end, n from maxn down to minn as get_ngrams"""
+  n_words = len(starts)
+  offsets = np.zeros(n_words + 1, dtype=np.int64)
+  max_total = 0
+  for w in range(n_words):
+    total = lens[w] + len(start) + len(end)
+    max_total = max(max_total, total)
+    count = 0
+    for n in range(minn, maxn + 1):
+      if total >= n:
+        count += total - n + 1
+    offsets[w + 1] = offsets[w] + count
+  ids = np.empty(offsets[-1], dtype=np.int64)
+  buf = np.empty(max_total, dtype=np.uint64)
+  # first position of each n in the output of a word
+  firsts = np.empty(maxn + 1, dtype=np.int64)
+  buckets_ = np.uint64(buckets)
+  for w in range(n_words):
+    total = lens[w] + len(start) + len(end)
+    for p in range(len(start)):
+      buf[p] = start[p]
+    for p in range(lens[w]):
+      buf[len(start) + p] = chars[starts[w] + p]
+    for p in range(len(end)):
+      buf[len(start) + lens[w] + p] = end[p]
+    firsts[maxn] = offsets[w]
+    for n in range(maxn - 1, minn - 1, -1):
+      firsts[n] = firsts[n + 1] + max(total - n, 0)
+    # the hash of [i, i + n) continues the one of [i, i + n - 1)
+    for i in range(total):
+      h = _FNV_OFFSET
+      for n in range(1, min(maxn, total - i) + 1):
+        h ^= buf[i + n - 1]
+        h *= _FNV_PRIME
+        if n >= minn:
+          ids[firsts[n] + i] = reserve + np.int64(h % buckets_)
+  return ids, offsets
+
+def _code_points(text):
+  return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+class NgramHasher(object):
+  """
+  Char n-grams (minn..maxn of start + word + end, order as get_ngrams) -> reserve + hash % buckets.
+  Default hash is fnv1a 64 over unicode code points, computed in numba for a whole batch,
+  stable across processes and machines (unlike python hash).
+  compat=True uses gezi.hash (mmh3 hash64 of the utf8 n-gram), the buckets of get_ngrams_hash/fasttext_ids,
+  n-grams are then hashed in python per unique word with an lru cache of cache_size words.
+  """
+  def __init__(self, buckets, minn=3, maxn=6, start='<', end='>', reserve=0, compat=False, cache_size=100000):
+    self.buckets, self.minn, self.maxn = buckets, minn, maxn
+    self.start, self.end, self.reserve = start, end, reserve
+    self.compat = compat
+    self._start, self._end = _code_points(start), _code_points(end)
+    self._cached = lru_cache(maxsize=cache_size)(self._compute)
+
+  def _compute(self, word):
+    if self.compat:
+      ngrams = get_ngrams(word, self.minn, self.maxn, self.start, self.end)
+      ids = np.asarray([self.reserve + mmh3_hash(x) % self.buckets for x in ngrams], dtype=np.int64)
+    else:
+      ids = self.hash_stream(word, [0], [len(word)])[0]
+    # shared by the cache
+    ids.flags.writeable = False
+    return ids
+
+  def __call__(self, word):
+    """n-gram ids of one word, cached"""
+    return self._cached(word)
+
+  def hash_stream(self, text, starts, lens):
+    """Tokens text[starts[i]:starts[i] + lens[i]] of one long str -> (ids, offsets), ids of token i are ids[offsets[i]:offsets[i + 1]]"""
+    starts, lens = np.asarray(starts, dtype=np.int64), np.asarray(lens, dtype=np.int64)
+    if self.compat:
+      return self._concat([text[s:s + l] for s, l in zip(starts.tolist(), lens.tolist())])
+    return _hash_ngrams(_code_points(text), starts, lens, self._start, self._end,
+                        self.minn, self.maxn, self.buckets, self.reserve)
+
+  def hash_words(self, words):
+    """list of words -> (ids, offsets) flat np.int64 arrays, ids of words[i] are ids[offsets[i]:offsets[i + 1]]"""
+    if self.compat:
+      return self._concat(words)
+    lens = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+    starts = np.cumsum(lens) - lens
+    return self.hash_stream(''.join(words), starts, lens)
+
+  def _concat(self, words):
+    parts = [self._cached(word) for word in words]
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in parts], out=offsets[1:])
+    return (np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)), offsets
+
+  def split(self, ids, offsets):
+    """(ids, offsets) -> list of per word arrays (views)"""
+    return np.split(ids, offsets[1:-1])
+
+  def fasttext_ids(self, words, vocab):
+    """
+    As gezi.fasttext_ids for each word (with compat and reserve=0 the same ids): word id (if in vocab) then
+    vocab.size() + n-gram ids, returns (ids, offsets)
+    """
+    ngram_ids, ngram_offsets = self.hash_words(words)
+    word_ids = vocab.encode_batch(list(words), default=-1) if len(words) else np.zeros(0, dtype=np.int64)
+    has_word = (np.asarray(word_ids) >= 0).astype(np.int64)
+    counts = np.diff(ngram_offsets) + has_word
+    offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    ids = np.empty(offsets[-1], dtype=np.int64)
+    # word ids first then the n-gram ids of each word
+    ngram_pos = np.arange(len(ngram_ids)) + np.repeat(offsets[:-1] + has_word - ngram_offsets[:-1], np.diff(ngram_offsets))
+    ids[ngram_pos] = ngram_ids + vocab.size()
+    ids[offsets[:-1][has_word > 0]] = np.asarray(word_ids)[has_word > 0]
+    return ids, offsets
+
+
+def benchmark(num_words=200000, buckets=2000000, minn=3, maxn=6, seed=0):
+  """get_ngrams_hash word by word vs NgramHasher batch (and compat) on random words"""
+  from gezi.ngram import get_ngrams_hash
+  rng = np.random.default_rng(seed)
+  alphabet = list('abcdefghijklmnopqrstuvwxyz') + list('的一是了我不人在他有这个上们来到')
+  vocab = [''.join(rng.choice(alphabet, rng.integers(1, 12))) for _ in range(20000)]
+  # zipf like repeated words as real text
+  words = [vocab[min(i, len(vocab) - 1)] for i in rng.zipf(1.2, num_words) - 1]
+  t = time.time()
+  expected = [get_ngrams_hash(word, buckets, minn, maxn) for word in words]
+  loop = time.time() - t
+  for compat in [True, False]:
+    hasher = NgramHasher(buckets, minn, maxn, compat=compat)
+    t = time.time()
+    ids, offsets = hasher.hash_words(words)
+    elapsed = time.time() - t
+    if compat:
+      assert ids.tolist() == [x for l in expected for x in l]
+    print(f'words:{num_words} ngrams:{len(ids)} loop:{loop:.3f}s {"compat" if compat else "fnv"}:{elapsed:.3f}s ({loop / elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+  benchmark()
@@ -35,7 +35,6 @@ import pandas as pd
 from tempfile import NamedTemporaryFile
 from datetime import datetime, timedelta
 from shutil import copyfile, copy2
-from sklearn.preprocessing import normalize
 
 from absl import flags
 
@@ -45,7 +44,11 @@ import gezi
 
 logging = gezi.logging
 from io import StringIO
-import tensorflow as tf
+
+# sklearn and tensorflow are imported on use, import gezi should stay light
+def normalize(X, norm='l2', axis=1, copy=True, return_norm=False):
+  from sklearn.preprocessing import normalize
+  return normalize(X, norm=norm, axis=axis, copy=copy, return_norm=return_norm)
 
 
 def is_cn(word):
@@ -230,7 +233,7 @@ def load_image_into_numpy_array(image):
 
 
 def dirname(input):
-  if tf.io.gfile.isdir(input):
+  if isdir_(input):
     return input
   else:
     dirname = os.path.dirname(input)
@@ -612,6 +615,48 @@ def multithreads_run(target, args_list):
     t.join()
 
 
+import multiprocessing
+
+# ctx of running fork_map calls, innermost last
+_fork_ctxs = []
+
+def fork_ctx():
+  """ctx of the innermost running fork_map, for its fn (in forked workers or in this process)"""
+  return _fork_ctxs[-1]
+
+def fork_map(fn, items, ctx=None, num_workers=None, ordered=True, chunksize=1, on_wait=None):
+  """
+  Yields fn(item) of items run in num_workers forked processes (default all cores, at most len(items)),
+  in items order, or as they finish if not ordered. num_workers 1 runs in this process.
+  fn reads a copy of ctx (dict) by gezi.fork_ctx(), set before fork so closures, large arrays and memmaps
+  are inherited not pickled, and cleared when done so frames kept by tracebacks do not hold them.
+  on_wait() is called about every second while waiting for workers, e.g. to refresh a progress bar.
+  """
+  items = items if hasattr(items, '__len__') else list(items)
+  num_workers = max(min(num_workers or multiprocessing.cpu_count(), len(items)), 1)
+  ctx = dict(ctx or {})
+  _fork_ctxs.append(ctx)
+  try:
+    if num_workers == 1:
+      for item in items:
+        yield fn(item)
+    else:
+      with multiprocessing.get_context('fork').Pool(num_workers) as p:
+        results = (p.imap if ordered else p.imap_unordered)(fn, items, chunksize=chunksize)
+        while True:
+          try:
+            res = results.next(timeout=1 if on_wait else None)
+          except StopIteration:
+            break
+          except multiprocessing.TimeoutError:
+            on_wait()
+            continue
+          yield res
+  finally:
+    _fork_ctxs.pop()
+    ctx.clear()
+
+
 #@TODO move to bigdata_util.py
 
 
@@ -637,8 +682,17 @@ def file_is_empty(path):
     return True
 
 
+def isdir_(x):
+  if x.startswith('gs://'):
+    import tensorflow as tf
+    return tf.io.gfile.isdir(x)
+  else:
+    return os.path.isdir(x)
+
+
 def glob_(x):
   if x.startswith('gs://'):
+    import tensorflow as tf
     return tf.io.gfile.glob(x)
   else:
     return glob.glob(x)
@@ -646,6 +700,7 @@ def glob_(x):
 
 def exists_(x):
   if x.startswith('gs://'):
+    import tensorflow as tf
     return tf.io.gfile.exists(x)
   else:
     return os.path.exists(x)
@@ -660,7 +715,7 @@ def list_files(inputs):
     if not input or not input.strip():
       continue
     parts = []
-    if tf.io.gfile.isdir(input):
+    if isdir_(input):
       parts = glob_(f'{input}/*')
     else:
       parts = glob_(input)
@@ -1408,7 +1463,7 @@ def set_timeout(num, callback=None):
 #-----------gpu related TODO move
 
 #https://stackoverflow.com/questions/38559755/how-to-get-current-available-gpus-in-tensorflow
-from tensorflow.python.client import device_lib
+# from tensorflow.python.client import device_lib
 
 
 def get_num_available_gpus():
@@ -19,6 +19,7 @@ from __future__ import print_function
 
 import os
 import mmh3
+import numpy as np
 from absl import logging
 
 """copy from google im2txt tensorflow/models/im2txt/inference_util, 
@@ -266,6 +267,20 @@ class Vocabulary(object):
       for word in self.words():
         print(word, file=f)
 
+  def encode_batch(self, words, default=None):
+    """ids of a list or np.ndarray of words, np.int64 array of the same shape (ArrayVocabulary does it vectorized)"""
+    words_ = np.asarray(words, dtype=object)
+    ids = [self.id(word, default) for word in words_.reshape(-1)]
+    return np.asarray(ids, dtype=np.int64).reshape(words_.shape)
+
+  def decode_batch(self, ids):
+    words = [self.key(id_) for id_ in np.asarray(ids).reshape(-1)]
+    if isinstance(ids, np.ndarray):
+      res = np.empty(len(words), dtype=object)
+      res[:] = words
+      return res.reshape(ids.shape)
+    return words
+
   def ids(self, word, vocab_size=None):
     id_ = self.id(word)
     if id_ != self._unk_id and (not vocab_size or id_ < vocab_size):
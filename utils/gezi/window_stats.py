@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   window_stats.py
+#        \author   chenghuige
+#          \date   2021-10-15 10:48:12.402263
+#   \Description   Per key (doc, user..) per day counters stored as prefix sums,
+#                  any [start, end) day window count or rate is one gather
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import numpy as np
+
+class WindowStats(object):
+  """
+  cumsum[i, d, j] = sum of counter names[j] of keys[i] over days [0, d)
+  so window [start, end) is cumsum[i, end] - cumsum[i, start], keys are sorted int64 ids
+  """
+  def __init__(self, keys, names, cumsum):
+    self.keys = keys
+    self.names = list(names)
+    self.name_index = dict((name, i) for i, name in enumerate(self.names))
+    self.cumsum = cumsum
+
+  @property
+  def num_days(self):
+    return self.cumsum.shape[1] - 1
+
+  @staticmethod
+  def from_counts(keys, names, counts):
+    """counts: [num_keys, num_days, num_names] daily counts"""
+    keys = np.asarray(keys, dtype=np.int64)
+    order = np.argsort(keys, kind='mergesort')
+    counts = np.asarray(counts)[order]
+    cumsum = np.zeros((counts.shape[0], counts.shape[1] + 1, counts.shape[2]),
+                      dtype=np.float64 if counts.dtype.kind == 'f' else np.int64)
+    np.cumsum(counts, axis=1, out=cumsum[:, 1:])
+    return WindowStats(keys[order], names, cumsum)
+
+  @staticmethod
+  def from_dict(data, names, num_days=None):
+    """data: dict key -> dict name -> list of daily counts (index is day)"""
+    keys = list(data.keys())
+    if num_days is None:
+      num_days = max((len(data[key][name]) for key in keys for name in names), default=0)
+    counts = np.zeros((len(keys), num_days, len(names)))
+    for i, key in enumerate(keys):
+      for j, name in enumerate(names):
+        values = data[key][name]
+        counts[i, :len(values), j] = values
+    return WindowStats.from_counts(keys, names, counts)
+
+  @staticmethod
+  def from_df(df, key, day, names, num_days=None):
+    """df: one row per event or per (key, day) with counter columns names"""
+    keys, key_index = np.unique(df[key].values, return_inverse=True)
+    days = df[day].values.astype(np.int64)
+    num_days = num_days or int(days.max()) + 1
+    counts = np.zeros((len(keys), num_days, len(names)))
+    for j, name in enumerate(names):
+      np.add.at(counts[:, :, j], (key_index, days), df[name].values)
+    return WindowStats.from_counts(keys, names, counts)
+
+  def save(self, dir):
+    os.makedirs(dir, exist_ok=True)
+    np.save(f'{dir}/keys.npy', self.keys)
+    np.save(f'{dir}/cumsum.npy', self.cumsum)
+    with open(f'{dir}/names.json', 'w') as f:
+      json.dump(self.names, f)
+
+  @staticmethod
+  def load(dir, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    names = json.load(open(f'{dir}/names.json'))
+    return WindowStats(np.load(f'{dir}/keys.npy', mmap_mode=mmap_mode), names,
+                       np.load(f'{dir}/cumsum.npy', mmap_mode=mmap_mode))
+
+  def index(self, keys):
+    """Row of each key, -1 if not found, compute once and reuse for several sum/rate calls"""
+    keys = np.asarray(keys, dtype=np.int64)
+    if not len(self.keys):
+      return np.full(keys.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+    return np.where(self.keys[pos] == keys, pos, -1)
+
+  def sum(self, idx, start, end, names=None):
+    """
+    Window sum over days [start, end) for rows idx (from self.index), start/end are scalars or arrays 
+    clipped to [0, num_days], Returns [n, len(names)], zeros for unknown keys
+    """
+    names = names or self.names
+    cols = [self.name_index[name] for name in names]
+    n = len(idx)
+    start = np.clip(np.broadcast_to(start, (n,)), 0, self.num_days)
+    end = np.clip(np.broadcast_to(end, (n,)), 0, self.num_days)
+    end = np.maximum(start, end)
+    if not len(self.keys):
+      return np.zeros((n, len(cols)), dtype=self.cumsum.dtype)
+    rows = np.maximum(idx, 0)
+    res = self.cumsum[rows, end][:, cols] - self.cumsum[rows, start][:, cols]
+    res[idx < 0] = 0
+    return res
+
+  def rate(self, idx, start, end, name, base, a=0., b=1., default=0.):
+    """(sum(name) + a) / (sum(base) + b) over the window, default if no base counts"""
+    counts = self.sum(idx, start, end, [name, base])
+    return np.where(counts[:, 1] > 0, (counts[:, 0] + a) / (counts[:, 1] + b), default)
@@ -15,12 +15,58 @@ from __future__ import print_function
 import sys, os
 from collections import Counter
 
+import numpy as np
+
+from gezi.util import fork_map, fork_ctx
+
+class CountMinSketch(object):
+  """
+  depth x width int64 counts, estimate is the min over rows (never under counts).
+  Rows are multiply-shift hashes of python hash(word), so sketches merge (add) within one process tree
+  (forked workers share the str hash seed).
+  """
+  def __init__(self, width=2**20, depth=4, seed=0):
+    assert width & (width - 1) == 0, 'width must be a power of 2'
+    self.width, self.depth = width, depth
+    self.shift = np.uint64(64 - int(np.log2(width)))
+    self.multipliers = np.random.RandomState(seed).randint(1, 2**62, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    self.table = np.zeros((depth, width), dtype=np.int64)
+
+  def _rows(self, words):
+    h = np.fromiter(map(hash, words), dtype=np.int64, count=len(words)).view(np.uint64)
+    return (h[None] * self.multipliers[:, None]) >> self.shift
+
+  def add(self, words, counts=None):
+    for row, index in enumerate(self._rows(words)):
+      self.table[row] += np.bincount(index.astype(np.int64), weights=counts, minlength=self.width).astype(np.int64)
+
+  def estimate(self, words):
+    rows = self._rows(words).astype(np.int64)
+    return self.table[np.arange(self.depth)[:, None], rows].min(0)
+
+  def merge(self, other):
+    assert (self.width, self.depth) == (other.width, other.depth) and (self.multipliers == other.multipliers).all()
+    self.table += other.table
+    return self
+
+
 class WordCounter(object): 
+  """
+  Exact: a Counter, adds() counts a whole list at once (C loop of Counter.update).
+  approx=True: for unbounded id spaces, memory is bounded by a count-min sketch and at most capacity
+  heavy hitter candidates (with sketch estimated counts), tokens are buffered and counted batch_size at a time.
+  Counters merge (merge or +=), so shards can be counted in processes, see count_files.
+  """
   def __init__(self,
                most_common=None, 
                min_count=None,
                write_unknown=True,
-               unknown_mark='<UNK>'):
+               unknown_mark='<UNK>',
+               approx=False,
+               capacity=None,
+               width=2**20,
+               depth=4,
+               batch_size=1000000):
     self.most_common = most_common
     self.min_count = min_count or 0
     self.write_unknown = write_unknown
@@ -29,19 +75,85 @@ class WordCounter(object):
     self.counter = Counter()
     self.total = 0
 
+    self.approx = approx
+    if approx:
+      self.capacity = capacity or most_common or 1000000
+      self.sketch = CountMinSketch(width, depth)
+      self.batch_size = batch_size
+      self.buffer = Counter()
+      self.pending = 0
+
   def add(self, word, count=1):
+    if self.approx:
+      self.buffer[word] += count
+      self._pend(count)
+      return
     self.counter[word] += count 
     self.total += count 
 
   def adds(self, words):
-    for word in words:
-      self.add(word)
+    if not isinstance(words, (list, tuple)):
+      words = list(words)
+    if self.approx:
+      self.buffer.update(words)
+      self._pend(len(words))
+      return
+    self.counter.update(words)
+    self.total += len(words)
+
+  def _pend(self, count):
+    self.total += count
+    self.pending += count
+    if self.pending >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    """Approx mode: count buffered tokens into the sketch and refresh the heavy hitter candidates"""
+    if not self.approx or not self.buffer:
+      return
+    batch, self.buffer, self.pending = self.buffer, Counter(), 0
+    words = list(batch)
+    self.sketch.add(words, np.fromiter(batch.values(), dtype=np.float64, count=len(words)))
+    self._refresh(set(words) | set(self.counter))
+
+  def _refresh(self, words):
+    words = list(words)
+    estimates = self.sketch.estimate(words)
+    if len(words) > self.capacity:
+      keep = np.argpartition(-estimates, self.capacity - 1)[:self.capacity]
+      words, estimates = [words[i] for i in keep], estimates[keep]
+    self.counter = Counter(dict(zip(words, estimates.tolist())))
+
+  def merge(self, other):
+    if self.approx:
+      self.flush()
+      other.flush()
+      self.sketch.merge(other.sketch)
+      self._refresh(set(self.counter) | set(other.counter))
+    else:
+      self.counter.update(other.counter)
+    self.total += other.total
+    return self
+
+  def __iadd__(self, other):
+    return self.merge(other)
+
+  def prune(self, most_common=None, min_count=None):
+    """Drop words below min_count and beyond the most_common top words (total kept, so unknown_count is the same)"""
+    self.flush()
+    most_common = most_common or self.most_common
+    min_count = min_count or self.min_count
+    items = self.counter.most_common(most_common)
+    self.counter = Counter(dict((word, count) for word, count in items if count >= min_count))
+    return self
 
   @property  
   def count(self):
+    self.flush()
     return len(self.counter)
   
   def save(self, filename, most_common=None, min_count=None):
+    self.flush()
     if not most_common:
       most_common = self.most_common
       if not most_common:
@@ -72,4 +184,64 @@ class WordCounter(object):
         print(word, count, sep='\t', file=out)
 
 
-      
+def _line_spans(files, chunk_bytes):
+  spans = []
+  for file in files:
+    size = os.path.getsize(file)
+    spans += [(file, start, min(start + chunk_bytes, size)) for start in range(0, max(size, 1), chunk_bytes)]
+  return spans
+
+def _read_lines(file, start, end):
+  """lines (without newline) starting in byte range [start, end)"""
+  with open(file, 'rb') as f:
+    if start > 0:
+      # finish the line holding byte start - 1, it belongs to the previous span
+      f.seek(start - 1)
+      f.readline()
+    pos = f.tell()
+    while pos < end:
+      line = f.readline()
+      if not line:
+        break
+      pos += len(line)
+      yield line.decode('utf8').rstrip('\n')
+
+def _count_shard(shard):
+  # parse_fn and read_fn (closures, lambdas) are inherited by fork not pickled
+  ctx = fork_ctx()
+  counters = dict((name, WordCounter(**ctx['kwargs'])) for name in ctx['names'])
+  file = shard[0]
+  items = ctx['read_fn'](file) if ctx['read_fn'] else _read_lines(*shard)
+  parse_fn = ctx['parse_fn']
+  for item in items:
+    res = parse_fn(item, file) if ctx['with_file'] else parse_fn(item)
+    if isinstance(res, dict):
+      for name, words in res.items():
+        counters[name].adds(words)
+    else:
+      counters[None].adds(res)
+  for counter in counters.values():
+    counter.flush()
+  return counters
+
+def count_files(files, parse_fn=str.split, names=None, read_fn=None, with_file=False, num_workers=None,
+                chunk_bytes=64 * 2**20, **kwargs):
+  """
+  Count tokens of files in num_workers forked processes, returns the merged WordCounter
+  (dict name -> WordCounter if names), then save(vocab_file) as usual.
+  Text files are split into byte ranges of chunk_bytes at line starts, so a few large files also use all cores,
+  with read_fn(file) -> items (e.g. tfrecord examples) each file is a shard.
+  parse_fn(line) (or parse_fn(line, file) if with_file) -> tokens, or dict name -> tokens to fill several counters
+  in one pass. kwargs go to WordCounter (most_common, min_count, approx, capacity...),
+  per shard counts are exact (or sketches) and merged before pruning, so the result is the same as one process.
+  """
+  files = [files] if isinstance(files, str) else list(files)
+  shards = [(file,) for file in files] if read_fn else _line_spans(files, chunk_bytes)
+  ctx = dict(parse_fn=parse_fn, read_fn=read_fn, with_file=with_file, kwargs=kwargs,
+             names=names or [None])
+  merged = dict((name, WordCounter(**kwargs)) for name in (names or [None]))
+  # in shard order, so words of equal count keep the first seen order of one pass
+  for counters in fork_map(_count_shard, shards, ctx, num_workers):
+    for name in merged:
+      merged[name].merge(counters[name])
+  return merged if names else merged[None]
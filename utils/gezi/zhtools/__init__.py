@@ -1 +1,11 @@
-from gezi.zhtools import langconv
+from gezi.lazy import LazyModules
+
+# langconv imports the zh_wiki tables, loaded on first use, fastconv reads its compiled cache instead
+_lazy = LazyModules(globals())
+__getattr__, __dir__ = _lazy.getattr, _lazy.dir
+_lazy.add('gezi.zhtools.langconv')
+
+from gezi.zhtools import fastconv
+from gezi.zhtools.fastconv import FastConverter, convert_many
+
+__all__ = ['langconv', 'fastconv', 'FastConverter', 'convert_many']
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   fastconv.py
+#        \author   chenghuige
+#          \date   2021-10-18 16:40:12.518204
+#   \Description   Compiled traditional <-> simplified converter, same output as
+#                  langconv.Converter, convert_many runs in forked workers
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import re
+import time
+import pickle
+from multiprocessing import cpu_count
+
+from gezi.util import fork_map, fork_ctx
+
+# a bump invalidates disk caches of the compiled tables
+VERSION = 1
+
+# machine states, as langconv (a machine is [state, final, len, pool])
+(START, END, FAIL, WAIT_TAIL) = list(range(4))
+
+def compile_map(convert_map):
+  """
+  langconv.ConvertMap -> (table, translate, starters)
+  table: prefix -> (is_tail, have_child, to_word) with to_word resolved as langconv.Node does,
+  translate: str.translate table of single chars, starters: regex of chars a longer key starts with.
+  """
+  table = {}
+  for key, (is_tail, have_child, to_word) in convert_map._map.items():
+    table[key] = (is_tail, have_child, to_word or key)
+  translate = dict((ord(key), to_word) for key, (_, have_child, to_word) in table.items()
+                   if len(key) == 1 and not have_child and to_word != key)
+  starters = ''.join(sorted(key for key, (_, have_child, _) in table.items() if len(key) == 1 and have_child))
+  starters = re.compile('[%s]' % re.escape(starters)) if starters else None
+  return table, translate, starters
+
+def _zh_wiki_file():
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zh_wiki.py')
+
+def load_compiled(to_encoding, cache_dir=None):
+  """
+  Compiled tables of a langconv map, zh-hans and zh-hant are cached under cache_dir (default ~/.cache/gezi/zhtools)
+  keyed by zh_wiki.py mtime and size, so later processes skip importing zh_wiki and building the map.
+  Maps registered at runtime (langconv.registery) are compiled each time.
+  """
+  cache_file = None
+  if to_encoding in ('zh-hans', 'zh-hant'):
+    cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'gezi', 'zhtools')
+    stat = os.stat(_zh_wiki_file())
+    cache_file = os.path.join(cache_dir, f'{to_encoding}.v{VERSION}.{int(stat.st_mtime)}.{stat.st_size}.pkl')
+    if os.path.exists(cache_file):
+      try:
+        with open(cache_file, 'rb') as f:
+          return pickle.load(f)
+      except Exception:
+        pass
+  from gezi.zhtools import langconv
+  compiled = compile_map(langconv.MAPS[to_encoding])
+  if cache_file:
+    try:
+      os.makedirs(cache_dir, exist_ok=True)
+      tmp = f'{cache_file}.{os.getpid()}'
+      with open(tmp, 'wb') as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp, cache_file)
+    except Exception:
+      pass
+  return compiled
+
+
+class FastConverter(object):
+  """
+  Same output as langconv.Converter(to_encoding).convert(text).
+  Runs of chars no longer key starts with are converted by str.translate, the langconv state machines
+  (fewest segments wins, ties by machine order) only run from a starter char until they commit,
+  on flat lists and the compiled prefix table instead of Node objects and deepcopy.
+  """
+  def __init__(self, to_encoding='zh-hans', cache_dir=None):
+    self.to_encoding = to_encoding
+    self.table, self.translate, self.starters = load_compiled(to_encoding, cache_dir)
+
+  def _feed(self, machine, char):
+    state, final, length, pool = machine
+    if state == END:
+      state = START
+    key = pool + char
+    entry = self.table.get(key)
+    if entry is None:
+      # not in map, the char as is, a longer pool was a dead end
+      if state == WAIT_TAIL:
+        machine[0] = FAIL
+      else:
+        machine[:] = [END, final + key, length + 1, '']
+      return None
+    is_tail, have_child, to_word = entry
+    if not have_child:
+      machine[:] = [END, final + to_word, length + 1, '']
+      return None
+    if is_tail or state == START:
+      # take the shorter word here, a clone waits for a longer one
+      machine[:] = [END, final + to_word, length + 1, '']
+      return [WAIT_TAIL, final, length, key]
+    machine[3] = key
+    return None
+
+  def _run(self, text, pos):
+    """Machines from pos until they all end at the same char, returns (converted, next pos)"""
+    machines = [[START, '', 0, '']]
+    feed = self._feed
+    for i in range(pos, len(text)):
+      char = text[i]
+      branches = []
+      for machine in machines:
+        new = feed(machine, char)
+        if new:
+          branches.append(new)
+      machines = [machine for machine in machines + branches if machine[0] != FAIL]
+      if all(machine[0] == END for machine in machines):
+        return min(machines, key=lambda x: x[2])[1], i + 1
+    machines = [machine for machine in machines if machine[0] == END]
+    return (min(machines, key=lambda x: x[2])[1] if machines else ''), len(text)
+
+  def convert(self, text):
+    if self.starters is None:
+      return text.translate(self.translate)
+    res = []
+    pos = 0
+    search = self.starters.search
+    while pos < len(text):
+      m = search(text, pos)
+      if m is None:
+        res.append(text[pos:].translate(self.translate))
+        break
+      start = m.start()
+      if start > pos:
+        res.append(text[pos:start].translate(self.translate))
+      if text[start:start + 2] not in self.table:
+        # the clone waiting for a longer word fails on the next char, same as a fresh start there
+        res.append(self.table[text[start]][2])
+        pos = start + 1
+        continue
+      converted, pos = self._run(text, start)
+      res.append(converted)
+    return ''.join(res)
+
+  __call__ = convert
+
+  def convert_many(self, texts, num_workers=1, chunk_size=1000):
+    return convert_many(texts, self.to_encoding, num_workers, chunk_size, converter=self)
+
+
+_converters = {}
+
+def get_converter(to_encoding='zh-hans'):
+  if to_encoding not in _converters:
+    _converters[to_encoding] = FastConverter(to_encoding)
+  return _converters[to_encoding]
+
+def convert(text, to_encoding='zh-hans'):
+  return get_converter(to_encoding).convert(text)
+
+def _convert_range(span):
+  # texts are inherited by fork not pickled
+  ctx = fork_ctx()
+  converter, texts = ctx['converter'], ctx['texts']
+  return [converter.convert(texts[i]) for i in range(*span)]
+
+def convert_many(texts, to_encoding='zh-hans', num_workers=None, chunk_size=1000, converter=None):
+  """Converted list of texts (list, array or other indexable), chunks of chunk_size in num_workers forked processes"""
+  converter = converter or get_converter(to_encoding)
+  num_texts = len(texts)
+  spans = [(i, min(i + chunk_size, num_texts)) for i in range(0, num_texts, chunk_size)]
+  num_workers = max(min(num_workers or cpu_count(), len(spans)), 1)
+  if num_workers == 1:
+    return [converter.convert(text) for text in texts]
+  res = []
+  for converted in fork_map(_convert_range, spans, dict(converter=converter, texts=texts), num_workers):
+    res += converted
+  return res
+
+
+def gen_corpus(num_texts=10000, max_len=200, seed=0):
+  """Chat like texts: common chars of both scripts, dictionary words, ascii, digits and punctuation"""
+  import random
+  from gezi.zhtools.zh_wiki import zh2Hant, zh2Hans
+  rng = random.Random(seed)
+  words = sorted(set(list(zh2Hant) + list(zh2Hans) + list(zh2Hant.values()) + list(zh2Hans.values())))
+  chars = sorted(set(''.join(words)))
+  others = list('的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会') \
+           + list('abcdefghijklmnopqrstuvwxyz0123456789 ,.!?，。！？、：；“”')
+  texts = []
+  for _ in range(num_texts):
+    pieces = []
+    for _ in range(rng.randint(1, max_len // 4)):
+      r = rng.random()
+      pieces.append(rng.choice(words) if r < 0.1 else rng.choice(chars) if r < 0.5 else rng.choice(others))
+    texts.append(''.join(pieces)[:max_len])
+  return texts
+
+def benchmark(texts=None, to_encodings=('zh-hans', 'zh-hant'), num_workers=None, check=True):
+  """Throughput of langconv.Converter vs FastConverter (and convert_many), asserts outputs are the same if check"""
+  from gezi.zhtools import langconv
+  texts = texts if texts is not None else gen_corpus()
+  num_chars = sum(len(text) for text in texts)
+  for to_encoding in to_encodings:
+    t = time.time()
+    converter = langconv.Converter(to_encoding)
+    expected = [converter.convert(text) for text in texts]
+    slow = time.time() - t
+    t = time.time()
+    fast_converter = FastConverter(to_encoding)
+    load = time.time() - t
+    t = time.time()
+    res = [fast_converter.convert(text) for text in texts]
+    fast = time.time() - t
+    t = time.time()
+    res_many = convert_many(texts, to_encoding, num_workers, converter=fast_converter)
+    many = time.time() - t
+    if check:
+      assert res == expected and res_many == expected, to_encoding
+    print(f'{to_encoding} texts:{len(texts)} chars:{num_chars} langconv:{slow:.3f}s fast:{fast:.3f}s ({slow / fast:.1f}x)',
+          f'convert_many:{many:.3f}s load:{load * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+  benchmark(open(sys.argv[1]).read().splitlines() if len(sys.argv) > 1 else None)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   collector.py
+#        \author   chenghuige
+#          \date   2021-10-16 10:23:41.518203
+#   \Description   Columnar batch collector for eval predictions and inputs,
+#                  buffers preallocated once and filled in place
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import gezi
+logging = gezi.logging
+
+def _to_numpy(x):
+  if hasattr(x, 'values') and isinstance(x.values, (tuple, list)):
+    # PerReplica
+    x = np.concatenate([_to_numpy(v) for v in x.values], 0)
+  if hasattr(x, 'numpy'):
+    x = x.numpy()
+  return np.asarray(x)
+
+
+class PredCollector(object):
+  """
+  Collect dict of batches (tensors or arrays) to dict of [num_examples, ...] arrays.
+  Each key's buffer is allocated on its first batch from num_examples (grows by doubling if unknown),
+  batches are copied in place, rows beyond num_examples (padded last batch) are dropped.
+  If the total size exceeds max_bytes, numeric buffers are memory-mapped .npy files under mmap_dir.
+  """
+  def __init__(self, num_examples=None, keys=None, max_bytes=None, mmap_dir=None):
+    self.num_examples = num_examples
+    self.keys = set(keys) if keys else None
+    self.max_bytes = max_bytes
+    self.mmap_dir = mmap_dir
+    self.owned_dir = None
+    self.buffers = {}
+    self.counts = {}
+    self.fallbacks = {}
+    self.mmap = None
+
+  def _use_mmap(self, batch):
+    if self.mmap is None:
+      if not self.max_bytes or not self.num_examples:
+        self.mmap = False
+      else:
+        row_bytes = sum(x.nbytes // max(len(x), 1) for x in batch.values())
+        self.mmap = row_bytes * self.num_examples > self.max_bytes
+        if self.mmap:
+          if self.mmap_dir:
+            os.makedirs(self.mmap_dir, exist_ok=True)
+          self.owned_dir = tempfile.mkdtemp(prefix='eval_', dir=self.mmap_dir)
+          logging.debug('eval collector spill to', self.owned_dir, 'rows', self.num_examples, 'row_bytes', row_bytes)
+    return self.mmap
+
+  def _alloc(self, key, x, mmap):
+    shape = (self.num_examples or max(len(x), 1) * 16,) + x.shape[1:]
+    if mmap and x.dtype != object:
+      return np.lib.format.open_memmap(f'{self.owned_dir}/{key.replace("/", "_")}.npy',
+                                       mode='w+', dtype=x.dtype, shape=shape)
+    return np.empty(shape, dtype=x.dtype)
+
+  def add(self, batch):
+    batch = dict((key, _to_numpy(val)) for key, val in batch.items() \
+                   if self.keys is None or key in self.keys)
+    batch = dict((key, val.reshape(1) if val.ndim == 0 else val) for key, val in batch.items())
+    if not batch:
+      return
+    mmap = self._use_mmap(batch)
+    for key, x in batch.items():
+      if key in self.fallbacks:
+        self.fallbacks[key].append(x)
+        continue
+      if key not in self.buffers:
+        self.buffers[key] = self._alloc(key, x, mmap)
+        self.counts[key] = 0
+      buf, count = self.buffers[key], self.counts[key]
+      if x.shape[1:] != buf.shape[1:] or (x.dtype != buf.dtype and not np.can_cast(x.dtype, buf.dtype)):
+        # variable length dims, keep as list and concat at last
+        logging.debug(f'eval collector {key} {buf.shape[1:]} -> {x.shape[1:]}, fallback to concat')
+        self.fallbacks[key] = [buf[:count], x]
+        del self.buffers[key]
+        continue
+      n = len(x)
+      if self.num_examples:
+        n = min(n, len(buf) - count)
+      elif count + n > len(buf):
+        buf = np.concatenate([buf[:count], np.empty((max(len(buf), n),) + buf.shape[1:], dtype=buf.dtype)])
+        self.buffers[key] = buf
+      buf[count:count + n] = x[:n]
+      self.counts[key] = count + n
+
+  def result(self):
+    res = {}
+    for key in self.buffers:
+      res[key] = self.buffers[key][:self.counts[key]]
+    for key in self.fallbacks:
+      res[key] = np.concatenate(self.fallbacks[key])
+      if self.num_examples:
+        res[key] = res[key][:self.num_examples]
+    return res
+
+  def close(self):
+    """Remove spilled files, results from mmap buffers are invalid after this"""
+    self.buffers = {}
+    self.fallbacks = {}
+    if self.owned_dir:
+      shutil.rmtree(self.owned_dir, ignore_errors=True)
+      self.owned_dir = None
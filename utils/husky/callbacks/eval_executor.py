@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   eval_executor.py
+#        \author   chenghuige
+#          \date   2021-10-16 15:02:17.310448
+#   \Description   Run metric computation in forked worker processes while
+#                  training goes on, report results in eval_step order
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import traceback
+import multiprocessing
+from collections import deque
+
+import gezi
+logging = gezi.logging
+
+def _run(conn, fn, args):
+  try:
+    res = fn(*args)
+  except Exception:
+    logging.warning('async eval error')
+    logging.warning(traceback.format_exc())
+    res = None
+  try:
+    conn.send(res)
+  except Exception:
+    logging.warning(traceback.format_exc())
+    conn.send(None)
+  conn.close()
+
+
+class EvalExecutor(object):
+  """
+  Each submitted eval is computed in a forked process, so predictions, eval_fn (closures, lambdas)
+  and kwargs are inherited instead of pickled, only the (small) result comes back through a pipe.
+  At most max_pending evals are in flight, submit blocks on the oldest one when full.
+  report_fn(result) runs in the calling process in submit order, so metrics.csv rows,
+  tensorboard and wandb (which can not log from child processes) stay ordered by eval_step.
+  """
+  def __init__(self, max_pending=2):
+    self.max_pending = max(max_pending, 1)
+    self.ctx = multiprocessing.get_context('fork')
+    self.pending = deque()
+
+  def __len__(self):
+    return len(self.pending)
+
+  def submit(self, eval_step, fn, args, report_fn):
+    while len(self.pending) >= self.max_pending:
+      logging.debug('eval queue full, waiting eval_step', self.pending[0][0])
+      self._deliver(block=True)
+    reader, writer = self.ctx.Pipe(duplex=False)
+    p = self.ctx.Process(target=_run, args=(writer, fn, args))
+    p.start()
+    writer.close()
+    self.pending.append((eval_step, p, reader, report_fn))
+    self.poll()
+
+  def _deliver(self, block=False):
+    eval_step, p, reader, report_fn = self.pending[0]
+    if not block and not reader.poll():
+      return False
+    try:
+      res = reader.recv()
+    except EOFError:
+      logging.warning(f'async eval of eval_step {eval_step} exit without result, exitcode {p.exitcode}')
+      res = None
+    reader.close()
+    p.join()
+    self.pending.popleft()
+    if res is not None:
+      report_fn(res)
+    return True
+
+  def poll(self):
+    """Report finished evals at the queue head, never blocks, cheap enough for each batch end"""
+    while self.pending and self._deliver(block=False):
+      pass
+
+  def join(self):
+    while self.pending:
+      self._deliver(block=True)
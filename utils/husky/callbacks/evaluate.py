@@ -25,6 +25,7 @@ from tensorflow.keras import backend as K
 
 import math
 import inspect
+import functools
 import traceback
 import copy
 # from tqdm import tqdm
@@ -43,6 +44,8 @@ import melt
 from melt.flow.flow import _try_eval, _on_epoch_end, _async_valid, _try_eval_day
 from melt.distributed import tonumpy
 from husky.callbacks.tqdm_progress_bar import TQDMProgressBar
+from husky.callbacks.collector import PredCollector
+from husky.callbacks.eval_executor import EvalExecutor
 
 try:
   import wandb
@@ -66,23 +69,9 @@ def _prepare_eval_part(part, parts):
   steps = -(-num_examples // FLAGS.eval_batch_size)
   return dataset, steps, num_examples
 
-# TODO wandb 不支持异步新启动的进程 可以考虑 ValidLossCallback 进行valid计算的 batch end 检查文件 写入wandb metrics信息, 当然一般不需要异步
-def eval(eval_fn, y, y_, dataset, kwargs, logger, writer, eval_step, step, epoch, 
-        num_valid_examples, is_last, eval_pred_time, 
-        gtimer=None, pre=None, logs={}, wandb_run=None, silent=False):
+def compute_metrics(eval_fn, y, y_, dataset, kwargs, num_valid_examples, eval_pred_time, gtimer=None):
+  """Run eval_fn, returns OrderedDict of Metrics/ Infos/ and other results, can run in a worker process"""
   timer = gezi.Timer('eval')
-  melt.save_eval_step()
-  # 异步需要重新生成一个logger避免同时写
-  if logger:
-    logger = melt.get_summary_writer()
-  writer = gezi.DfWriter(FLAGS.log_dir, filename='metrics.csv')
-  writer2 = gezi.DfWriter(FLAGS.log_dir, filename='infos.csv')
-  writer3 = gezi.DfWriter(FLAGS.log_dir, filename='others.csv')
-  # eval_step += 1
-  # gezi.set('eval_step', eval_step)
-
-  # TODO 当前这种设计存在一个问题就是如果eval_fn比较慢就迟迟不能展现eval结果 比如eval内部需要写图片log比较慢这种
-  # 需要阻塞等待处理完在处理res结果 而实际上res早就完成一直等待 不过这么处理逻辑比较简单清晰
   try:
     if y is not None:
       results = eval_fn(y, y_, **kwargs)
@@ -104,7 +93,6 @@ def eval(eval_fn, y, y_, dataset, kwargs, logger, writer, eval_step, step, epoch
     logging.warning('eval fn error')
     logging.warning(traceback.format_exc())
     results = {}
-  logging.debug(f'eval_step: {eval_step} step: {step}', 'epoch: %.2f' % epoch)
 
   if isinstance(results, (list, tuple)):
     try:
@@ -123,7 +111,17 @@ def eval(eval_fn, y, y_, dataset, kwargs, logger, writer, eval_step, step, epoch
   results['elapsed'] = gtimer.elapsed(reset=False)
   results['eval_metrics_time'] = timer.elapsed()
   results['eval_pred_time'] = eval_pred_time
-  
+  return results
+
+
+def report_metrics(results, logger, eval_step, step, epoch, is_last, wandb_run=None, silent=False):
+  """Print results and write them to metrics.csv/infos.csv/others.csv, tensorboard and wandb"""
+  melt.save_eval_step()
+  writer = gezi.DfWriter(FLAGS.log_dir, filename='metrics.csv')
+  writer2 = gezi.DfWriter(FLAGS.log_dir, filename='infos.csv')
+  writer3 = gezi.DfWriter(FLAGS.log_dir, filename='others.csv')
+  logging.debug(f'eval_step: {eval_step} step: {step}', 'epoch: %.2f' % epoch)
+
   res = type(results)([(key, results[key]) for key in results if key.startswith('Metrics/')])
   res2 = type(results)([(key, results[key]) for key in results if key.startswith('Infos/')])
   res3 = type(results)([(key, results[key]) for key in results if not (key in res or key in res2) ])
@@ -221,6 +219,13 @@ def eval(eval_fn, y, y_, dataset, kwargs, logger, writer, eval_step, step, epoch
   _try_eval_day()
 
 
+def eval(eval_fn, y, y_, dataset, kwargs, logger, writer, eval_step, step, epoch, 
+        num_valid_examples, is_last, eval_pred_time, 
+        gtimer=None, pre=None, logs={}, wandb_run=None, silent=False):
+  results = compute_metrics(eval_fn, y, y_, dataset, kwargs, num_valid_examples, eval_pred_time, gtimer)
+  report_metrics(results, logger, eval_step, step, epoch, is_last, wandb_run, silent)
+
+
 class EvalCallback(Callback):
   def __init__(self, model, dataset, eval_fn, 
                info_dataset=None,
@@ -290,6 +295,8 @@ class EvalCallback(Callback):
     self.write_valid_steps = set()
 
     self.cached_xs = None
+    self.collectors = []
+    self.executor = None
 
     self.pre = pre
 
@@ -305,6 +312,34 @@ class EvalCallback(Callback):
     self.outdir = os.path.dirname(self.ofile)
     self.is_last = False
 
+  def predict_collect(self, eval_step):
+    model = self.model
+    for collector in self.collectors:
+      collector.close()
+    max_bytes = int(FLAGS.eval_mmap_gb * (1 << 30)) if FLAGS.eval_mmap_gb else None
+    xs_collector = PredCollector(self.num_valid_examples, max_bytes=max_bytes, mmap_dir=FLAGS.model_dir)
+    outputs_collector = PredCollector(self.num_valid_examples, max_bytes=max_bytes, mmap_dir=FLAGS.model_dir)
+    eval_iter = iter(self.info_dataset)
+    for i in tqdm(range(self.steps), ascii=False, desc=f'eval_predict_{eval_step}', leave=FLAGS.eval_leave):
+      xs, y = next(eval_iter)
+      res = model.predict_on_batch(xs)
+      if isinstance(res, (tuple, list)):
+        if len(res) == len(self.out_keys):
+          res = dict(zip(self.out_keys, res))
+        else:
+          res = dict(zip(['pred'] + self.out_keys, res))
+      elif not isinstance(res, dict): 
+        res = {'pred': res}
+      if not isinstance(xs, dict):
+        xs = {}
+      xs = dict((key, xs[key]) for key in xs if not self.eval_keys or key in self.eval_keys)
+      xs['y'] = y
+      xs_collector.add(xs)
+      outputs_collector.add(res)
+    # spilled files are removed at next eval
+    self.collectors = [xs_collector, outputs_collector]
+    return xs_collector.result(), outputs_collector.result()
+
   def get_y_eager(self):
     model = self.model
     ys = []
@@ -336,40 +371,11 @@ class EvalCallback(Callback):
         outputs = {'pred': outputs}
       xs = outputs
     else:
-      if FLAGS.predict_on_batch:
-        tmp = {}
-        outputs = {}
-        eval_iter = iter(self.info_dataset)
-        for i in tqdm(range(self.steps), ascii=False, desc='eval_predict_on_batch', leave=FLAGS.eval_leave):
-          xs, _ = next(eval_iter)
-          # xs = tonumpy(xs)
-          res = model.predict_on_batch(xs)
-          if isinstance(res, (tuple, list)):
-            if len(res) == len(self.out_keys):
-              res = dict(zip(self.out_keys, res))
-            else:
-              res = dict(zip(['pred'] + self.out_keys, res))
-          elif not isinstance(res, dict): 
-            res = {'pred': res}
-          for key in xs:
-            if self.eval_keys and key not in self.eval_keys:
-              continue
-            xs[key] = xs[key].numpy()
-            if key not in tmp:
-              tmp[key] = [xs[key]]
-            else:
-              tmp[key].append(xs[key])
-          for key in res:
-            if key not in outputs:
-              outputs[key] = [res[key]]
-            else:
-              outputs[key].append(res[key])
-
-        for key in tmp:
-          tmp[key] = np.concatenate(tmp[key]) 
-        xs = tmp
-        for key in outputs:
-          outputs[key] = np.concatenate(outputs[key])
+      if FLAGS.predict_on_batch or (self.cached_xs is None and FLAGS.eval_single_pass):
+        # one pass over info_dataset, eval keys, y and predictions written in place to preallocated buffers
+        xs, outputs = self.predict_collect(eval_step)
+        if FLAGS.cache_valid_input and not self.collectors[0].owned_dir:
+          self.cached_xs = xs
       else:
         if isinstance(model, melt.Model) and not FLAGS.keras_loop:
           outputs = model.infer(self.dataset, steps=self.steps, dump_inputs=False, desc=f'eval_predict_{eval_step}', verbose=0, leave=FLAGS.eval_leave)
@@ -652,12 +658,20 @@ class EvalCallback(Callback):
       wandb_run = gezi.get('wandb_run')
       # is_last不需要再异步 另外就是v100 tione最后tf和multiprocess兼容有点问题
       if (not FLAGS.async_eval) or is_last:
+        if self.executor is not None:
+          # keep metrics.csv ordered by eval_step
+          self.executor.join()
         eval(eval_fn, y, y_, self.dataset, kwargs, self.logger, self.writer, self.eval_step, self.step, self.epoch, 
              self.num_valid_examples, self.is_last or is_last, pred_time, self.timer, pre, logs, wandb_run, silent)
       else:
-        p = multiprocessing.Process(target=eval, args=(eval_fn, y, y_, self.dataset, kwargs, self.logger, self.writer, self.eval_step, self.step, self.epoch, 
-                                                       self.num_valid_examples, self.is_last or is_last, pred_time, self.timer, pre, logs, wandb_run, silent))
-        p.start()
+        if self.executor is None:
+          self.executor = EvalExecutor(FLAGS.async_eval_max_pending)
+        # metrics computed in a worker process, reported here in eval_step order while training goes on
+        report_fn = functools.partial(report_metrics, logger=self.logger, eval_step=self.eval_step, step=self.step, epoch=self.epoch,
+                                      is_last=self.is_last or is_last, wandb_run=wandb_run, silent=silent)
+        self.executor.submit(self.eval_step, compute_metrics, 
+                             (eval_fn, y, y_, self.dataset, kwargs, self.num_valid_examples, pred_time, self.timer), 
+                             report_fn)
 
       if (self.write_valid_ or (FLAGS.write_valid_final and is_last)) and FLAGS.write_valid_after_eval:
         self.write_valid()
@@ -665,12 +679,9 @@ class EvalCallback(Callback):
       _try_eval_day() # 现在只是为了 fee/rank 做异步天级别验证 输入是24小时的所以valid.csv
       
 
-    if is_last and (p or q) and not (FLAGS.test_input and FLAGS.do_test):
-      logging.debug('Waiting async eval finish finally')
-      if p:
-        p.join()
-      if q:
-        q.join()
+    if is_last and q and not (FLAGS.test_input and FLAGS.do_test):
+      logging.debug('Waiting async write valid finish finally')
+      q.join()
 
     if FLAGS.ema_inject:
       ema.reset_old_weights() 
@@ -757,6 +768,9 @@ class EvalCallback(Callback):
     # if FLAGS.do_valid and FLAGS.metric_eval:
     #   if FLAGS.write_valid_final:
     #     self.write_valid()
+    if self.executor is not None:
+      logging.debug('Waiting async eval finish finally')
+      self.executor.join()
     return
 
   # Need init iter here for we also do validation using validation_steps=num_valid_examples when train epoch end
@@ -781,6 +795,8 @@ class EvalCallback(Callback):
 
   def on_batch_end(self, batch, logs={}):
     self.step += FLAGS.steps_per_execution
+    if self.executor is not None:
+      self.executor.poll()
     
     if FLAGS.do_valid and FLAGS.metric_eval:
       if FLAGS.metric_eval_interval_steps:
@@ -30,8 +30,9 @@ logging = gezi.logging
 import lele
 
 
-class HashFamily():
-    r"""Universal hash family as proposed by Carter and Wegman.
+class HashFamily(gezi.hash.HashFamily):
+    r"""Universal hash family as proposed by Carter and Wegman, see gezi.hash.HashFamily,
+    here mask_zero defaults to False.
 
     .. math::
 
@@ -45,58 +46,8 @@ class HashFamily():
         moduler (int,optional): Temporary hashing. Has to be a prime number.
     """
 
-    def __init__(self, bins, mask_zero=False, moduler=None):
-        if moduler and moduler <= bins:
-            raise ValueError("p (moduler) should be >> m (buckets)")
-
-        self.bins = bins
-        self.moduler = moduler if moduler else self._next_prime(np.random.randint(self.bins + 1, 2**32))
-        self.mask_zero = mask_zero
-
-        # do not allow same a and b, as it could mean shifted hashes
-        self.sampled_a = set()
-        self.sampled_b = set()
-
-    def _is_prime(self, x):
-        """Naive is prime test."""
-        for i in range(2, int(np.sqrt(x))):
-            if x % i == 0:
-                return False
-        return True
-
-    def _next_prime(self, n):
-        """Naively gets the next prime larger than n."""
-        while not self._is_prime(n):
-            n += 1
-
-        return n
-
-    def draw_hash(self, a=None, b=None):
-        """Draws a single hash function from the family."""
-        if a is None:
-            while a is None or a in self.sampled_a:
-                a = np.random.randint(1, self.moduler - 1)
-                assert len(self.sampled_a) < self.moduler - 2, "please give a bigger moduler"
-
-            self.sampled_a.add(a)
-        if b is None:
-            while b is None or b in self.sampled_b:
-                b = np.random.randint(0, self.moduler - 1)
-                assert len(self.sampled_b) < self.moduler - 1, "please give a bigger moduler"
-
-            self.sampled_b.add(b)
-
-        if self.mask_zero:
-            # The return doesn't set 0 to 0 because that's taken into account in the hash embedding
-            # if want to use for an integer then should uncomment second line !!!!!!!!!!!!!!!!!!!!!
-            return lambda x: ((a * x + b) % self.moduler) % (self.bins - 1) + 1
-            # return lambda x: 0 if x == 0 else ((a*x + b) % self.moduler) % (self.bins-1) + 1
-        else:
-            return lambda x: ((a * x + b) % self.moduler) % self.bins
-
-    def draw_hashes(self, n, **kwargs):
-        """Draws n hash function from the family."""
-        return [self.draw_hash() for i in range(n)]
+    def __init__(self, bins, mask_zero=False, moduler=None, seed=None):
+        super(HashFamily, self).__init__(bins, mask_zero, moduler, seed)
 
 class HashEmbedding(nn.Module):
     r"""Type of embedding which uses multiple hashes to approximate an Embedding layer using less parameters.
@@ -223,7 +174,8 @@ class HashEmbedding(nn.Module):
 
         mask_zero = padding_idx is not None
         hashFamily = HashFamily(self.num_buckets, mask_zero=mask_zero)
-        self.hashes = hashFamily.draw_hashes(self.num_hashes)
+        # all hashes in one vectorized call, (N, W) -> (N, W, num_hashes)
+        self.hash = hashFamily.draw_multi_hash(self.num_hashes)
 
         if aggregation_combiner == 'sum':
             self.aggregate = lambda x: torch.sum(x, dim=-1)
@@ -275,10 +227,10 @@ class HashEmbedding(nn.Module):
         idx_importance_weights = input % self.num_embeddings
         # THERE IS NO ADVANTAGE OF USING THE FOLLWOING LINE, I JUST HAVE TO COMPARE WITH THE ALGORITHM IN THE PAPER
         input = idx_importance_weights if self.oldAlgorithm else input
-        idx_shared_embeddings = torch.stack([h(input).masked_fill_(input == 0, 0) for h in self.hashes], dim=-1)
+        idx_shared_embeddings = self.hash(input).masked_fill_((input == 0).unsqueeze(-1), 0)
 
-        shared_embedding = torch.stack([self.shared_embeddings(idx_shared_embeddings[:, :, iHash])
-                                        for iHash in range(self.num_hashes)], dim=-1)
+        # (N, W, num_hashes, dim) -> (N, W, dim, num_hashes)
+        shared_embedding = self.shared_embeddings(idx_shared_embeddings).transpose(-1, -2)
         importance_weight = self.importance_weights(idx_importance_weights)
         importance_weight = importance_weight.unsqueeze(-2)
         word_embedding = self.aggregate(importance_weight * shared_embedding)
@@ -302,10 +254,16 @@ class SimpleEmbedding(nn.Module):
         super(SimpleEmbedding, self).__init__()
         self.num_embeddings = num_buckets
         self.num_buckets = num_buckets
+        self.embedding_dim = embedding_dim
         self.large_emb = large_emb
+        self.kwargs = kwargs
         if not large_emb:
           self.embedding = nn.Embedding(self.num_buckets + 1, embedding_dim, **kwargs)
 
+    def build(self):
+      if self.large_emb:
+        self.embedding = lele.layers.LargeEmbedding(self.num_buckets + 1, self.embedding_dim, **self.kwargs)
+
     def forward(self, x):
         mask = x.ne(0).type(x.dtype)
         x = x % self.num_buckets
@@ -1,10 +1,135 @@
+import os
 import numpy
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.autograd import Variable
+from concurrent.futures import ThreadPoolExecutor
+
+class ShardedCpuEmbedding(nn.Module):
+  """
+  CPU embedding table for tens of millions of ids, kept as numpy shards outside autograd parameters.
+  id i is row i // num_shards of shard i % num_shards, shards are gathered/updated by a thread pool
+  and can be memory-mapped .npy files (mmap_dir) so only hot rows stay in page cache.
+  Each forward looks up unique ids of the batch once (dedupe + inverse index),
+  the gradient of the unique rows is applied in backward by row wise sparse adagrad (or sgd),
+  so the table needs no optimizer and the training loop is unchanged.
+  """
+  def __init__(self, num_embeddings, embedding_dim, padding_idx=None, num_shards=None, 
+               optimizer='adagrad', lr=0.01, init_std=0.05, eps=1e-8, mmap_dir=None, 
+               num_threads=None, seed=None, **kwargs):
+    super(ShardedCpuEmbedding, self).__init__()
+    self.num_embeddings = num_embeddings
+    self.embedding_dim = embedding_dim
+    self.padding_idx = padding_idx
+    self.num_shards = num_shards or min(os.cpu_count() or 1, 16)
+    assert optimizer in ('adagrad', 'sgd'), optimizer
+    self.optimizer = optimizer
+    self.lr = lr
+    self.eps = eps
+    self.mmap_dir = mmap_dir
+    self.num_threads = num_threads or self.num_shards
+    self._pool = None
+
+    rng = np.random.default_rng(seed)
+    self.shards, self.accs = [], []
+    for i in range(self.num_shards):
+      rows = len(range(i, num_embeddings, self.num_shards))
+      self.shards.append(self._alloc(f'shard{i}', (rows, embedding_dim)))
+      # init by chunks, memmap tables may be larger than memory
+      for start in range(0, rows, 1 << 20):
+        end = min(start + (1 << 20), rows)
+        self.shards[i][start:end] = rng.normal(0., init_std, (end - start, embedding_dim)).astype(np.float32)
+      self.accs.append(self._alloc(f'acc{i}', (rows,)) if optimizer == 'adagrad' else None)
+      if self.accs[i] is not None:
+        self.accs[i][:] = 0.
+    if padding_idx is not None:
+      self.shards[padding_idx % self.num_shards][padding_idx // self.num_shards] = 0.
+
+  @property
+  def pool(self):
+    # lazy, so the module can still be pickled or deep copied
+    if self._pool is None:
+      self._pool = ThreadPoolExecutor(self.num_threads)
+    return self._pool
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['_pool'] = None
+    return state
+
+  def _alloc(self, name, shape):
+    if self.mmap_dir:
+      os.makedirs(self.mmap_dir, exist_ok=True)
+      return np.lib.format.open_memmap(f'{self.mmap_dir}/{name}.npy', mode='w+', dtype=np.float32, shape=shape)
+    return np.empty(shape, dtype=np.float32)
+
+  def _split(self, ids):
+    """positions and local rows of ids for each shard"""
+    shard_ids = ids % self.num_shards
+    order = np.argsort(shard_ids, kind='stable')
+    bounds = np.searchsorted(shard_ids[order], np.arange(self.num_shards + 1))
+    return [(order[bounds[i]:bounds[i + 1]], ids[order[bounds[i]:bounds[i + 1]]] // self.num_shards) \
+              for i in range(self.num_shards)]
+
+  def gather(self, ids):
+    out = np.empty((len(ids), self.embedding_dim), dtype=np.float32)
+    def _gather(i, pos, rows):
+      out[pos] = self.shards[i][rows]
+    list(self.pool.map(lambda x: _gather(x[0], *x[1]), enumerate(self._split(ids))))
+    return out
+
+  def apply_gradients(self, ids, grads):
+    """ids unique, grads [len(ids), dim]"""
+    if self.padding_idx is not None:
+      grads[ids == self.padding_idx] = 0.
+    def _update(i, pos, rows):
+      if not len(rows):
+        return
+      grad = grads[pos]
+      if self.optimizer == 'adagrad':
+        acc = self.accs[i]
+        acc[rows] += (grad * grad).mean(1)
+        grad = grad / (np.sqrt(acc[rows])[:, None] + self.eps)
+      self.shards[i][rows] -= self.lr * grad
+    list(self.pool.map(lambda x: _update(x[0], *x[1]), enumerate(self._split(ids))))
+
+  def forward(self, input):
+    ids = input.detach().reshape(-1).cpu().numpy().astype(np.int64)
+    uniq, inverse = np.unique(ids, return_inverse=True)
+    rows = torch.from_numpy(self.gather(uniq))
+    if self.training and torch.is_grad_enabled():
+      rows.requires_grad_(True)
+      rows.register_hook(lambda grad: self.apply_gradients(uniq, grad.numpy().copy()))
+    out = rows[torch.from_numpy(inverse.reshape(-1))]
+    return out.view(*input.shape, self.embedding_dim).to(input.device)
+
+  def _tables(self):
+    """(state_dict name, array) of weight shards and adagrad accumulators"""
+    tables = [(f'shard{i}', shard) for i, shard in enumerate(self.shards)]
+    tables += [(f'acc{i}', acc) for i, acc in enumerate(self.accs) if acc is not None]
+    return tables
+
+  def _save_to_state_dict(self, destination, prefix, keep_vars):
+    super(ShardedCpuEmbedding, self)._save_to_state_dict(destination, prefix, keep_vars)
+    for name, table in self._tables():
+      destination[f'{prefix}{name}'] = torch.from_numpy(np.asarray(table))
+
+  def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+    super(ShardedCpuEmbedding, self)._load_from_state_dict(state_dict, prefix, local_metadata, strict, 
+                                                           missing_keys, unexpected_keys, error_msgs)
+    for name, table in self._tables():
+      key = f'{prefix}{name}'
+      if key in state_dict:
+        table[:] = state_dict[key].cpu().numpy()
+        if key in unexpected_keys:
+          unexpected_keys.remove(key)
+      else:
+        missing_keys.append(key)
 
 class LargeEmbedding(nn.Module):
-  def __init__(self, num_embeddings, embedding_dim, num_devices=None, use_cuda=True, device_list=None, **kwargs):
+  def __init__(self, num_embeddings, embedding_dim, num_devices=None, use_cuda=True, device_list=None, 
+               cpu_kwargs={}, **kwargs):
     super(LargeEmbedding, self).__init__()
     self.num_embeddings = num_embeddings
     self.embedding_dim = embedding_dim
@@ -15,6 +140,12 @@ class LargeEmbedding(nn.Module):
     self.num_devices = num_devices
     self.use_cuda = use_cuda
 
+    if not use_cuda:
+      # cpu only host, sharded numpy table with sparse updates, see ShardedCpuEmbedding
+      self.cpu_embedding = ShardedCpuEmbedding(num_embeddings, embedding_dim, 
+                                               padding_idx=kwargs.get('padding_idx'), **cpu_kwargs)
+      return
+
 
     self.num_pages = num_devices
     reminder = num_embeddings % num_devices
@@ -46,6 +177,8 @@ class LargeEmbedding(nn.Module):
     self.embeddings = nn.ModuleList(embedding_list)
 
   def forward(self, indices_):
+    if not self.use_cuda:
+      return self.cpu_embedding(indices_)
     indices = indices_.view(1, -1)
     y = torch.FloatTensor(1, indices.size(-1), self.embedding_dim)
     index_seq = torch.arange(0, indices.size(-1)).long().view(1, -1)
@@ -56,8 +189,10 @@ class LargeEmbedding(nn.Module):
       index_seq = Variable(index_seq, requires_grad=False)
 
       page_offset = 0
+      # one division instead of ge/lt masks per page
+      pages = torch.div(indices, self.page_size, rounding_mode='floor')
       for i in range(self.num_pages):
-        mask_i = torch.min(torch.ge(indices, page_offset), torch.lt(indices, page_offset + self.page_size))
+        mask_i = pages.eq(i)
         #
         masked_idx_i = torch.masked_select(index_seq, mask_i)
         if masked_idx_i.dim() == 0:
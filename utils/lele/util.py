@@ -215,69 +215,70 @@ class PadCollate:
     def __call__(self, batch):
         return self.pad_collate(batch)
 
+def _pad_buffer(shape, dtype, pin_memory=False):
+  """Zeros torch buffer and its numpy view (shared memory), pinned if pin_memory for faster h2d copy"""
+  buf = torch.zeros(shape, dtype=dtype, pin_memory=pin_memory and torch.cuda.is_available())
+  return buf, buf.numpy()
+
+def pad_stack(vals, max_len=None, dim=0, dtype=None, pin_memory=False):
+  """
+  Stack list of numpy arrays (or lists) with different lengths on dim to one zero padded torch tensor,
+  only one allocation, each sample is copied once into its slice
+  """
+  vals = [x if isinstance(x, np.ndarray) else np.asarray(x) for x in vals]
+  if dtype is None:
+    dtype = np.result_type(*vals) if vals else np.int64
+  if max_len is None:
+    max_len = max(x.shape[dim] for x in vals)
+  shape = list(vals[0].shape)
+  shape[dim] = max_len
+  buf, arr = _pad_buffer([len(vals)] + shape, torch.from_numpy(np.zeros(0, dtype=dtype)).dtype, pin_memory)
+  prefix = (slice(None),) * dim
+  for i, x in enumerate(vals):
+    len_ = min(x.shape[dim], max_len)
+    arr[(i,) + prefix + (slice(0, len_),)] = x[prefix + (slice(0, len_),)]
+  return buf
+
 class NpDictPadCollate:
     """
     a variant of callate_fn that pads according to the longest sequence in
-    a batch of sequences
+    a batch of sequences, input is list of (dict of numpy array/list/scalar, y)
+    each padded key is written to one preallocated (optionally pinned) buffer
     """
 
-    def __init__(self, dim=0):
+    def __init__(self, dim=0, pin_memory=False, max_lens={}):
         """
         args:
             dim - the dimension to be padded (dimension of time in sequences)
+            max_lens - optional per key max length, longer sequences are truncated
         """
         self.dim = dim
+        self.pin_memory = pin_memory
+        self.max_lens = max_lens
         
     def pad_collate(self, batch):
-      ys = [None] * len(batch)
       input = {}
-      ys[0] = batch[0][1]
-      max_len = {}
-      
-      for key, val in batch[0][0].items():
-        if isinstance(val, np.ndarray):
-          val = torch.as_tensor(val)
-          max_len[key] = len(val)
-        else:
+      example = batch[0][0]
+      for key, val in example.items():
+        vals = [x[0][key] for x in batch]
+        if isinstance(val, (np.ndarray, list)):
           if isinstance(val, list):
-            if type(val[0]) == int:
-              val = torch.as_tensor(np.asarray(val))
-            else:
-              val = torch.as_tensor(np.asarray(val)).float()
-            max_len[key] = len(val)
-        input[key] = [val] * len(batch)
-       
-      for i in range(1, len(batch)):
-        ys[i] = batch[i][1]
-        for key, val in batch[i][0].items():
-          if isinstance(val, np.ndarray):
-            val = torch.as_tensor(val)
-            if len(val) > max_len[key]:
-              max_len[key] = len(val)
+            vals = [np.asarray(x) for x in vals]
+            # int list keep int64, others as float32
+            dtype = np.int64 if all(x.dtype.kind in 'iub' or not x.size for x in vals) else np.float32
           else:
-            if isinstance(val, list):
-              if type(val[0]) == int:
-                val = torch.as_tensor(np.asarray(val))
-              else:
-                val = torch.as_tensor(np.asarray(val)).float()
-              if len(val) > max_len[key]:
-                max_len[key] = len(val)
-          input[key][i] = val
-          
-      for key, val_list in input.items():
-        if key in max_len:
-          for i in range(len(val_list)):
-            val_list[i] = pad_tensor(val_list[i], pad=max_len[key], dim=self.dim)
-            #print(i, val_list[i].shape, max_len[key])
-    
-          input[key] = torch.stack(val_list, dim=0)
+            dtype = np.result_type(*vals)
+          max_len = max(x.shape[self.dim] for x in vals)
+          if key in self.max_lens:
+            max_len = min(max_len, self.max_lens[key])
+          input[key] = pad_stack(vals, max_len, self.dim, dtype, self.pin_memory)
         else:
           #... TODO why np.arry.dtype not dp.str_ but <U3 <U4 ?
-          input[key] = np.asarray(input[key])
+          input[key] = np.asarray(vals)
           if type(input[key][0]) != np.str_:
             input[key] = torch.as_tensor(input[key])
             
-      ys = torch.as_tensor(np.asarray(ys))
+      ys = torch.as_tensor(np.asarray([x[1] for x in batch]))
       return input, ys
         
     def __call__(self, batch):
@@ -286,56 +287,129 @@ class NpDictPadCollate:
 class DictPadCollate:
     """
     a variant of callate_fn that pads according to the longest sequence in
-    a batch of sequences
+    a batch of sequences, input is list of (dict of tensor, y tensor)
     """
 
-    def __init__(self, dim=0):
+    def __init__(self, dim=0, pin_memory=False, max_lens={}):
         """
         args:
             dim - the dimension to be padded (dimension of time in sequences)
         """
         self.dim = dim
+        self.pin_memory = pin_memory
+        self.max_lens = max_lens
         
     def pad_collate(self, batch):
-      ys = [None] * len(batch)
       input = {}
-      ys[0] = batch[0][1]
-      max_len = {}
-      
       for key, val in batch[0][0].items():
+        vals = [x[0][key] for x in batch]
         #if not isinstance(val, str):
         if isinstance(val, torch.Tensor):
-          if not len(val.size()):
-            val = val.expand(1)
-          max_len[key] = val.size(self.dim)
-        input[key] = [val] * len(batch)
-       
-      for i in range(1, len(batch)):
-        ys[i] = batch[i][1]
-        for key, val in batch[i][0].items():
-          #if not isinstance(val, str):
-          if isinstance(val, torch.Tensor):
-            if not len(val.size()):
-              val = val.expand(1)
-            if len(val) > max_len[key]:
-              max_len[key] = val.size(self.dim)
-          input[key][i] = val
-          
-      for key, val_list in input.items():
-        if key in max_len:
-          for i in range(len(val_list)):
-            val_list[i] = pad_tensor(val_list[i], pad=max_len[key], dim=self.dim)  
-          input[key] = torch.stack(val_list, dim=0)
+          vals = [x.expand(1) if not len(x.size()) else x for x in vals]
+          max_len = max(x.size(self.dim) for x in vals)
+          if key in self.max_lens:
+            max_len = min(max_len, self.max_lens[key])
+          shape = list(vals[0].size())
+          shape[self.dim] = max_len
+          buf = torch.zeros([len(vals)] + shape, dtype=vals[0].dtype, 
+                            pin_memory=self.pin_memory and torch.cuda.is_available())
+          for i, x in enumerate(vals):
+            x = x.narrow(self.dim, 0, min(x.size(self.dim), max_len))
+            buf[i].narrow(self.dim, 0, x.size(self.dim)).copy_(x)
+          input[key] = buf
         else:
-          input[key] = np.array(input[key])
+          input[key] = np.array(vals)
 
       #list of tensor ->
-      ys = torch.stack(ys, dim=0)
+      ys = torch.stack([x[1] for x in batch], dim=0)
       return input, ys
         
     def __call__(self, batch):
       return self.pad_collate(batch)
 
+class BucketBatchSampler(torch.utils.data.Sampler):
+  """
+  Batch sampler grouping examples of similar length to cut padding,
+  indexes are shuffled, sorted by length inside each bucket of bucket_size examples, 
+  split to batches and then batches are shuffled
+  use as DataLoader(dataset, batch_sampler=BucketBatchSampler(lengths, batch_size), collate_fn=NpDictPadCollate())
+  """
+  def __init__(self, lengths, batch_size, bucket_size=None, shuffle=True, drop_last=False, seed=None):
+    self.lengths = np.asarray(lengths)
+    self.batch_size = batch_size
+    self.bucket_size = bucket_size or batch_size * 100
+    self.shuffle = shuffle
+    self.drop_last = drop_last
+    self.rng = np.random.default_rng(seed)
+
+  def __iter__(self):
+    n = len(self.lengths)
+    indexes = self.rng.permutation(n) if self.shuffle else np.arange(n)
+    batches = []
+    for start in range(0, n, self.bucket_size):
+      bucket = indexes[start:start + self.bucket_size]
+      bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+      batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+    if self.drop_last:
+      batches = [x for x in batches if len(x) == self.batch_size]
+    if self.shuffle:
+      batches = [batches[i] for i in self.rng.permutation(len(batches))]
+    for batch in batches:
+      yield batch.tolist()
+
+  def __len__(self):
+    if self.drop_last:
+      return sum((min(self.bucket_size, len(self.lengths) - start)) // self.batch_size 
+                 for start in range(0, len(self.lengths), self.bucket_size))
+    return sum(-(-min(self.bucket_size, len(self.lengths) - start) // self.batch_size) 
+               for start in range(0, len(self.lengths), self.bucket_size))
+
+class BlockShuffleSampler(torch.utils.data.Sampler):
+  """
+  Shuffle by contiguous blocks of block_size rows: block order is shuffled and rows inside each block are shuffled,
+  so each batch reads from a few blocks of the (memory mapped) file, good for random access text datasets.
+  call set_epoch(epoch) for a different order each epoch, all ranks use the same order (same seed) and
+  rank takes its contiguous 1/num_replicas part, padded by wrapping so every rank has the same length
+  (as DistributedSampler, num_replicas and rank default to torch.distributed if initialized).
+  """
+  def __init__(self, num_examples, block_size=10000, shuffle=True, seed=0, num_replicas=None, rank=None):
+    if num_replicas is None:
+      num_replicas = torch.distributed.get_world_size() if torch.distributed.is_available() and torch.distributed.is_initialized() else 1
+    if rank is None:
+      rank = torch.distributed.get_rank() if num_replicas > 1 else 0
+    assert 0 <= rank < num_replicas, (rank, num_replicas)
+    self.num_examples = num_examples
+    self.block_size = block_size
+    self.shuffle = shuffle
+    self.seed = seed
+    self.num_replicas = num_replicas
+    self.rank = rank
+    self.num_samples = -(-num_examples // num_replicas)
+    self.epoch = 0
+
+  def set_epoch(self, epoch):
+    self.epoch = epoch
+
+  def __iter__(self):
+    n, block_size = self.num_examples, self.block_size
+    if not self.shuffle:
+      indexes = np.arange(n)
+    else:
+      rng = np.random.default_rng(self.seed + self.epoch)
+      num_blocks = -(-n // block_size)
+      indexes = [np.zeros(0, dtype=np.int64)]
+      for block in rng.permutation(num_blocks):
+        start = block * block_size
+        indexes.append(start + rng.permutation(min(block_size, n - start)))
+      indexes = np.concatenate(indexes)
+    if self.num_replicas > 1 and n:
+      total = self.num_samples * self.num_replicas
+      indexes = np.resize(indexes, total)[self.rank * self.num_samples:(self.rank + 1) * self.num_samples]
+    return iter(indexes.tolist())
+
+  def __len__(self):
+    return self.num_samples
+
 # https://discuss.pytorch.org/t/how-do-i-check-the-number-of-parameters-of-a-model/4325/9
 def count_parameters(model):
   return sum(p.numel() for p in model.parameters() if p.requires_grad)
@@ -20,11 +20,12 @@ import traceback
 import sys
 # print('tensorflow_version:', tf.__version__, file=sys.stderr) 
 
-try:
-  import torch
-  # print('torch_version:', torch.__version__, file=sys.stderr) 
-except Exception:
-	print("torch not found", file=sys.stderr)
+# rarely used submodules (and torch) load on first access, python -m gezi.lazy melt to profile
+from gezi.lazy import LazyModules
+_lazy = LazyModules(globals())
+__getattr__, __dir__ = _lazy.getattr, _lazy.dir
+
+_lazy.add('torch', attr='torch')
 
 from melt.training import training as train 
 import melt.training 
@@ -42,43 +43,39 @@ from melt.tfrecords.dataset import Dataset
 
 from melt.inference import *
 
-import melt.layers
-from melt.layers.layers import activation_layer as activation
+_lazy.add('melt.layers')
+_lazy.add('melt.layers.layers', {'activation': 'activation_layer'})
 
 # import melt.slim2
 
-import melt.flow
+_lazy.add('melt.flow')
 # from melt.flow import projector_config
 
 from melt.metrics import * # TODO
 
-try:
-  import melt.apps
-  from melt.apps.init import *
-  from melt.apps.train import *
-except Exception:
-	print(traceback.format_exc(), file=sys.stderr)
-	pass
+# flags of model, batch_size .. are defined on import, init and train load on first use
+import melt.apps.config
+_lazy.add('melt.apps.init', star=True)
+_lazy.add('melt.apps.train', star=True)
 
-import melt.rnn 
+_lazy.add('melt.rnn')
 # import melt.cnn 
-import melt.encoder 
+_lazy.add('melt.encoder')
 
-import melt.seq2seq 
-import melt.image  
-from melt.image import *
+_lazy.add('melt.seq2seq')
+_lazy.add('melt.image', star=True)
 
-import melt.losses  
+_lazy.add('melt.losses')
 
-import melt.eager 
+_lazy.add('melt.eager')
 
 import melt.distributed 
 from melt.distributed import get_strategy
 
-import melt.deepctr
-import melt.global_objectives
+_lazy.add('melt.deepctr')
+_lazy.add('melt.global_objectives')
 
-import melt.models
-import melt.pretrain
+_lazy.add('melt.models')
+_lazy.add('melt.pretrain')
 
 # import melt.torch 
@@ -11,9 +11,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import melt.apps.image_processing 
+# config only defines the training flags, eager so absl parses them in app.run before main
 import melt.apps.config
-from melt.apps.init import *
+
+from gezi.lazy import LazyModules
+_lazy = LazyModules(globals())
+__getattr__, __dir__ = _lazy.getattr, _lazy.dir
+
+_lazy.add('melt.apps.image_processing')
+_lazy.add('melt.apps.init', star=True)
 
 #import melt.apps.train
-from melt.apps.train import *
+_lazy.add('melt.apps.train', star=True)
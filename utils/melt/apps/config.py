@@ -509,6 +509,8 @@ flags.DEFINE_alias('kvalid', 'keras_validation')
 flags.DEFINE_alias('keval', 'keras_validation')
 flags.DEFINE_boolean('keras_loop', False, '')
 flags.DEFINE_boolean('predict_on_batch', False, '')
+flags.DEFINE_boolean('eval_single_pass', False, 'predict_on_batch and collect eval keys in one pass of info_dataset (opt in), default model.infer/predict then loop info_dataset again')
+flags.DEFINE_float('eval_mmap_gb', None, 'eval predictions and inputs larger than this spill to memory-mapped files under model_dir')
 flags.DEFINE_boolean('cache_info_dataset', False, '')
 flags.DEFINE_integer('print_depth', 1, '')
 flags.DEFINE_boolean('keras_functional_model', False, '')
@@ -667,6 +669,7 @@ flags.DEFINE_alias('asv', 'async_valid')
 flags.DEFINE_bool('async_eval', False, 'only cpu evaluation without prediction(already done and write to csv), now only work using keras')
 flags.DEFINE_bool('is_last_eval', None, '')
 flags.DEFINE_alias('ase', 'async_eval')
+flags.DEFINE_integer('async_eval_max_pending', 2, 'max evals computing in background, eval blocks on the oldest one if full')
 flags.DEFINE_bool('cpu_valid', False, '')
 flags.DEFINE_integer('num_valid_gpus', 1, '')
 
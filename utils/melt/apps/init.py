@@ -1468,9 +1468,7 @@ def init(graph=None):
     except Exception as e:
       logging.warning(e)
 
-  # TODO wandb 当前 不支持异步
-  if FLAGS.wandb:
-    FLAGS.async_eval = False
+  # async eval metrics are reported to wandb from the main process, see husky.callbacks.eval_executor
 
   if FLAGS.gcs_dest:
     logging.info('gcs_dest:', FLAGS.gcs_dest)
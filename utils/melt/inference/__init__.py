@@ -14,4 +14,4 @@ from __future__ import print_function
 import tensorflow as tf
 
 from melt.inference.predictor_base import * 
-from melt.inference.predictor import Predictor, SimplePredictor, SimPredictor, RerankSimPredictor, WordsImportancePredictor, TextPredictor, EnsembleTextPredictor
+from melt.inference.predictor import Predictor, BatchPredictor, SimplePredictor, SimPredictor, RerankSimPredictor, WordsImportancePredictor, TextPredictor, EnsembleTextPredictor
@@ -29,6 +29,11 @@ import melt
 
 import operator 
 import traceback
+import time
+import queue
+import threading
+import asyncio
+from concurrent.futures import Future
 
 def get_model_dir_and_path(model_dir, model_name=None):
   model_path = model_dir
@@ -94,6 +99,8 @@ class Predictor(object):
     if random_seed is not None:
       tf.compat.v1.set_random_seed(random_seed)
 
+    # (key, index) -> resolved tensor
+    self.tensors = {}
     self.frozen_graph_name = frozen_graph_name
     if frozen_graph is None:
       if model_dir is not None and os.path.isdir(model_dir):
@@ -106,17 +113,34 @@ class Predictor(object):
     else:
       self.load_graph(frozen_graph, frozen_graph_name)
 
+  def get_tensor(self, key, index=-1):
+    """Resolved tensor of key (collection name or tensor name), cached, raise KeyError if not found"""
+    tensor = self._get_tensor(key, index)
+    if tensor is None:
+      raise KeyError(key)
+    return tensor
+
+  def _get_tensor(self, key, index=-1):
+    if not isinstance(key, str):
+      return key
+    if (key, index) not in self.tensors:
+      tensor = get_tensor_from_key(key, self.graph, index)
+      if tensor is None:
+        return None
+      self.tensors[(key, index)] = tensor
+    return self.tensors[(key, index)]
+
   #by default will use last one
   def inference(self, key, feed_dict=None, index=-1, return_dict=False, **kwargs):
     if not isinstance(key, (list, tuple)):
-      return self.sess.run(get_tensor_from_key(key, self.graph, index), feed_dict=feed_dict)
+      return self.sess.run(self._get_tensor(key, index), feed_dict=feed_dict)
     else:
       keys = key 
       if not isinstance(index, (list, tuple)):
         indexes = [index] * len(keys)
       else:
         indexes = index 
-      tensors = [get_tensor_from_key(key, self.graph, index) for key,index in zip(keys, indexes)]
+      tensors = [self._get_tensor(key, index) for key,index in zip(keys, indexes)]
       if not return_dict:
         return self.sess.run(tensors, feed_dict=feed_dict, **kwargs)
       else:
@@ -140,6 +164,8 @@ class Predictor(object):
     """
     model_dir, model_path = get_model_dir_and_path(model_dir, model_name)
     self.model_path = model_path
+    # tensors looked up in the previous graph
+    self.tensors = {}
 
     frozen_graph_file = '%s.pb' % model_path
     if os.path.exists(frozen_graph_file):
@@ -187,6 +213,7 @@ class Predictor(object):
     # unserialized graph_def
     if not frozen_map_file:
       frozen_map_file = frozen_graph_file.replace('.pb', '.map')
+    self.tensors = {}
     timer = gezi.Timer('load frozen graph from %s with mapfile %s' % (frozen_graph_file, frozen_map_file))
     with tf.io.gfile.GFile(frozen_graph_file, "rb") as f:
       graph_def = tf.compat.v1.GraphDef()
@@ -224,6 +251,156 @@ class Predictor(object):
     timer.print_elapsed()
     return graph
 
+def _bucket(n, buckets):
+  for size in buckets:
+    if size >= n:
+      return size
+  return n
+
+
+class _Request(object):
+  def __init__(self, inputs, num_rows):
+    self.inputs = inputs
+    self.num_rows = num_rows
+    self.future = Future()
+
+
+class BatchPredictor(object):
+  """
+  Micro-batching over Predictor for many concurrent callers (threads or asyncio).
+  Requests (dict feed -> [n, ...] arrays) are queued and merged by one worker thread into a single
+  sess.run of up to max_batch_size rows, waiting at most max_wait seconds for more requests.
+  Rows are padded to batch_buckets sizes (powers of 2 by default), variable length dim 1 is padded 
+  with pad_value to the batch max (rounded up to length_buckets if set), so only a few shapes are run.
+  Batch-major outputs are sliced back to each caller.
+  """
+  def __init__(self, predictor, keys, feeds, max_batch_size=512, max_wait=0.005,
+               batch_buckets=None, length_buckets=None, pad_value=0, index=-1):
+    self.predictor = predictor
+    self.single = not isinstance(keys, (list, tuple))
+    keys = [keys] if self.single else keys
+    self.fetches = [predictor.get_tensor(key, index) for key in keys]
+    self.feeds = dict((feed, predictor.get_tensor(feed, index)) for feed in feeds)
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    if batch_buckets is None:
+      batch_buckets = [2 ** i for i in range(int(math.log2(max_batch_size)) + 1)] + [max_batch_size]
+    self.batch_buckets = sorted(set(batch_buckets))
+    self.length_buckets = sorted(length_buckets) if length_buckets else None
+    self.pad_value = pad_value
+    self.queue = queue.Queue()
+    # submit and close under the lock, so no request is queued after the stop marker
+    self.lock = threading.Lock()
+    self.closed = False
+    self.thread = threading.Thread(target=self._loop, daemon=True)
+    self.thread.start()
+
+  def submit(self, inputs):
+    """inputs: dict feed name -> [n, ...], returns concurrent.futures.Future"""
+    # a bad request is rejected here, not in the merged batch with others
+    missing = [feed for feed in self.feeds if feed not in inputs]
+    if missing:
+      raise ValueError(f'missing feeds {missing}')
+    num_rows = set(len(inputs[feed]) for feed in self.feeds)
+    if len(num_rows) > 1:
+      raise ValueError(f'feeds with different number of rows {num_rows}')
+    req = _Request(inputs, num_rows.pop() if num_rows else 0)
+    with self.lock:
+      if self.closed:
+        raise RuntimeError('submit after BatchPredictor closed')
+      self.queue.put(req)
+    return req.future
+
+  def predict(self, inputs, timeout=None):
+    return self.submit(inputs).result(timeout)
+
+  async def apredict(self, inputs):
+    return await asyncio.wrap_future(self.submit(inputs))
+
+  def close(self):
+    with self.lock:
+      if not self.closed:
+        self.closed = True
+        self.queue.put(None)
+    self.thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _loop(self):
+    pending = None
+    stop = False
+    while not stop:
+      req = pending or self.queue.get()
+      pending = None
+      if req is None:
+        break
+      batch = [req]
+      num_rows = req.num_rows
+      deadline = time.monotonic() + self.max_wait
+      while num_rows < self.max_batch_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+          break
+        try:
+          req = self.queue.get(timeout=timeout)
+        except queue.Empty:
+          break
+        if req is None:
+          stop = True
+          break
+        if num_rows + req.num_rows > self.max_batch_size:
+          pending = req
+          break
+        batch.append(req)
+        num_rows += req.num_rows
+      self._run(batch, num_rows)
+    # requests left when closing
+    while pending is not None or not self.queue.empty():
+      req = pending or self.queue.get()
+      pending = None
+      if req is not None:
+        self._run([req], req.num_rows)
+
+  def _stack(self, arrays, num_rows):
+    arrays = [np.asarray(x) for x in arrays]
+    shape = tuple(np.max([x.shape[1:] for x in arrays], 0)) if arrays[0].ndim > 1 else ()
+    if shape and self.length_buckets:
+      shape = (_bucket(shape[0], self.length_buckets),) + shape[1:]
+    dtype = np.result_type(*arrays)
+    res = np.full((_bucket(num_rows, self.batch_buckets),) + shape, 
+                  self.pad_value if dtype.kind in 'biuf' else np.zeros((), dtype).item(), dtype=dtype)
+    start = 0
+    for x in arrays:
+      res[(slice(start, start + len(x)),) + tuple(slice(0, dim) for dim in x.shape[1:])] = x
+      start += len(x)
+    return res
+
+  def _run(self, batch, num_rows):
+    try:
+      feed_dict = dict((tensor, self._stack([req.inputs[feed] for req in batch], num_rows)) \
+                        for feed, tensor in self.feeds.items())
+      batch_size = len(next(iter(feed_dict.values())))
+      outputs = self.predictor.sess.run(self.fetches, feed_dict=feed_dict)
+    except Exception as e:
+      if len(batch) > 1:
+        # each on its own, so only the failing requests get the error
+        for req in batch:
+          self._run([req], req.num_rows)
+      else:
+        batch[0].future.set_exception(e)
+      return
+    start = 0
+    for req in batch:
+      end = start + req.num_rows
+      results = [x[start:end] if np.ndim(x) and len(x) == batch_size else x for x in outputs]
+      req.future.set_result(results[0] if self.single else results)
+      start = end
+
+
 class SimplePredictor(object):
   def __init__(self, 
               model_dir, 
@@ -357,41 +534,20 @@ class SimPredictor(object):
     rtexts [batch_size, num_texts,..]
     TODO support split batch, so can avoid gpu mem issue
     """
-    stacked_ltexts = []
-    stacked_rtexts = []
-    boundaries = []
-    for ltext, rtexts in zip(ltexts, rtexts_list):
-      stacked_ltexts += [ltext] * len(rtexts)
-      stacked_rtexts += list(rtexts)
-      boundaries.append(len(rtexts))
-
-    stacked_ltexts = np.array(stacked_ltexts)
-    stacked_rtexts = np.array(stacked_rtexts)
+    boundaries = np.asarray([len(rtexts) for rtexts in rtexts_list])
+    stacked_ltexts = np.repeat(np.asarray(ltexts), boundaries, axis=0)
+    stacked_rtexts = np.concatenate([np.asarray(rtexts) for rtexts in rtexts_list], 0)
 
     if len(stacked_ltexts) <= buffer_size:
       #[n, 1] <- [n, 1] [n, 1]
       score = self.predict(stacked_ltexts, stacked_rtexts)
     else:
-      start = 0
-      score_list = []
-      while start < len(stacked_ltexts):
-        end = start + buffer_size
-        score = self.predict(stacked_ltexts[start: end], stacked_rtexts[start: end])
-        score_list += list(score)
-        start += buffer_size
-      score = np.array(score_list)
+      score = np.concatenate([self.predict(stacked_ltexts[start: start + buffer_size], stacked_rtexts[start: start + buffer_size]) \
+                                for start in range(0, len(stacked_ltexts), buffer_size)], 0)
     score = np.squeeze(score)
 
-    results_list = []
-    index = 0
-    for num_rtexts in boundaries:
-      results = []
-      for i in range(num_rtexts):
-        results.append(score[index])
-        index += 1
-      results_list.append(np.array(results))
-    results_list = np.array(results_list)
-    return results_list
+    results_list = np.split(score, np.cumsum(boundaries)[:-1])
+    return np.array(results_list) if len(set(boundaries)) <= 1 else np.array(results_list, dtype=object)
 
   def top_k(self, ltext, rtext, k=1, key=None):
     feed_dict = {
@@ -8,6 +8,9 @@ import melt.tfrecords.shuffle_then_decode
 import melt.tfrecords.dataset_decode 
 #import melt.tfrecords.dataset_decode as decode
 
+import melt.tfrecords.columnar
 import melt.tfrecords.write
+import melt.tfrecords.gen_records
+from melt.tfrecords.gen_records import gen_records, SharedTables
 from melt.tfrecords.write import *
 from melt.tfrecords.dataset import Dataset
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   columnar.py
+#        \author   chenghuige
+#          \date   2021-10-12 10:21:46.629992
+#   \Description   Encode columns of numpy arrays to serialized tf.train.Example
+#                  in bulk, no per row type sniffing or proto objects
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# tf.train.Feature oneof field tags, BytesList=1 FloatList=2 Int64List=3
+INT64 = 'int64'
+FLOAT = 'float'
+BYTES = 'bytes'
+_FEATURE_TAGS = {BYTES: 0x0a, FLOAT: 0x12, INT64: 0x1a}
+
+class Ragged(object):
+  """
+  Variable length rows, row i is data[offsets[i]:offsets[i + 1]]
+  """
+  def __init__(self, data, offsets):
+    self.data = data
+    self.offsets = np.asarray(offsets, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  @property
+  def lengths(self):
+    return np.diff(self.offsets)
+
+  @staticmethod
+  def from_lengths(data, lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return Ragged(data, offsets)
+
+  @staticmethod
+  def from_rows(rows, dtype=None):
+    lengths = [len(x) if _is_seq(x) else 1 for x in rows]
+    # skip empty rows so that they do not promote int rows to float
+    data = [np.asarray(x) if _is_seq(x) else np.asarray([x]) for x in rows if not _is_seq(x) or len(x)]
+    data = np.concatenate(data) if data else np.zeros(0, dtype=np.int64)
+    if dtype is not None:
+      data = data.astype(dtype)
+    return Ragged.from_lengths(data, lengths)
+
+  def __getitem__(self, i):
+    return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+
+def _is_seq(x):
+  return isinstance(x, (list, tuple, np.ndarray))
+
+
+def _scatter(src, dst, dst_starts):
+  """Copy row i of src to dst.data[dst_starts[i]:]"""
+  if len(src.data):
+    row_ids = np.repeat(np.arange(len(src)), src.lengths)
+    pos = np.arange(len(src.data)) - src.offsets[row_ids] + dst_starts[row_ids]
+    dst.data[pos] = src.data
+
+
+def _concat(pieces):
+  """Per row concatenation of several Ragged uint8 byte columns"""
+  num_rows = len(pieces[0])
+  lengths = np.stack([x.lengths for x in pieces], 1)
+  row_lengths = lengths.sum(1)
+  out = Ragged.from_lengths(np.empty(row_lengths.sum(), dtype=np.uint8), row_lengths)
+  starts = out.offsets[:-1].copy()
+  for i, piece in enumerate(pieces):
+    _scatter(piece, out, starts)
+    starts += lengths[:, i]
+  assert len(out) == num_rows
+  return out
+
+
+def _varint(values):
+  """Protobuf varint bytes of each value, int64 as two's complement"""
+  values = np.asarray(values)
+  if values.dtype != np.uint64:
+    values = values.astype(np.int64).view(np.uint64)
+  shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+  groups = (values[:, None] >> shifts[None, :])
+  nbytes = 1 + (groups[:, 1:] != 0).sum(1)
+  groups = (groups & np.uint64(0x7f)).astype(np.uint8)
+  cols = np.arange(10)[None, :]
+  groups[cols < (nbytes[:, None] - 1)] |= 0x80
+  return Ragged.from_lengths(groups[cols < nbytes[:, None]], nbytes)
+
+
+def _const(value, num_rows, mask=None):
+  value = np.frombuffer(value, dtype=np.uint8)
+  if mask is None:
+    lengths = np.full(num_rows, len(value), dtype=np.int64)
+    return Ragged.from_lengths(np.tile(value, num_rows), lengths)
+  lengths = np.where(mask, len(value), 0)
+  return Ragged.from_lengths(np.tile(value, mask.sum()), lengths)
+
+
+def _field(tag, payload, skip_empty=False):
+  """tag + varint(len) + payload, the wire format of a length delimited field"""
+  lengths = payload.lengths
+  mask = lengths > 0 if skip_empty else None
+  header = _varint(lengths)
+  if mask is not None:
+    header = Ragged.from_lengths(header.data[np.repeat(mask, header.lengths)],
+                                 np.where(mask, header.lengths, 0))
+  return _concat([_const(bytes([tag]), len(payload), mask), header, payload])
+
+
+def _payload(values, dtype):
+  """Encoded value list of each row, the body of Int64List/FloatList/BytesList"""
+  if dtype == INT64:
+    data = _varint(values.data)
+    payload = Ragged(data.data, data.offsets[values.offsets])
+    # packed repeated field
+    return _field(0x0a, payload, skip_empty=True)
+  elif dtype == FLOAT:
+    data = np.ascontiguousarray(values.data, dtype='<f4').view(np.uint8)
+    payload = Ragged(data, values.offsets * 4)
+    return _field(0x0a, payload, skip_empty=True)
+  else:
+    strs = [x if isinstance(x, bytes) else str(x).encode('utf-8') for x in values.data]
+    data = np.frombuffer(b''.join(strs), dtype=np.uint8)
+    items = _field(0x0a, Ragged.from_lengths(data, [len(x) for x in strs]))
+    return Ragged(items.data, items.offsets[values.offsets])
+
+
+def infer_dtype(values):
+  """Column level (not per value) dtype inference, same rules as melt.gen_feature"""
+  values = np.asarray(values)
+  kind = values.dtype.kind
+  if kind in 'iub':
+    return INT64
+  elif kind == 'O' and len(values) and all(isinstance(x, (bool, np.bool_)) for x in values):
+    # python bools (object or nullable boolean columns) are ints for gen_feature
+    return INT64
+  elif kind == 'f':
+    return FLOAT
+  return BYTES
+
+
+def to_ragged(column, dtype=None, default_value=0):
+  """
+  column can be
+    1d array: one value per row
+    2d array: fixed length rows
+    Ragged or (values, lengths) tuple
+    list of lists or object array: variable length rows
+  empty rows are filled with [default_value] as melt.gen_features does
+  """
+  if isinstance(column, Ragged):
+    ragged = column
+  elif isinstance(column, tuple) and len(column) == 2:
+    ragged = Ragged.from_lengths(np.asarray(column[0]), column[1])
+  else:
+    arr = column if isinstance(column, np.ndarray) else None
+    if arr is None or arr.dtype == object:
+      try:
+        arr = np.asarray(column)
+      except ValueError:
+        arr = None
+    if arr is not None and arr.size == 0 and not isinstance(column, np.ndarray):
+      # [[], []] would be float, leave it to from_rows
+      arr = None
+    if arr is not None and arr.dtype != object and arr.ndim <= 2 and not len(arr):
+      # empty shard or slice
+      ragged = Ragged(arr.reshape(-1), [0])
+    elif arr is not None and arr.dtype != object and arr.ndim <= 2:
+      arr = arr.reshape(len(arr), -1)
+      ragged = Ragged.from_lengths(arr.reshape(-1), np.full(len(arr), arr.shape[1]))
+    elif arr is not None and arr.ndim == 1 and not any(_is_seq(x) for x in arr):
+      # object array of str/bytes scalars
+      ragged = Ragged.from_lengths(arr, np.ones(len(arr), dtype=np.int64))
+    else:
+      ragged = Ragged.from_rows(list(column))
+
+  if dtype is None:
+    dtype = infer_dtype(ragged.data)
+  if dtype in (INT64, FLOAT):
+    ragged = Ragged(ragged.data.astype(np.int64 if dtype == INT64 else np.float32, copy=False),
+                    ragged.offsets)
+  lengths = ragged.lengths
+  if default_value is not None and dtype != BYTES and (lengths == 0).any():
+    lengths = np.maximum(lengths, 1)
+    out = Ragged.from_lengths(np.full(lengths.sum(), default_value, dtype=ragged.data.dtype), lengths)
+    _scatter(ragged, out, out.offsets[:-1])
+    ragged = out
+  return ragged, dtype
+
+
+def encode_examples(columns, schema=None, default_value=0):
+  """
+  columns: dict of name -> column, see to_ragged, all columns have the same number of rows
+  schema: dict of name -> 'int64' | 'float' | 'bytes', missing names are inferred per column
+  Returns Ragged of serialized tf.train.Example bytes, rows[i].tobytes() is the ith record,
+    parses the same as tf.train.Example(features=tf.train.Features(feature=melt.gen_features(row)))
+  """
+  schema = schema or {}
+  num_rows = None
+  entries = []
+  for name, column in columns.items():
+    values, dtype = to_ragged(column, schema.get(name), default_value)
+    if num_rows is None:
+      num_rows = len(values)
+    assert len(values) == num_rows, f'{name} {len(values)} {num_rows}'
+    feature = _field(_FEATURE_TAGS[dtype], _payload(values, dtype))
+    key = name.encode('utf-8')
+    key = b'\x0a' + bytes(np.asarray(_varint([len(key)]).data)) + key
+    # map<string, Feature> entry: key=1 value=2
+    entry = _concat([_const(key, num_rows), _field(0x12, feature)])
+    entries.append(_field(0x0a, entry))
+
+  if not entries:
+    return Ragged(np.zeros(0, dtype=np.uint8), [0])
+  # Example.features=1
+  return _field(0x0a, _concat(entries))
+
+
+def serialize_examples(columns, schema=None, default_value=0):
+  examples = encode_examples(columns, schema, default_value)
+  data = examples.data.tobytes()
+  offsets = examples.offsets.tolist()
+  return [data[offsets[i]:offsets[i + 1]] for i in range(len(examples))]
+
+
+def df_to_columns(df, keys=None):
+  keys = keys or list(df.columns)
+  return {key: df[key].values for key in keys}
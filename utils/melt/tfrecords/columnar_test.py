@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   columnar_test.py
+#        \author   chenghuige
+#          \date   2021-10-20 14:21:08.551902
+#   \Description   python -m pytest melt/tfrecords/columnar_test.py
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import melt
+from melt.tfrecords import columnar
+
+def _parse(serialized):
+  return tf.train.Example.FromString(serialized)
+
+def _expected(row):
+  # gen_feature writes python bools as int64 (newer protobuf wants them as int)
+  row = dict((key, int(value) if isinstance(value, (bool, np.bool_)) else value) for key, value in row.items())
+  return tf.train.Example(features=tf.train.Features(feature=melt.gen_features(row)))
+
+def test_same_as_gen_features():
+  df = pd.DataFrame({'id': [3, -1, 2 ** 40], 'score': [0.5, -1.25, 3.], 'name': ['a', '中文', ''],
+                     'flag': [True, False, True]})
+  examples = columnar.serialize_examples(columnar.df_to_columns(df))
+  for example, row in zip(examples, df.itertuples(index=False)):
+    assert _parse(example) == _expected(row._asdict())
+
+def test_bool_column_as_int64():
+  for column in [np.array([True, False]), np.array([True, False], dtype=object),
+                 pd.Series([True, False], dtype='boolean').values]:
+    values, dtype = columnar.to_ragged(column)
+    assert dtype == columnar.INT64 and values.data.tolist() == [1, 0]
+  example = columnar.serialize_examples({'flag': [True]})[0]
+  assert _parse(example) == _expected({'flag': True})
+
+def test_var_len_rows():
+  # empty rows are [0], a column of floats stays float (gen_features sniffs each row)
+  columns = {'ids': [[1, 2, 3], [], [4]], 'vals': [[0.5], [1., 2.], [3.]]}
+  examples = columnar.serialize_examples(columns)
+  for i, example in enumerate(examples):
+    assert _parse(example) == _expected({'ids': columns['ids'][i], 'vals': columns['vals'][i]})
+
+def test_empty():
+  assert columnar.serialize_examples({'a': np.zeros(0), 'b': np.zeros((0, 2), dtype=np.int64)}) == []
+  df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y'], 'c': [True, False]}).iloc[:0]
+  assert columnar.serialize_examples(columnar.df_to_columns(df)) == []
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   gen_records.py
+#        \author   chenghuige
+#          \date   2021-10-13 09:12:51.104326
+#   \Description   Sharded, multi process tfrecord generation driver
+#                  project scripts only supply row -> feature function
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import tempfile
+import traceback
+import multiprocessing
+from multiprocessing import cpu_count
+
+import numpy as np
+
+import gezi
+from gezi import tqdm
+import melt
+
+class SharedTables(object):
+  """
+  Read only lookup tables shared by all worker processes.
+  Each table is saved once as .npy (under /dev/shm if exists) and memory-mapped lazily in each process,
+  so workers share the same physical pages instead of copy on write python objects.
+  """
+  def __init__(self, dir=None):
+    if dir is None:
+      root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+      dir = tempfile.mkdtemp(prefix='melt_tables_', dir=root)
+      self.owned = True
+    else:
+      os.makedirs(dir, exist_ok=True)
+      self.owned = False
+    self.dir = dir
+    self.names = set()
+    self.cache = {}
+
+  def path(self, name):
+    return f'{self.dir}/{name}.npy'
+
+  def add(self, name, arr):
+    ofile = self.path(name)
+    np.save(ofile + '.tmp.npy', np.ascontiguousarray(arr))
+    os.replace(ofile + '.tmp.npy', ofile)
+    self.names.add(name)
+    self.cache.pop(name, None)
+    return self[name]
+
+  def __setitem__(self, name, arr):
+    self.add(name, arr)
+
+  def __getitem__(self, name):
+    if name not in self.cache:
+      self.cache[name] = np.load(self.path(name), mmap_mode='r')
+    return self.cache[name]
+
+  def __contains__(self, name):
+    return name in self.names or os.path.exists(self.path(name))
+
+  def close(self):
+    self.cache = {}
+    if self.owned:
+      for name in self.names:
+        gezi.try_remove(self.path(name))
+      try:
+        os.rmdir(self.dir)
+      except Exception:
+        pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+def _build_shard(index):
+  # data and functions are inherited by fork not pickled
+  ctx = gezi.fork_ctx()
+  out_dir = ctx['out_dir']
+  ofile = f'{out_dir}/{index}.{ctx["format"]}'
+  start, end = gezi.get_fold(ctx['total'], ctx['num_shards'], index)
+  counter = ctx['counter']
+  num_done = 0
+  num_records = 0
+  try:
+    with melt.tfrecords.Writer(ofile, format=ctx['format'], buffer_size=ctx['buffer_size'],
+                               shuffle=ctx['shuffle'], seed=ctx['seed'] + index if ctx['seed'] is not None else None) as writer:
+      data = ctx['data']
+      if ctx['batch_fn'] is not None:
+        # columnar fast path, batch_fn(data_slice) -> dict of columns
+        batch_size = ctx['batch_size']
+        for i in range(start, end, batch_size):
+          end_ = min(i + batch_size, end)
+          columns = ctx['batch_fn'](_slice(data, i, end_))
+          if columns:
+            writer.write_columns(columns, ctx['schema'])
+          with counter.get_lock():
+            counter.value += end_ - i
+      elif ctx['chunk_fn'] is not None:
+        # chunk_fn(data_slice) -> iterable of feature dicts, for batch lookups shared by rows of the chunk
+        batch_size = ctx['batch_size']
+        for i in range(start, end, batch_size):
+          end_ = min(i + batch_size, end)
+          for fe in ctx['chunk_fn'](_slice(data, i, end_)):
+            if fe is not None:
+              writer.write_feature(fe)
+          with counter.get_lock():
+            counter.value += end_ - i
+      else:
+        rows = _iter_rows(data, start, end) if data is not None else range(start, end)
+        for row in rows:
+          fe = ctx['row_fn'](row)
+          num_done += 1
+          if fe is not None:
+            writer.write_feature(fe)
+          if num_done % 1000 == 0:
+            with counter.get_lock():
+              counter.value += 1000
+        with counter.get_lock():
+          counter.value += num_done % 1000
+      # Writer.close resets count
+      num_records = writer.num_records
+  except Exception:
+    print(traceback.format_exc(), file=sys.stderr)
+    raise
+  return index, num_records
+
+
+def _slice(data, start, end):
+  if hasattr(data, 'iloc'):
+    return data.iloc[start:end]
+  return data[start:end]
+
+
+def _iter_rows(data, start, end):
+  if hasattr(data, 'itertuples'):
+    for row in data.iloc[start:end].itertuples():
+      yield row._asdict()
+  else:
+    for i in range(start, end):
+      yield data[i]
+
+
+def write_num_records(out_dir, num_records):
+  ofile = f'{out_dir}/num_records.txt'
+  with open(ofile + '.tmp', 'w') as f:
+    print(num_records, file=f)
+  os.replace(ofile + '.tmp', ofile)
+
+
+def gen_records(out_dir, row_fn=None, data=None, total=None, num_shards=None, num_workers=None,
+                batch_fn=None, chunk_fn=None, batch_size=1000, schema=None, buffer_size=None, shuffle=False,
+                seed=None, format='tfrec', index=None, clear_first=False):
+  """
+  Split data (DataFrame, list, or just range(total)) to num_shards contiguous shards by gezi.get_fold,
+  each shard is written by one worker process as <out_dir>/<index>.<count>.<format>
+  (written to .TMP first, renamed on close), at last write <out_dir>/num_records.txt
+
+  row_fn: row -> feature dict or None(skip), DataFrame row as dict, list item or int index if no data
+  batch_fn: data slice -> dict of columns, written by Writer.write_columns, faster than row_fn
+  chunk_fn: data slice -> iterable of feature dicts (None to skip), slices are batch_size rows
+  index: only build this shard in current process, for debug or external scheduling
+  Large read only lookups should be put in SharedTables (memory-mapped) instead of python dicts,
+  all other globals are inherited by fork.
+  Returns total number of records written.
+  """
+  assert row_fn is not None or batch_fn is not None or chunk_fn is not None
+  if total is None:
+    total = len(data)
+  num_shards = num_shards or cpu_count()
+  num_workers = max(min(num_workers or cpu_count(), num_shards), 1)
+  os.makedirs(out_dir, exist_ok=True)
+  if clear_first:
+    for file in gezi.list_files(f'{out_dir}/*.{format}'):
+      gezi.try_remove(file)
+
+  ctx = dict(out_dir=out_dir, row_fn=row_fn, batch_fn=batch_fn, chunk_fn=chunk_fn, batch_size=batch_size, schema=schema,
+             data=data, total=total, num_shards=num_shards, buffer_size=buffer_size, shuffle=shuffle,
+             seed=seed, format=format, counter=multiprocessing.Value('l', 0))
+
+  if index is not None:
+    _, num_records = list(gezi.fork_map(_build_shard, [index], ctx, 1))[0]
+    return num_records
+
+  counts = [0] * num_shards
+  counter = ctx['counter']
+  t = tqdm(total=total, desc=f'gen_records:{os.path.basename(out_dir)}')
+  def _update():
+    t.update(counter.value - t.n)
+  for i, count in gezi.fork_map(_build_shard, range(num_shards), ctx, num_workers, ordered=False, on_wait=_update):
+    counts[i] = count
+    _update()
+  t.close()
+
+  num_records = sum(counts)
+  write_num_records(out_dir, num_records)
+  return num_records
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ==============================================================================
+#          \file   gen_records_test.py
+#        \author   chenghuige
+#          \date   2021-10-20 10:32:17.402135
+#   \Description   python -m pytest melt/tfrecords/gen_records_test.py
+# ==============================================================================
+
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+import gezi
+import melt
+from melt.tfrecords.gen_records import gen_records
+
+def _read_ids(out_dir):
+  res = {}
+  for file in gezi.list_files(f'{out_dir}/*.tfrec'):
+    shard = int(file.split('/')[-1].split('.')[0])
+    res[shard] = [tf.train.Example.FromString(x.numpy()).features.feature['id'].int64_list.value[0]
+                  for x in tf.data.TFRecordDataset(file)]
+  return res
+
+def _gen(out_dir, seed):
+  return gen_records(str(out_dir), lambda i: {'id': i}, total=200, num_shards=2, num_workers=1,
+                     buffer_size=1000, shuffle=True, seed=seed)
+
+def test_seed_zero_same_order(tmp_path):
+  assert _gen(tmp_path / 'a', 0) == 200
+  assert _gen(tmp_path / 'b', 0) == 200
+  a, b = _read_ids(tmp_path / 'a'), _read_ids(tmp_path / 'b')
+  assert a == b
+  # shuffled, shard 0 is rows [0, 100)
+  assert a[0] != list(range(100)) and sorted(a[0]) == list(range(100))
+  # other seed, other order
+  _gen(tmp_path / 'c', 1)
+  assert _read_ids(tmp_path / 'c') != a
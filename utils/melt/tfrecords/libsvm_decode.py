@@ -11,6 +11,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import numpy as np
+from numba import njit
 import tensorflow as tf
 
 #notice heare use parse_example not parse single example for it
@@ -36,3 +38,146 @@ def decode(batch_serialized_examples, label_type=tf.int64, index_type=tf.int64,
   #return as X,y
   print(index, value)
   return (index, value), label
+
+
+@njit
+def _parse_int(buf, i, end):
+  neg = False
+  if i < end and buf[i] == 45: # -
+    neg = True
+    i += 1
+  x = 0
+  start = i
+  while i < end and buf[i] >= 48 and buf[i] <= 57:
+    x = x * 10 + (buf[i] - 48)
+    i += 1
+  return -x if neg else x, i, i > start
+
+
+@njit
+def _match(buf, i, end, word):
+  # case insensitive ascii letters
+  if end - i < len(word):
+    return False
+  for j in range(len(word)):
+    if buf[i + j] | 32 != word[j]:
+      return False
+  return True
+
+_NAN = np.frombuffer(b'nan', dtype=np.uint8)
+_INF = np.frombuffer(b'inf', dtype=np.uint8)
+_INFINITY = np.frombuffer(b'infinity', dtype=np.uint8)
+
+@njit
+def _parse_float(buf, i, end):
+  """as float(): [+-] digits [. digits] [e [+-] digits] or nan, inf, infinity, returns (x, next i, ok)"""
+  neg = False
+  if i < end and (buf[i] == 45 or buf[i] == 43): # - +
+    neg = buf[i] == 45
+    i += 1
+  if _match(buf, i, end, _INFINITY):
+    return -np.inf if neg else np.inf, i + len(_INFINITY), True
+  if _match(buf, i, end, _INF):
+    return -np.inf if neg else np.inf, i + len(_INF), True
+  if _match(buf, i, end, _NAN):
+    return np.nan, i + len(_NAN), True
+  mant = 0.
+  digits = 0
+  while i < end and buf[i] >= 48 and buf[i] <= 57:
+    mant = mant * 10. + (buf[i] - 48)
+    digits += 1
+    i += 1
+  scale = 0
+  if i < end and buf[i] == 46: # .
+    i += 1
+    while i < end and buf[i] >= 48 and buf[i] <= 57:
+      mant = mant * 10. + (buf[i] - 48)
+      digits += 1
+      scale -= 1
+      i += 1
+  ok = digits > 0
+  if ok and i < end and (buf[i] == 101 or buf[i] == 69): # e E
+    i += 1
+    if i < end and buf[i] == 43:
+      i += 1
+    exp, i, ok = _parse_int(buf, i, end)
+    scale += exp
+  x = mant * 10. ** scale if scale >= 0 else mant / 10. ** (-scale)
+  return -x if neg else x, i, ok
+
+
+@njit
+def _parse_features(buf, starts, ends, max_len, out_index, out_value, lengths, errors):
+  for r in range(len(starts)):
+    i, end = starts[r], ends[r]
+    k = 0
+    while i < end and k < max_len:
+      # token id:value, tokens split by tab (or space)
+      while i < end and (buf[i] == 9 or buf[i] == 32 or buf[i] == 10 or buf[i] == 13):
+        i += 1
+      if i == end:
+        break
+      out_index[r, k], i, ok = _parse_int(buf, i, end)
+      if ok and i < end and buf[i] == 58: # :
+        out_value[r, k], i, ok = _parse_float(buf, i + 1, end)
+        if not ok:
+          out_value[r, k] = 0.
+      else:
+        # no value, id:value split would fail
+        out_value[r, k] = 1.
+        ok = False
+      # fields after a second : are ignored as by split(':'), anything else before the delimiter is malformed
+      if ok and i < end and buf[i] == 58:
+        while i < end and buf[i] != 9 and buf[i] != 32 and buf[i] != 10 and buf[i] != 13:
+          i += 1
+      while i < end and buf[i] != 9 and buf[i] != 32 and buf[i] != 10 and buf[i] != 13:
+        ok = False
+        i += 1
+      if not ok:
+        errors[r] += 1
+      k += 1
+    lengths[r] = k
+
+
+def parse_lines(lines, num_heads=0, max_len=1000, field_of=None, batch_size=None, strict=True):
+  """
+  Parse a batch of libsvm like lines in one call
+    head_0 \t ... head_{num_heads - 1} \t id:value \t id:value ...
+  lines: list of bytes or str (tf TextLineDataset batch gives bytes)
+  field_of: dense int array, field_of[id] is field of feature id (0 if id out of range), instead of dict lookups
+  batch_size: pad rows to batch_size (empty rows, heads '')
+  strict: raise ValueError on malformed id:value tokens (as int()/float() did), else they are kept
+    (bad id as parsed, bad value 0) and counted in errors. Values also take nan, inf, infinity.
+  Returns dict of index [n, l] int64, field [n, l] int64 (if field_of not None), value [n, l] float32, 
+    lengths [n], errors [n] malformed tokens, heads list of num_heads lists of str, l is max length of this batch (<= max_len)
+  """
+  num_rows = len(lines)
+  batch_size = max(batch_size or num_rows, num_rows)
+  heads = [[''] * batch_size for _ in range(num_heads)]
+  tails = [None] * num_rows
+  for i, line in enumerate(lines):
+    if isinstance(line, str):
+      line = line.encode('utf-8')
+    fields = line.split(b'\t', num_heads)
+    for j in range(min(num_heads, len(fields))):
+      heads[j][i] = fields[j].decode('utf-8')
+    tails[i] = fields[num_heads] if len(fields) > num_heads else b''
+  buf = np.frombuffer(b'\t'.join(tails) if tails else b'', dtype=np.uint8)
+  lens = np.asarray([len(x) for x in tails], dtype=np.int64)
+  # tails joined by one tab
+  ends = np.cumsum(lens + 1) - 1
+  starts = ends - lens
+  index = np.zeros((batch_size, max_len), dtype=np.int64)
+  value = np.zeros((batch_size, max_len), dtype=np.float32)
+  lengths = np.zeros(batch_size, dtype=np.int64)
+  errors = np.zeros(batch_size, dtype=np.int64)
+  _parse_features(buf, starts, ends, max_len, index, value, lengths, errors)
+  if strict and errors.any():
+    row = int(np.flatnonzero(errors)[0])
+    raise ValueError(f'malformed id:value in line {row}: {tails[row][:200]!r}')
+  cur_len = int(lengths.max()) if batch_size else 0
+  res = {'index': index[:, :cur_len], 'value': value[:, :cur_len], 'lengths': lengths, 'errors': errors, 'heads': heads}
+  if field_of is not None:
+    index = res['index']
+    res['field'] = np.asarray(field_of).take(index, mode='clip') * ((index >= 0) & (index < len(field_of)))
+  return res
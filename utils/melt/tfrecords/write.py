@@ -18,7 +18,11 @@ import numpy as np
 import tensorflow as tf
 import gezi
 import melt
+from melt.tfrecords import columnar
  
+def _serialize(example):
+  return example if isinstance(example, bytes) else example.SerializeToString()
+
 class Writer(object):
   def __init__(self, filename, format='tfrec', buffer_size=None, 
                shuffle=True, seed=None, clear_first=False):
@@ -27,7 +31,7 @@ class Writer(object):
     = 0 means buffersize large engouh, only output at last 
     oterwise output when buffer full
     '''
-    if seed:
+    if seed is not None:
       random.seed(seed)
     self.count = 0
     self.buffer_size = buffer_size
@@ -72,7 +76,7 @@ class Writer(object):
         if self.shuffle:
           random.shuffle(self.buffer)
         for example in self.buffer:
-          self.writer.write(example.SerializeToString())
+          self.writer.write(_serialize(example))
         self.buffer = []  
         self.sort_vals = []
 
@@ -100,6 +104,20 @@ class Writer(object):
     else:
       self.write_example(example, feature[sort_key])
 
+  def write_columns(self, columns, schema=None, sort_key=None):
+    """
+    Bulk version of write_feature, columns is a dict of numpy arrays (or list of lists for var len features)
+    each with one row per example, see melt.tfrecords.columnar.encode_examples
+    schema: dict of key -> 'int64' | 'float' | 'bytes', infer by column dtype if not set
+    """
+    examples = columnar.serialize_examples(columns, schema)
+    sort_vals = columns[sort_key] if sort_key is not None else [None] * len(examples)
+    for example, sort_val in zip(examples, sort_vals):
+      self.write_example(example, sort_val)
+
+  def write_df(self, df, schema=None, keys=None, sort_key=None):
+    self.write_columns(columnar.df_to_columns(df, keys), schema, sort_key)
+
   def write_example(self, example, sort_val=None):
     self.count += 1
     if self.buffer is not None:
@@ -115,10 +133,10 @@ class Writer(object):
         elif self.shuffle: # if sort_vals not do shuffle anymore
           random.shuffle(self.buffer)
         for example in self.buffer:
-          self.writer.write(example.SerializeToString())
+          self.writer.write(_serialize(example))
         self.buffer = []
     else:
-      self.writer.write(example.SerializeToString())
+      self.writer.write(_serialize(example))
 
   def size(self):
     return self.count